@@ -0,0 +1,259 @@
+'''
+Micro-benchmarks for the interpreter - run as `python bench.py <benchmark>`
+'''
+import io
+import os
+import sys
+import tempfile
+import time
+
+from interpreter import Interpreter, Limits, Scanner, load_program
+from interpreter import EndProcValue, IntegerValue, NameValue, RealValue, SourceMap, StartProcValue, StringValue
+
+LEGACY_DELIMITERS = {
+    '(',
+    ')',
+    '<',
+    '>',
+    '[',
+    ']',
+    '{',
+    '}',
+    '/',
+    '%',
+}
+
+class LegacyScanner:
+    '''
+    The original line-splitting scanner, kept only as a baseline for the scanner benchmark
+    '''
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __iter__(self):
+        source = SourceMap()
+        for line_no, line in enumerate(self.lines, start=1):
+            line = line.rstrip()
+
+            tag = None
+            args = None
+
+            if (idx := line.find('%')) != -1:
+                comment = line[idx+1:]
+                line = line[:idx]
+
+                while len(comment) > 0 and comment[0].isspace():
+                    comment = comment[1:]
+
+                if comment.startswith('tag '):
+                    tag = comment.removeprefix('tag ')
+                if comment.startswith('args '):
+                    args = comment.removeprefix('args ').split(' ')
+
+            col_no = 1
+
+            while True:
+                stripped = line.lstrip()
+                col_no += len(line) - len(stripped)
+                line = stripped
+                if line == '':
+                    break
+
+                if line.startswith('/'):
+                    idx = 1
+                    while idx < len(line) and not line[idx].isspace() and not line[idx] in LEGACY_DELIMITERS:
+                        idx += 1
+                    yield NameValue(value=line[1:idx], source=source, line=line_no, column=col_no, length=idx, tag=tag)
+                    line = line[idx:]
+                    col_no += idx
+                elif line[0] == '{':
+                    assert len(line) == 1 or line[1].isspace()
+                    yield StartProcValue(source=source, line=line_no, column=col_no, length=1, tag=tag, args=args)
+                    line = line[1:]
+                    col_no += 1
+                elif line[0] == '}':
+                    assert len(line) == 1 or line[1].isspace()
+                    yield EndProcValue(source=source, line=line_no, column=col_no, length=1, tag=tag)
+                    line = line[1:]
+                    col_no += 1
+                elif line[0].isalpha():
+                    idx = 1
+                    while idx < len(line) and line[idx].isalpha():
+                        idx += 1
+                    yield NameValue(value=line[:idx], source=source, line=line_no, column=col_no, length=idx, tag=tag, executable=True)
+                    line = line[idx:]
+                    col_no += idx
+                elif (line[0] == '-' and line[1].isdigit()) or line[0].isdigit():
+                    idx = 1
+                    while idx < len(line) and (line[idx].isdigit() or line[idx] == '.'):
+                        idx += 1
+                    if '.' in line[:idx]:
+                        yield RealValue(value=float(line[:idx]), source=source, line=line_no, column=col_no, length=idx, tag=tag)
+                    else:
+                        yield IntegerValue(value=int(line[:idx]), source=source, line=line_no, column=col_no, length=idx, tag=tag)
+                    line = line[idx:]
+                    col_no += idx
+                elif line[0] == '(':
+                    idx = line.index(')')
+                    yield StringValue(value=line[1:idx], source=source, line=line_no, column=col_no, length=idx+1, tag=tag)
+                    line = line[idx+1:]
+                    col_no += idx + 1
+                elif line[0] == '=':
+                    assert len(line) == 1 or line[1].isspace()
+                    yield NameValue(value='=', source=source, line=line_no, column=col_no, length=1, tag=tag, executable=True)
+                    line = line[1:]
+                    col_no += 1
+                elif line[0:2] == '<<':
+                    assert len(line) == 2 or line[2].isspace()
+                    yield NameValue(value='<<', source=source, line=line_no, column=col_no, length=2, tag=tag, executable=True)
+                    line = line[2:]
+                    col_no += 2
+                elif line[0:2] == '>>':
+                    assert len(line) == 2 or line[2].isspace()
+                    yield NameValue(value='>>', source=source, line=line_no, column=col_no, length=2, tag=tag, executable=True)
+                    line = line[2:]
+                    col_no += 2
+                elif line[0] == '[':
+                    assert len(line) == 1 or line[1].isspace()
+                    yield NameValue(value='[', source=source, line=line_no, column=col_no, length=1, tag=tag, executable=True)
+                    line = line[1:]
+                    col_no += 1
+                elif line[0] == ']':
+                    assert len(line) == 1 or line[1].isspace()
+                    yield NameValue(value=']', source=source, line=line_no, column=col_no, length=1, tag=tag, executable=True)
+                    line = line[1:]
+                    col_no += 1
+                else:
+                    raise NotImplementedError(f"can't handle rest of line {line!r}")
+
+def time_run(program, i=None):
+    if i is None:
+        i = Interpreter()
+        i.print = lambda _: None
+
+    start = time.perf_counter()
+    i.run(Scanner(io.StringIO(program)))
+    return time.perf_counter() - start
+
+def bench_stack_depth():
+    '''
+    Per-step cost of a fixed workload with increasingly many values left sitting on the operand
+    stack underneath it - this should stay flat
+    '''
+    steps = 20_000
+    workload = '1 2 add pop\n' * (steps // 4)
+
+    print(f'{"stack depth":>12} {"ns/step":>10}')
+    for depth in (0, 1_000, 10_000, 100_000):
+        i = Interpreter()
+        time_run(f'1 1 {depth} {{ }} for', i)
+        assert len(i.operand_stack) == depth
+
+        elapsed = time_run(workload, i)
+        print(f'{depth:>12} {elapsed / steps * 1e9:>10.0f}')
+
+def bench_scanner():
+    '''
+    Tokens per second (best of five) scanning a few megabytes of generated PostScript, from a
+    string and from a memory-mapped file, against the original line-splitting scanner
+    '''
+    line = '/box { newpath 0 0 moveto 10.5 0 rlineto (label) show } def 1 2 add %tag sum\n'
+    program = line * 40_000
+
+    def scan(make_scanner, repeat=5):
+        # best of a few, since one run is at the mercy of whatever else the machine is doing
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            count = sum(1 for _ in make_scanner())
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return count, best
+
+    with tempfile.NamedTemporaryFile('w', suffix='.ps') as f:
+        f.write(program)
+        f.flush()
+
+        print(f'{"source":>8} {"MB":>6} {"tokens/s":>12}')
+        sources = (
+            ('legacy', lambda: LegacyScanner(io.StringIO(program))),
+            ('string', lambda: Scanner(program)),
+            ('mmap', lambda: Scanner(open(f.name, 'rb'))),
+        )
+        for label, scanner in sources:
+            count, elapsed = scan(scanner)
+            print(f'{label:>8} {len(program) / 1e6:>6.1f} {count / elapsed:>12,.0f}')
+
+def bench_cache():
+    '''
+    Time to load a few megabytes of generated PostScript by scanning it, and from its cache file
+    '''
+    line = '/box { newpath 0 0 moveto 10.5 0 rlineto (label) show } def 1 2 add %tag sum\n'
+    program = line * 40_000
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'program.ps')
+        with open(filename, 'w') as f:
+            f.write(program)
+
+        print(f'{"load":>8} {"seconds":>8}')
+        for label, use_cache in (('scan', False), ('build', True), ('cached', True)):
+            start = time.perf_counter()
+            load_program(filename, use_cache=use_cache)
+            print(f'{label:>8} {time.perf_counter() - start:>8.2f}')
+
+def bench_dict_depth():
+    '''
+    Per-step cost of a loop that looks up names defined at the bottom of the dictionary stack,
+    with increasingly many dictionaries begun on top of them - this should stay flat
+    '''
+    steps = 20_000
+    iterations = steps // 5
+
+    print(f'{"dict depth":>12} {"ns/step":>10}')
+    for depth in (0, 10, 100, 1_000):
+        i = Interpreter()
+        time_run('/x 1 def /y 2 def ' + '0 dict begin ' * depth, i)
+        assert len(i.dictionary_stack.maps) == depth + 2
+
+        elapsed = time_run(f'1 1 {iterations} {{ pop x y add pop }} for', i)
+        print(f'{depth:>12} {elapsed / steps * 1e9:>10.0f}')
+
+def bench_limits():
+    '''
+    Time (best of five) to run a few loops with no limits and with every limit set - the limits
+    cost a few comparisons a step, and the operation count and clock less than that
+    '''
+    programs = (
+        ('pop', '1 1 300000 { pop } for'),
+        ('arith', '0 1 1 100000 { 2 mul add 3 sub } for pop'),
+        ('calls', '/f { 1 add } def 0 1 1 100000 { pop f } for pop'),
+    )
+    huge = 10**12
+    every_limit = Limits(max_operations=huge, max_operand_stack=huge, max_execution_stack=huge, max_allocated=huge, time_limit=huge)
+
+    def best(program, limits, repeat=5):
+        elapsed = []
+        for _ in range(repeat):
+            i = Interpreter(limits=limits)
+            i.print = lambda _: None
+            elapsed.append(time_run(program, i))
+        return min(elapsed)
+
+    print(f'{"program":>8} {"no limits":>10} {"limits":>10}')
+    for label, program in programs:
+        print(f'{label:>8} {best(program, None) * 1e3:>8.0f}ms {best(program, every_limit) * 1e3:>8.0f}ms')
+
+BENCHMARKS = {
+    'stack-depth': bench_stack_depth,
+    'dict-depth': bench_dict_depth,
+    'scanner': bench_scanner,
+    'cache': bench_cache,
+    'limits': bench_limits,
+}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f'# {name}')
+        BENCHMARKS[name]()
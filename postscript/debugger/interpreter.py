@@ -1,31 +1,240 @@
-from collections import deque, ChainMap
-from dataclasses import dataclass
+from array import array
+import base64
+from collections import Counter, deque, ChainMap
+import dataclasses
+from dataclasses import dataclass, field, InitVar
 import functools
+import gc
+import hashlib
 import inspect
 import itertools
+import marshal
+import math
+import mmap
+import operator
+import os
+import re
+import struct
+import threading
+import time
 
 import types
 import typing
-from typing import Optional, Self
+import weakref
+import zlib
+from typing import Optional
 
 class Frame:
     '''
     A stack frame on the execution stack
+
+    The interpreter's dispatch loop repeatedly calls next_word on the topmost frame; frames
+    that call into other code (procedures, loop bodies) just push a new frame on top of
+    themselves, so no Python recursion is involved and a step costs the same no matter
+    how deep the PostScript call chain is.
+    '''
+    def next_word(self, i):
+        '''
+        Return the next word to execute, or None if the frame on top of the execution
+        stack is done and should be popped
+        '''
+        raise NotImplementedError(f'next_word not implemented for type {type(self)}')
+
+    def leave(self, i):
+        '''
+        Called when this frame is popped off the execution stack
+        '''
+        pass
+
+class ProgramFrame(Frame):
+    '''
+    A frame for a top-level program, which is a stream of assembled words (see
+    Interpreter.assemble)
     '''
     def __init__(self, program):
         self.program = iter(program)
+        # the word we returned last, so the debugger can tell it apart from the last word of a
+        # procedure we called (which has already popped its frame)
+        self.word = None
 
-@dataclass(eq=False)
+    def next_word(self, i):
+        self.word = word = next(self.program, None)
+        return word
+
+class ProcFrame(Frame):
+    '''
+    A frame for a call to an executable array
+    '''
+    def __init__(self, proc, restore_tags=None):
+        self.proc = proc
+        self.words = proc.value
+        self.pc = 0
+        self.restore_tags = restore_tags
+
+    def next_word(self, i):
+        pc = self.pc
+        if pc == len(self.words):
+            return None
+        self.pc = pc + 1
+
+        # tail call - if this is our last word and we have nothing to clean up, pop ourselves
+        # now so that anything the word calls replaces this frame rather than nesting on it
+        if pc + 1 == len(self.words) and self.restore_tags is None:
+            i.execution_stack.pop()
+
+        return self.words[pc]
+
+    def leave(self, i):
+        if self.restore_tags:
+            i.operand_stack.restore_tags(self.restore_tags)
+
+class ForFrame(Frame):
+    '''
+    A frame for a running `for` loop - each time it comes up it pushes the control variable
+    and a frame for the loop body
+    '''
+    def __init__(self, init, incr, limit, proc):
+        self.current = init
+        self.incr = incr
+        self.limit = limit
+        self.proc = proc
+
+    def next_word(self, i):
+        while True:
+            current = self.current
+            if (current > self.limit) if self.incr >= 0 else (current < self.limit):
+                return None
+            self.current = current + self.incr
+
+            i.operand_stack.append(integer_value(current))
+
+            self.proc.execute(i, direct=False)
+            # if the body didn't push a frame (eg. it was compiled, or a literal), it's already
+            # done and we can move on to the next iteration - unless there are limits, which
+            # need the dispatch loop to see every iteration
+            if i.execution_stack[-1] is not self:
+                return i.execution_stack[-1].next_word(i)
+            if i.limits is not None:
+                return NO_OPERATION
+
+class SourceMap:
+    '''
+    Source locations for the tokens of one program, stored once in parallel arrays indexed by
+    token id - values carry their program's map and their token id in it, so the map lives
+    exactly as long as something from the program does, and values created at runtime don't
+    carry any location at all
+    '''
+    def __init__(self):
+        self.lines = array('I')
+        self.columns = array('I')
+        self.lengths = array('I')
+        # token id -> tag, for the few tokens that have a %tag
+        self.tags = {}
+        self.lock = threading.Lock()
+
+    def add(self, line, column, length):
+        with self.lock:
+            token = len(self.lines)
+            self.lines.append(line)
+            self.columns.append(column)
+            self.lengths.append(length)
+        return token
+
+    def extend(self, lines, columns, lengths):
+        '''
+        Add many locations at once, returning the token id of the first
+        '''
+        lines, columns, lengths = array('I', lines), array('I', columns), array('I', lengths)
+        assert len(lines) == len(columns) == len(lengths)
+        with self.lock:
+            first = len(self.lines)
+            self.lines.extend(lines)
+            self.columns.extend(columns)
+            self.lengths.extend(lengths)
+        return first
+
+    def location(self, token):
+        return self.lines[token], self.columns[token], self.lengths[token]
+
+class Symbol:
+    '''
+    A name, interned in symbols - dictionaries are keyed by these rather than by the name's text,
+    and they hash and compare by identity, so looking a name up costs the same however long it is
+    '''
+    __slots__ = ('name', '__weakref__')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f'Symbol({self.name!r})'
+
+class SymbolTable:
+    '''
+    Every name in use, interned as a Symbol - names carry their symbol (see NameValue.symbol),
+    and dictionaries are keyed by it, so looking a name up is an identity hash and comparison,
+    and each distinct name's text is only stored once.
+
+    There's one of these per process, so that a program's words mean the same in any interpreter
+    that runs them, but it only holds its symbols weakly: a symbol lasts as long as a name or a
+    dictionary key that uses it does, and once the programs and interpreters using a name have
+    gone, so has its symbol.
+    '''
+    def __init__(self):
+        # name text -> Symbol
+        self.by_name = weakref.WeakValueDictionary()
+        self.lock = threading.Lock()
+
+    def intern(self, name):
+        symbol = self.by_name.get(name)
+        if symbol is None:
+            with self.lock:
+                symbol = self.by_name.get(name)
+                if symbol is None:
+                    symbol = self.by_name[name] = Symbol(name)
+        return symbol
+
+    def name(self, symbol):
+        return symbol.name
+
+    def __len__(self):
+        return len(self.by_name)
+
+symbols = SymbolTable()
+
+class _AllocationHook(threading.local):
+    # if set, called with every Value created on this thread (see MemoryTracker)
+    hook = None
+
+allocation_hook = _AllocationHook()
+
+@dataclass(eq=False, slots=True)
 class Value:
     value: any # please override this in subclasses
 
     executable: bool = False
-    line: Optional[int] = None
-    column: Optional[int] = None
-    length: Optional[int] = None
-
-    tag: Optional[str] = None
-    predecessor: Optional[Self] = None
+    token: Optional[int] = None
+    # the SourceMap token is an id in
+    source: Optional[SourceMap] = field(default=None, repr=False)
+
+    # source tags and locations live in source - these are accepted for convenience when
+    # constructing values (without a source, the value gets a map of its own), and read back via
+    # the properties attached below
+    tag: InitVar[Optional[str]] = None
+    line: InitVar[Optional[int]] = None
+    column: InitVar[Optional[int]] = None
+    length: InitVar[Optional[int]] = None
+
+    def __post_init__(self, tag, line, column, length):
+        if line is not None:
+            if self.source is None:
+                self.source = SourceMap()
+            self.token = self.source.add(line, column, length)
+        if tag is not None and self.token is not None:
+            self.source.tags[self.token] = tag
+        hook = allocation_hook.hook
+        if hook is not None:
+            hook(self)
 
     def execute(self, i, direct):
         # XXX this should probably just be `i.operand_stack.append(self)` and subclasses that actually
@@ -46,7 +255,23 @@ class Value:
     def __hash__(self):
         return hash(self.value)
 
-@dataclass(eq=False)
+# these can't be defined in the class body, since the names are taken by the InitVars there
+Value.line = property(lambda self: None if self.token is None else self.source.lines[self.token])
+Value.column = property(lambda self: None if self.token is None else self.source.columns[self.token])
+Value.length = property(lambda self: None if self.token is None else self.source.lengths[self.token])
+
+def _set_tag(self, tag):
+    assert self.token is not None, 'only values from the program text can have a %tag'
+    if tag is None:
+        self.source.tags.pop(self.token, None)
+    else:
+        self.source.tags[self.token] = tag
+
+# the %tag a value was written with - tags that procedure %args give operands are tracked per
+# stack slot by TaggedOperandStack instead
+Value.tag = property(lambda self: None if self.token is None else self.source.tags.get(self.token), _set_tag)
+
+@dataclass(eq=False, slots=True)
 class MarkValue(Value):
     value: any = None
     def execute(self, i, direct):
@@ -59,29 +284,55 @@ class MarkValue(Value):
     def __ps_repr__(self):
         return '-mark-'
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class NameValue(Value):
     value: str
 
+    # our Symbol in symbols
+    symbol: Symbol = field(init=False, repr=False)
+
+    # (dictionary stack version, what the name was bound to then, whether that's a Value) - see
+    # Interpreter.dictionary_version.  Versions are never reused, even between interpreters, so
+    # this can't be mistaken for another interpreter's lookup.  It's a single tuple so that it's
+    # replaced atomically if several threads are running the same program.
+    lookup_cache: tuple = field(default=(-1, None, False), repr=False)
+
     def execute(self, i, direct):
         if self.executable:
             # executing an executable name looks up the name in the dictionary and executes _that_
-            c = i.look_up(self.value)
-
-            # XXX is this how I want to dispatch on values vs functions implementing operators?
-            if hasattr(c, 'execute'):
-                return c.execute(i, direct=False)
+            version, c, is_value = self.lookup_cache
+            if version != i.dictionary_version:
+                version = i.dictionary_version
+                c = i.look_up(self.symbol)
+                # XXX is this how I want to dispatch on values vs functions implementing operators?
+                is_value = hasattr(c, 'execute')
+                self.lookup_cache = (version, c, is_value)
+
+            if is_value:
+                c.execute(i, direct=False)
             else:
-                return c(i)
+                c(i)
         else:
             # executing a literal name appends the name to the operand stack (XXX can I just append(self)?)
             # XXX I *think* it should be ok just to push ourselves onto the stack?
             i.operand_stack.append(self)
 
+    def __post_init__(self, tag, line, column, length):
+        self.symbol = symbol = symbols.intern(self.value)
+        # share the one copy of the name's text
+        self.value = symbol.name
+        Value.__post_init__(self, tag, line, column, length)
+
+    def __eq__(self, other):
+        return type(self) == type(other) and self.symbol == other.symbol
+
+    def __hash__(self):
+        return hash(self.symbol)
+
     def __ps_repr__(self):
         return '/' + self.value
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class StringValue(Value):
     value: str
 
@@ -91,40 +342,55 @@ class StringValue(Value):
     def __ps_repr__(self):
         return '(' + self.value + ')'
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class IntegerValue(Value):
     value: int
 
     def execute(self, i, direct):
         i.operand_stack.append(self)
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class RealValue(Value):
     value: float
 
     def execute(self, i, direct):
         i.operand_stack.append(self)
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class ArrayValue(Value):
     value: list[Value]
     args: list[str] = None
 
+    # JIT bookkeeping - how many times we've been called, and our compiled form once we're hot
+    calls: int = field(default=0, repr=False)
+    compiled: typing.Callable = field(default=None, repr=False)
+
     def execute(self, i, direct):
         if self.executable and not direct:
-            # executing an executable array…executes it
+            if i.jit_active and self.args is None:
+                compiled = self.compiled
+                if compiled is None:
+                    self.calls += 1
+                    if self.calls >= i.jit_threshold:
+                        compiled = self.compiled = compile_procedure(self)
+
+                # compiled procedures call each other with Python recursion, so past a certain
+                # depth we fall back to frames
+                if compiled is not None and i.jit_depth < MAX_JIT_DEPTH:
+                    i.jit_depth += 1
+                    try:
+                        compiled(i)
+                    finally:
+                        i.jit_depth -= 1
+                    return
+
+            # executing an executable array…executes it, by pushing a frame that the
+            # interpreter's dispatch loop picks up
             restore_tags = None
-            try:
-                if self.args:
-                    restore_tags = []
-                    for new_tag, value in zip(reversed(self.args), reversed(i.operand_stack)):
-                        restore_tags.append((value, value.tag))
-                        value.tag = new_tag
-                yield from i.execute(self)
-            finally:
-                if restore_tags:
-                    for v, old_tag in restore_tags:
-                        v.tag = old_tag
+            if self.args:
+                i.enable_tags()
+                restore_tags = i.operand_stack.retag(self.args)
+            i.execution_stack.append(ProcFrame(self, restore_tags))
         else:
             # executing a literal array just pushes it onto the stack
             # XXX I *think* it should be ok just to push ourselves onto the stack?
@@ -147,20 +413,52 @@ class ArrayValue(Value):
         return ' '.join(pieces)
 
 # XXX these two classes are kinda weird
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class StartProcValue(Value):
     value: any = None
     args: list[str] = None
 
-    def execute(self, i, direct):
-        # XXX I *think* it should be ok just to push ourselves onto the stack?
-        i.operand_stack.append(self)
-
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class EndProcValue(Value):
     value: any = None
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
+class OperatorValue(Value):
+    '''
+    A direct reference to an operator's implementation, which is what `bind` replaces
+    executable names with
+    '''
+    value: typing.Callable
+    name: str = None
+
+    def execute(self, i, direct):
+        self.value(i)
+
+    def __ps_str__(self):
+        return '--' + self.name + '--'
+
+    def __ps_repr__(self):
+        return self.__ps_str__()
+
+@dataclass(eq=False, slots=True)
+class SuperinstructionValue(Value):
+    '''
+    Several words fused into one by the optimizer - value holds the (bound) words it replaced,
+    and fn does the work of all of them at once
+    '''
+    value: tuple[Value, ...]
+    fn: typing.Callable = None
+
+    def execute(self, i, direct):
+        self.fn(i)
+
+    def __ps_str__(self):
+        return self.__ps_repr__()
+
+    def __ps_repr__(self):
+        return ' '.join(w.__ps_repr__() for w in self.value)
+
+@dataclass(eq=False, slots=True)
 class StubValue(Value):
     value: any = None
 
@@ -170,17 +468,41 @@ class StubValue(Value):
     def __ps_repr__(self):
         return '-stub-'
 
-@dataclass(eq=False)
+@dataclass(eq=False, slots=True)
 class DictionaryValue(Value):
-    value: dict[Value, Value]
+    # names (and strings) are keyed by their symbol, like the dictionary stack is, and anything
+    # else by its Value - see dictionary_key
+    value: dict[Symbol | Value, Value]
+
+    def execute(self, i, direct):
+        i.operand_stack.append(self)
 
     def __ps_str__(self):
         return '-dict-'
 
     def __ps_repr__(self):
-        return '<< ' + ' '.join(k.__ps_repr__() + ' ' + v.__ps_repr__() for k, v in self.value.items()) + ' >>'
+        return '<< ' + ' '.join(_key_repr(k) + ' ' + v.__ps_repr__() for k, v in self.value.items()) + ' >>'
 
-@dataclass(eq=False)
+def dictionary_key(v, define=False):
+    '''
+    The key v is stored under in a dictionary - in PostScript a name and a string with the same
+    text are the same key.
+
+    Only defining something under a string interns its text: a string whose text isn't in symbols
+    can't be a key anywhere yet, so looking it up uses the string itself, which matches nothing.
+    That way symbols only grows with the names a program is written with or defines, not with
+    every string it looks up.
+    '''
+    if isinstance(v, NameValue):
+        return v.symbol
+    if isinstance(v, StringValue):
+        return symbols.intern(v.value) if define else symbols.by_name.get(v.value, v)
+    return v
+
+def _key_repr(k):
+    return '/' + k.name if isinstance(k, Symbol) else k.__ps_repr__()
+
+@dataclass(eq=False, slots=True)
 class BooleanValue(Value):
     value: bool
 
@@ -193,6 +515,70 @@ class BooleanValue(Value):
     def __ps_repr__(self):
         return self.__ps_str__()
 
+# interned values for operators to push instead of allocating - these have no source location,
+# so they're never confused with scanned literals
+FALSE = BooleanValue(value=False)
+TRUE = BooleanValue(value=True)
+MARK = MarkValue()
+SMALL_INTEGERS = [ IntegerValue(value=n) for n in range(-128, 1024) ]
+# a word that does nothing, for frames that need to hand control back to the dispatch loop
+# without having anything to execute
+NO_OPERATION = OperatorValue(value=lambda i: None, name='(nothing)')
+
+def integer_value(n):
+    if -128 <= n < 1024:
+        return SMALL_INTEGERS[n + 128]
+    return IntegerValue(value=n)
+
+def number_value(n):
+    if isinstance(n, float):
+        return RealValue(value=n)
+    return integer_value(n)
+
+def boolean_value(b):
+    return TRUE if b else FALSE
+
+def _repr_pieces(v):
+    '''
+    The pieces of v's __ps_repr__, in order - containers yield theirs as they go rather than
+    building the whole string
+    '''
+    if isinstance(v, ArrayValue):
+        yield '{' if v.executable else '['
+        for w in v.value:
+            yield ' '
+            yield from _repr_pieces(w)
+        yield ' }' if v.executable else ' ]'
+    elif isinstance(v, DictionaryValue):
+        yield '<< '
+        for idx, (key, value) in enumerate(v.value.items()):
+            if idx:
+                yield ' '
+            if isinstance(key, Symbol):
+                yield _key_repr(key)
+            else:
+                yield from _repr_pieces(key)
+            yield ' '
+            yield from _repr_pieces(value)
+        yield ' >>'
+    else:
+        yield v.__ps_repr__()
+
+def truncated_repr(v, limit):
+    '''
+    v's __ps_repr__, cut short with … if it's longer than limit characters - only as much of
+    a big array or dictionary is looked at as fits, so showing one is as cheap as showing a
+    small one
+    '''
+    pieces = []
+    length = 0
+    for piece in _repr_pieces(v):
+        pieces.append(piece)
+        length += len(piece)
+        if length > limit:
+            return ''.join(pieces)[:limit - 1] + '…'
+    return ''.join(pieces)
+
 TYPE_MAPPING = {
     bool: BooleanValue,
     int: IntegerValue,
@@ -200,6 +586,54 @@ TYPE_MAPPING = {
     str: NameValue | StringValue,
 }
 
+@functools.cache
+def compile_signature(signature):
+    '''
+    Turn an operator signature (a tuple of annotations) into a tuple of (valid types, unwrap)
+    pairs, one per operand - this does all of the reflection up front so that checking
+    operands at call time is just isinstance calls
+    '''
+    compiled = []
+    for expected_type in signature:
+        if isinstance(expected_type, types.UnionType):
+            valid_types = typing.get_args(expected_type)
+        else:
+            valid_types = (expected_type,)
+
+        unwrap = not any(issubclass(t, Value) for t in valid_types)
+
+        if any(issubclass(t, Value) for t in valid_types):
+            assert all(issubclass(t, Value) for t in valid_types), 'if any of the types are Value subclasses, all of them must be'
+        else:
+            valid_types = tuple(itertools.chain.from_iterable(typing.get_args(TYPE_MAPPING[t]) if isinstance(TYPE_MAPPING[t], types.UnionType) else (TYPE_MAPPING[t],) for t in valid_types))
+
+        compiled.append((valid_types, unwrap))
+    return tuple(compiled)
+
+def _type_mismatch(arg, valid_types):
+    return f'got {type(arg).__name__}, expected any of {", ".join(t.__name__ for t in valid_types)}'
+
+def pop_operands(i, compiled_signature, arity):
+    '''
+    Check the top arity operands against compiled_signature and pop them, returning their
+    (possibly unwrapped) values in signature order
+    '''
+    stack = i.operand_stack
+    assert len(stack) >= arity, 'operand stack underflow'
+
+    args = [ stack[idx] for idx in range(-arity, 0) ]
+    retvals = []
+    for arg, (valid_types, unwrap) in zip(args, compiled_signature):
+        assert isinstance(arg, valid_types), _type_mismatch(arg, valid_types)
+        retvals.append(arg.value if unwrap else arg)
+
+    # we didn't want to alter the stack unless everything looks good - now that we know that, we
+    # can pop the values we've gathered
+    for _ in range(arity):
+        stack.pop()
+
+    return retvals
+
 def print_value(v, indent=0):
     print('  ' * indent, type(v).__name__, end='', sep='')
     if isinstance(v, ArrayValue):
@@ -209,297 +643,1587 @@ def print_value(v, indent=0):
     else:
         print('', v.value)
 
-DELIMITERS = {
-    '(',
-    ')',
-    '<',
-    '>',
-    '[',
-    ']',
-    '{',
-    '}',
-    '/',
-    '%',
-}
+class ImmediateNameValue(NameValue):
+    '''
+    An immediately evaluated name (`//name`) - the interpreter replaces these with whatever
+    the name refers to when it assembles the program
+    '''
+    __slots__ = ()
 
-class Scanner:
-    def __init__(self, lines):
-        self.lines = lines
+    def __ps_repr__(self):
+        return '//' + self.value
+
+# character classes for whitespace (besides newlines) and for characters that can't appear in
+# a regular token (whitespace, newlines and delimiters)
+WHITESPACE = r' \t\r\f\x00'
+NOT_REGULAR = r' \t\r\f\x00\n()<>\[\]{}/%'
+
+# one master pattern for every token - leading whitespace other than newlines is skipped as part
+# of the match, and newlines are their own tokens so that we can track line numbers without
+# rescanning anything
+TOKEN_PATTERN = r'''[WHITESPACE]*(?:
+    (?P<newline>\n)
+  | (?P<comment>%[^\n]*)
+  | (?P<start_dict><<)
+  | (?P<end_dict>>>)
+  | (?P<ascii85><~)
+  | (?P<hex><)
+  | (?P<simple_string>\([^()\\\n]*\))
+  | (?P<string>\()
+  | (?P<start_proc>\{)
+  | (?P<end_proc>\})
+  | (?P<start_array>\[)
+  | (?P<end_array>\])
+  | (?P<immediate>//[^NOT_REGULAR]*)
+  | (?P<literal>/[^NOT_REGULAR]*)
+  | (?P<integer>[+-]?[0-9]+)(?![^NOT_REGULAR])
+  | (?P<name>[^NOT_REGULAR0-9+\-.][^NOT_REGULAR]*)
+  | (?P<regular>[^NOT_REGULAR]+)
+  | (?P<eof>\Z)
+  | (?P<error>.)
+)'''.replace('NOT_REGULAR', NOT_REGULAR).replace('WHITESPACE', WHITESPACE)
+
+STRING_SPECIAL_PATTERN = r'[()\\\n]'
+
+REAL_RE = re.compile(r'[+-]?(?:\d+\.\d*|\.\d+|\d+(?=[eE]))(?:[eE][+-]?\d+)?\Z')
+RADIX_RE = re.compile(r'(\d+)#([0-9a-zA-Z]+)\Z')
+
+STRING_ESCAPES = {
+    'n':  '\n',
+    'r':  '\r',
+    't':  '\t',
+    'b':  '\b',
+    'f':  '\f',
+    '\\': '\\',
+    '(':  '(',
+    ')':  ')',
+}
 
-    def __iter__(self):
-        for line_no, line in enumerate(self.lines, start=1):
-            line = line.rstrip()
+class _Syntax:
+    '''
+    The compiled patterns and constants for scanning either str or bytes-like buffers
+    '''
+    def __init__(self, encode, decode):
+        self.token_re = re.compile(encode(TOKEN_PATTERN), re.VERBOSE)
+        self.string_special_re = re.compile(encode(STRING_SPECIAL_PATTERN))
+        self.newline = encode('\n')
+        self.percent = encode('%')
+        self.gt = encode('>')
+        self.ascii85_end = encode('~>')
+        self.decode = decode
+
+_TEXT_SYNTAX = _Syntax(str, str)
+_BYTES_SYNTAX = _Syntax(operator.methodcaller('encode', 'latin-1'), operator.methodcaller('decode', 'latin-1'))
+
+def _number_or_name(text, **location):
+    # plain integers and names that can't be numbers are picked out by TOKEN_PATTERN itself
+    if REAL_RE.match(text):
+        return RealValue(value=float(text), **location)
+    if (m := RADIX_RE.match(text)) and 2 <= int(m.group(1)) <= 36:
+        try:
+            return IntegerValue(value=int(m.group(2), int(m.group(1))), **location)
+        except ValueError:
+            pass
+    return NameValue(value=text, executable=True, **location)
 
-            tag = None
-            args = None
+class Scanner:
+    '''
+    Turns PostScript source into a stream of tokens, in a single pass over a buffer
 
-            if (idx := line.find('%')) != -1:
-                comment = line[idx+1:]
-                line = line[:idx]
+    source may be a str, a bytes-like object (including an mmap), a file, or any other iterable
+    of lines (str or bytes) - files that are backed by a real file descriptor are mmap'd rather
+    than read.  Columns and lengths are measured in units of the underlying buffer (bytes for
+    binary files), which is the same thing for ASCII source.
 
-                while len(comment) > 0 and comment[0].isspace():
-                    comment = comment[1:]
+    Tokens are yielded a line at a time, once the line's been scanned - a `%tag …` or `%args …`
+    comment applies to every token on its line, and the line's source locations are registered
+    in one go.
+    '''
+    def __init__(self, source):
+        self.source = source
 
-                if comment.startswith('tag '):
-                    tag = comment.removeprefix('tag ')
-                if comment.startswith('args '):
-                    args = comment.removeprefix('args ').split(' ')
+    def __iter__(self):
+        source = self.source
+        mapped = None
 
-            col_no = 1
+        if isinstance(source, str):
+            buf = source
+        elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+            buf = source
+        else:
+            try:
+                mapped = buf = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+            except (AttributeError, OSError, ValueError):
+                # not a real file (eg. StringIO), an empty one, which mmap refuses, or not a file
+                # at all
+                if hasattr(source, 'read'):
+                    buf = source.read()
+                else:
+                    lines = list(source)
+                    buf = b''.join(lines) if lines and not isinstance(lines[0], str) else ''.join(lines)
 
-            while True:
-                stripped = line.lstrip()
-                col_no += len(line) - len(stripped)
-                line = stripped
-                if line == '':
+        try:
+            yield from self._scan(buf, _TEXT_SYNTAX if isinstance(buf, str) else _BYTES_SYNTAX)
+        finally:
+            if mapped is not None:
+                mapped.close()
+
+    def _scan(self, buf, syntax):
+        finditer = syntax.token_re.finditer
+        decode = syntax.decode
+        source = SourceMap()
+
+        pos = 0
+        line_no = 1
+        line_start = 0
+
+        # the tokens on the current line, with their columns and lengths - they're held back until
+        # the end of the line, so that their locations can be registered all at once and any %tag
+        # or %args comment on the line can be applied to them
+        pending = []
+        columns = []
+        lengths = []
+        tag = None
+        args = None
+
+        def finish_line(line_no, tag, args):
+            token = source.extend(itertools.repeat(line_no, len(pending)), columns, lengths)
+            for value in pending:
+                value.token = token
+                token += 1
+            if tag is not None:
+                for value in pending:
+                    source.tags[value.token] = tag
+            if args is not None:
+                for value in pending:
+                    if isinstance(value, StartProcValue):
+                        value.args = args
+            columns.clear()
+            lengths.clear()
+
+        # the common tokens are matched entirely by TOKEN_PATTERN, so scanning runs straight down
+        # finditer - only strings that need scanning by hand break out and restart it
+        while True:
+            for m in finditer(buf, pos):
+                kind = m.lastgroup
+                start, pos = m.span(kind)
+
+                if kind == 'name':
+                    token = NameValue(value=decode(m.group(kind)), executable=True, source=source)
+                elif kind == 'integer':
+                    token = IntegerValue(value=int(m.group(kind)), source=source)
+                elif kind == 'regular':
+                    token = _number_or_name(decode(m.group(kind)), source=source)
+                elif kind == 'literal':
+                    token = NameValue(value=decode(m.group(kind))[1:], source=source)
+                elif kind == 'start_proc':
+                    token = StartProcValue(source=source)
+                elif kind == 'end_proc':
+                    token = EndProcValue(source=source)
+                elif kind == 'simple_string':
+                    token = StringValue(value=decode(m.group(kind))[1:-1], source=source)
+                elif kind in ('start_array', 'end_array', 'start_dict', 'end_dict'):
+                    token = NameValue(value=decode(m.group(kind)), executable=True, source=source)
+                elif kind == 'newline' or kind == 'eof':
+                    if pending:
+                        finish_line(line_no, tag, args)
+                        yield from pending
+                        pending.clear()
+                    if kind == 'eof':
+                        return
+
+                    line_no += 1
+                    line_start = pos
+                    tag = args = None
+                    continue
+                elif kind == 'comment':
+                    comment = decode(m.group(kind))[1:].lstrip()
+                    if comment.startswith('tag '):
+                        tag = comment.removeprefix('tag ')
+                    if comment.startswith('args '):
+                        args = comment.removeprefix('args ').split(' ')
+                    continue
+                elif kind == 'immediate':
+                    token = ImmediateNameValue(value=decode(m.group(kind))[2:], source=source)
+                elif kind == 'error':
+                    raise SyntaxError(f'unrecognized input at line {line_no}, column {start - line_start + 1}')
+                else:
                     break
 
-                if line.startswith('/'):
-                    idx = 1
-                    while idx < len(line) and not line[idx].isspace() and not line[idx] in DELIMITERS:
-                        idx += 1
-                    yield NameValue(value=line[1:idx], line=line_no, column=col_no, length=idx, tag=tag)
-                    line = line[idx:]
-                    col_no += idx
-                elif line[0] == '{':
-                    assert len(line) == 1 or line[1].isspace()
-                    yield StartProcValue(line=line_no, column=col_no, length=1, tag=tag, args=args)
-                    line = line[1:]
-                    col_no += 1
-                elif line[0] == '}':
-                    assert len(line) == 1 or line[1].isspace()
-                    yield EndProcValue(line=line_no, column=col_no, length=1, tag=tag)
-                    line = line[1:]
-                    col_no += 1
-                elif line[0].isalpha():
-                    idx = 1
-                    while idx < len(line) and line[idx].isalpha():
-                        idx += 1
-                    yield NameValue(value=line[:idx], line=line_no, column=col_no, length=idx, tag=tag, executable=True)
-                    line = line[idx:]
-                    col_no += idx
-                elif (line[0] == '-' and line[1].isdigit()) or line[0].isdigit():
-                    idx = 1
-                    while idx < len(line) and (line[idx].isdigit() or line[idx] == '.'):
-                        idx += 1
-                    if '.' in line[:idx]:
-                        yield RealValue(value=float(line[:idx]), line=line_no, column=col_no, length=idx, tag=tag)
-                    else:
-                        yield IntegerValue(value=int(line[:idx]), line=line_no, column=col_no, length=idx, tag=tag)
-                    line = line[idx:]
-                    col_no += idx
-                elif line[0] == '(':
-                    idx = line.index(')')
-                    yield StringValue(value=line[1:idx], line=line_no, column=col_no, length=idx+1, tag=tag)
-                    line = line[idx+1:]
-                    col_no += idx + 1
-                elif line[0] == '=':
-                    assert len(line) == 1 or line[1].isspace()
-                    yield NameValue(value='=', line=line_no, column=col_no, length=1, tag=tag, executable=True)
-                    line = line[1:]
-                    col_no += 1
-                elif line[0:2] == '<<':
-                    assert len(line) == 2 or line[2].isspace()
-                    yield NameValue(value='<<', line=line_no, column=col_no, length=2, tag=tag, executable=True)
-                    line = line[2:]
-                    col_no += 2
-                elif line[0:2] == '>>':
-                    assert len(line) == 2 or line[2].isspace()
-                    yield NameValue(value='>>', line=line_no, column=col_no, length=2, tag=tag, executable=True)
-                    line = line[2:]
-                    col_no += 2
-                elif line[0] == '[':
-                    assert len(line) == 1 or line[1].isspace()
-                    yield NameValue(value='[', line=line_no, column=col_no, length=1, tag=tag, executable=True)
-                    line = line[1:]
-                    col_no += 1
-                elif line[0] == ']':
-                    assert len(line) == 1 or line[1].isspace()
-                    yield NameValue(value=']', line=line_no, column=col_no, length=1, tag=tag, executable=True)
-                    line = line[1:]
-                    col_no += 1
+                pending.append(token)
+                columns.append(start - line_start + 1)
+                lengths.append(pos - start)
+
+            # strings that can span lines or need unescaping work out their own end position
+            # and line
+            if kind == 'string':
+                value, pos, newlines, last_newline = self._scan_string(buf, pos, syntax)
+            elif kind == 'hex':
+                end = buf.find(syntax.gt, pos)
+                if end == -1:
+                    raise SyntaxError(f'unterminated hex string at line {line_no}')
+                text = decode(buf[pos:end])
+                digits = ''.join(text.split())
+                if len(digits) % 2:
+                    digits += '0'
+                try:
+                    value = bytes.fromhex(digits).decode('latin-1')
+                except ValueError:
+                    raise SyntaxError(f'invalid hex string at line {line_no}')
+                newlines = text.count('\n')
+                last_newline = buf.rfind(syntax.newline, pos, end)
+                pos = end + 1
+            else:
+                end = buf.find(syntax.ascii85_end, pos)
+                if end == -1:
+                    raise SyntaxError(f'unterminated ASCII85 string at line {line_no}')
+                text = decode(buf[pos:end])
+                value = base64.a85decode(text.encode('latin-1')).decode('latin-1')
+                newlines = text.count('\n')
+                last_newline = buf.rfind(syntax.newline, pos, end)
+                pos = end + 2
+
+            pending.append(StringValue(value=value, source=source))
+            columns.append(start - line_start + 1)
+            lengths.append(pos - start)
+
+            if newlines:
+                # the string belongs to the line it started on, and anything after it is on a
+                # fresh line
+                finish_line(line_no, tag, args)
+                yield from pending
+                pending.clear()
+
+                line_no += newlines
+                line_start = last_newline + 1
+                tag = args = None
+
+    def _scan_string(self, buf, pos, syntax):
+        '''
+        Scan the body of a literal string starting just after its opening parenthesis, returning
+        (value, position after the closing parenthesis, number of newlines, position of the last
+        newline)
+        '''
+        search = syntax.string_special_re.search
+        decode = syntax.decode
+
+        pieces = []
+        depth = 1
+        newlines = 0
+        last_newline = -1
+
+        while True:
+            m = search(buf, pos)
+            if m is None:
+                raise SyntaxError('unterminated string')
+
+            special = decode(m.group())
+            pieces.append(decode(buf[pos:m.start()]))
+            pos = m.end()
+
+            if special == '(':
+                depth += 1
+                pieces.append(special)
+            elif special == ')':
+                depth -= 1
+                if depth == 0:
+                    return ''.join(pieces), pos, newlines, last_newline
+                pieces.append(special)
+            elif special == '\n':
+                newlines += 1
+                last_newline = pos - 1
+                pieces.append(special)
+            else:
+                escaped = decode(buf[pos:pos+1])
+                pos += 1
+                if escaped in STRING_ESCAPES:
+                    pieces.append(STRING_ESCAPES[escaped])
+                elif escaped == '\n':
+                    # line continuation
+                    newlines += 1
+                    last_newline = pos - 1
+                elif escaped == '\r':
+                    if decode(buf[pos:pos+1]) == '\n':
+                        pos += 1
+                        newlines += 1
+                        last_newline = pos - 1
+                elif escaped.isdigit() and escaped < '8':
+                    digits = escaped
+                    while len(digits) < 3 and (c := decode(buf[pos:pos+1])) and '0' <= c <= '7':
+                        digits += c
+                        pos += 1
+                    pieces.append(chr(int(digits, 8) & 0xff))
                 else:
-                    raise NotImplementedError(f"can't handle rest of line {line!r}")
+                    # an unknown escape just means the character itself
+                    pieces.append(escaped)
 
-class Interpreter:
-    def __init__(self):
-        self.operand_stack = deque()
-        self.execution_stack = deque()
-        self.dictionary_stack = ChainMap(core_vocabulary)
-        self.graphics_state = None
+class OperandStack(list):
+    '''
+    The operand stack - a list (top of the stack at the end) with the bulk operations that
+    PostScript's stack manipulation operators need, all done with slices so that they cost
+    O(number of elements involved) rather than O(depth of the stack)
+    '''
 
-    def _describe_graphics_state(self):
-        if self.graphics_state is None:
-            return '(no path)'
-        elif self.graphics_state[0] is None:
-            return '(no current point)'
+    def pop_n(self, n):
+        '''
+        Pop the top n values, returning them bottom-first
+        '''
+        assert 0 <= n <= len(self), 'operand stack underflow'
+        if n == 0:
+            return []
+        values = self[-n:]
+        del self[-n:]
+        return values
+
+    def push_n(self, values):
+        self.extend(values)
+
+    def peek(self, idx):
+        '''
+        The value idx places down from the top (0 being the top itself)
+        '''
+        assert 0 <= idx < len(self), 'operand stack underflow'
+        return self[-1 - idx]
+
+    def copy_top(self, n):
+        assert 0 <= n <= len(self), 'operand stack underflow'
+        if n > 0:
+            self.extend(self[-n:])
+
+    def push_copy(self, idx):
+        '''
+        Push another reference to the value idx places down from the top
+        '''
+        self.append(self.peek(idx))
+
+    def exch(self):
+        assert len(self) >= 2, 'operand stack underflow'
+        self[-1], self[-2] = self[-2], self[-1]
+
+    def tag(self, idx):
+        '''
+        The tag of the value in slot idx - plain stacks don't track tags at all
+        '''
+        return None
+
+    def roll(self, n, j):
+        '''
+        Roll the top n values j positions "up" (towards the top), or -j positions down if j
+        is negative
+        '''
+        assert 0 <= n <= len(self), 'operand stack underflow'
+        if n == 0:
+            return
+        j %= n
+        if j:
+            self[-n:] = self[-j:] + self[-n:-j]
+
+    def mark_position(self):
+        '''
+        The index of the topmost mark
+        '''
+        for idx in range(len(self) - 1, -1, -1):
+            if isinstance(self[idx], MarkValue):
+                return idx
+        raise AssertionError('unmatched mark')
+
+    def count_to_mark(self):
+        return len(self) - self.mark_position() - 1
+
+    def pop_to_mark(self):
+        '''
+        Pop everything above the topmost mark and the mark itself, returning the values above
+        the mark bottom-first
+        '''
+        idx = self.mark_position()
+        values = self[idx + 1:]
+        del self[idx:]
+        return values
+
+def _source_tag(v):
+    return None if v.token is None else v.source.tags.get(v.token)
+
+class TaggedOperandStack(OperandStack):
+    '''
+    An operand stack that keeps a tag for each slot, in a parallel list - values pushed on
+    get their %tag from the source (if any), values copied or moved within the stack take
+    their slot's tag with them, and procedure %args retag slots for the length of the call.
+    Values themselves are never touched, so values shared between slots (eg. after a dup) or
+    interned ones can have different tags in different places.
+
+    The interpreter only switches to one of these once a program uses %tag or %args, so
+    programs that don't pay nothing for it.
+    '''
+    def __init__(self, values=()):
+        super().__init__(values)
+        self.tags = [ _source_tag(v) for v in self ]
+
+    def tag(self, idx):
+        return self.tags[idx]
+
+    def append(self, value):
+        list.append(self, value)
+        self.tags.append(_source_tag(value))
+
+    def extend(self, values):
+        values = list(values)
+        list.extend(self, values)
+        self.tags.extend(_source_tag(v) for v in values)
+
+    def insert(self, idx, value):
+        list.insert(self, idx, value)
+        self.tags.insert(idx, _source_tag(value))
+
+    def pop(self, idx=-1):
+        value = list.pop(self, idx)
+        self.tags.pop(idx)
+        return value
+
+    def __setitem__(self, idx, value):
+        list.__setitem__(self, idx, value)
+        if isinstance(idx, slice):
+            self.tags[idx] = [ _source_tag(v) for v in self[idx] ]
+        else:
+            self.tags[idx] = _source_tag(value)
+
+    def __delitem__(self, idx):
+        list.__delitem__(self, idx)
+        del self.tags[idx]
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def clear(self):
+        list.clear(self)
+        self.tags.clear()
+
+    def copy_top(self, n):
+        assert 0 <= n <= len(self), 'operand stack underflow'
+        if n > 0:
+            list.extend(self, self[-n:])
+            self.tags.extend(self.tags[-n:])
+
+    def push_copy(self, idx):
+        value = self.peek(idx)
+        list.append(self, value)
+        self.tags.append(self.tags[-1 - idx])
+
+    def exch(self):
+        assert len(self) >= 2, 'operand stack underflow'
+        list.__setitem__(self, slice(-2, None), [self[-1], self[-2]])
+        tags = self.tags
+        tags[-1], tags[-2] = tags[-2], tags[-1]
+
+    def roll(self, n, j):
+        assert 0 <= n <= len(self), 'operand stack underflow'
+        if n == 0:
+            return
+        j %= n
+        if j:
+            list.__setitem__(self, slice(-n, None), self[-j:] + self[-n:-j])
+            tags = self.tags
+            tags[-n:] = tags[-j:] + tags[-n:-j]
+
+    def retag(self, names):
+        '''
+        Give the top slots the tags in names (the last one going on the top slot), returning
+        what's needed to undo it with restore_tags
+        '''
+        saved = []
+        for idx, name in zip(range(len(self) - 1, -1, -1), reversed(names)):
+            saved.append((idx, self[idx], self.tags[idx]))
+            self.tags[idx] = name
+        return saved
+
+    def restore_tags(self, saved):
+        # only slots that still hold the value they were retagged with get their old tag back -
+        # anything else has been consumed or replaced since
+        for idx, value, tag in saved:
+            if idx < len(self) and self[idx] is value:
+                self.tags[idx] = tag
+
+def parse_program(tokens):
+    '''
+    Build executable arrays out of everything between braces in a stream of tokens (deferred
+    execution mode), yielding top-level words - this way the dispatch loop never has to check
+    whether it's in the middle of a procedure.  This is purely structural, which is what lets
+    load_program cache its output; already-built arrays pass straight through.
+    '''
+    # (start token, words) for each procedure we're in the middle of
+    open_procs = []
+
+    for token in tokens:
+        if isinstance(token, StartProcValue):
+            open_procs.append((token, []))
+        elif isinstance(token, EndProcValue):
+            assert open_procs, 'unmatched }'
+            start_proc_word, array = open_procs.pop()
+            proc = ArrayValue(
+                value=array,
+                executable=True,
+                source=start_proc_word.source,
+                line=start_proc_word.line,
+                column=start_proc_word.column,
+                length=1,
+                tag=token.tag,
+                args=start_proc_word.args,
+            )
+
+            if open_procs:
+                open_procs[-1][1].append(proc)
+            else:
+                yield proc
+        elif open_procs:
+            open_procs[-1][1].append(token)
         else:
-            return f'({self.graphics_state[0]}, {self.graphics_state[1]})'
+            yield token
 
-    def _is_building_executable_array(self):
-        return any(isinstance(v, StartProcValue) for v in self.operand_stack)
+    assert not open_procs, 'unterminated procedure'
 
-    def look_up(self, name):
-        return self.dictionary_stack[name]
+def _interpreter_fingerprint():
+    '''
+    A hash of this module's source and of the marshal format, so that cache files written by any
+    other version of the interpreter are ignored without anyone having to remember to bump a
+    version number - any change to the interpreter invalidates them, even ones that don't
+    affect the parsed representation, which only costs a rescan
+    '''
+    fingerprint = hashlib.sha256(struct.pack('<I', marshal.version))
+    try:
+        with open(__file__, 'rb') as f:
+            fingerprint.update(f.read())
+    except OSError:
+        # without our source (eg. if we've been frozen), at least each process agrees with itself
+        fingerprint.update(str(os.getpid()).encode('ascii'))
+    return fingerprint.digest()[:8]
+
+CACHE_MAGIC = b'PSC\x02' + _interpreter_fingerprint()
+
+# the types parse_program can produce, in the order they're numbered in cache files
+CACHED_TYPES = (IntegerValue, RealValue, NameValue, ImmediateNameValue, StringValue, ArrayValue)
+_CACHED_TYPE_CODES = { t: code for code, t in enumerate(CACHED_TYPES) }
+
+def _pack_integers(values):
+    '''
+    Pack a sequence of integers into bytes using the narrowest array type that holds them all,
+    returning (typecode, bytes)
+    '''
+    lowest, highest = min(values, default=0), max(values, default=0)
+    for typecode in ('bhiq' if lowest < 0 else 'BHIQ'):
+        bits = array(typecode).itemsize * 8 - typecode.islower()
+        if -(1 << bits) <= lowest and highest < (1 << bits):
+            return typecode, array(typecode, values).tobytes()
+
+def _unpack_integers(packed):
+    typecode, data = packed
+    values = array(typecode)
+    values.frombytes(data)
+    return values
+
+def _encode_program(words):
+    '''
+    Encode parsed top-level words into something marshal can write compactly - each value in
+    the program in postorder (so a procedure comes right after its contents), as parallel arrays
+    of type codes, indexes into tables of distinct constants and tags, and source locations
+    '''
+    flat = []
+    def flatten(words):
+        for word in words:
+            if isinstance(word, ArrayValue):
+                flatten(word.value)
+            flat.append(word)
+    flatten(words)
+
+    constants = {}
+    kinds = []
+    value_indexes = []
+    line_deltas = []
+    columns = []
+    lengths = []
+    # index 0 is no tag
+    tags = { None: 0 }
+    tag_indexes = []
+    args = {}
+
+    previous_line = 0
+    for idx, word in enumerate(flat):
+        kinds.append(_CACHED_TYPE_CODES[type(word)] << 1 | word.executable)
+        # procedures store how many of the values before them are their contents
+        value = len(word.value) if isinstance(word, ArrayValue) else word.value
+        # (type, value) so that eg. 1 and 1.0 and True don't share an entry
+        value_indexes.append(constants.setdefault((type(value), value), len(constants)))
+
+        line = word.line
+        line_deltas.append(line - previous_line)
+        previous_line = line
+        columns.append(word.column)
+        lengths.append(word.length)
+
+        tag_indexes.append(tags.setdefault(word.tag, len(tags)))
+        if isinstance(word, ArrayValue) and word.args is not None:
+            args[idx] = tuple(word.args)
+
+    return (
+        len(flat),
+        tuple(value for _, value in constants),
+        _pack_integers(kinds),
+        _pack_integers(value_indexes),
+        _pack_integers(line_deltas),
+        _pack_integers(columns),
+        _pack_integers(lengths),
+        tuple(tags),
+        _pack_integers(tag_indexes),
+        args,
+    )
+
+def _decode_program(encoded):
+    count, constants, kinds, value_indexes, line_deltas, columns, lengths, tags, tag_indexes, args = encoded
+    kinds = _unpack_integers(kinds)
+    value_indexes = _unpack_integers(value_indexes)
+    tag_indexes = _unpack_integers(tag_indexes)
+
+    # register all the source locations in one go, rather than one value at a time
+    source = SourceMap()
+    first_token = source.extend(
+        itertools.accumulate(_unpack_integers(line_deltas)),
+        _unpack_integers(columns),
+        _unpack_integers(lengths),
+    )
+
+    types = [ (CACHED_TYPES[kind >> 1], bool(kind & 1)) for kind in range(len(CACHED_TYPES) * 2) ]
+
+    # values are in postorder, so a procedure's contents are the values on top of this stack
+    stack = []
+    for idx in range(count):
+        cls, executable = types[kinds[idx]]
+        value = constants[value_indexes[idx]]
+        tag = tags[tag_indexes[idx]]
+        if cls is ArrayValue:
+            start = len(stack) - value
+            word = ArrayValue(stack[start:], executable, first_token + idx, source, tag, args=args.get(idx))
+            if word.args is not None:
+                word.args = list(word.args)
+            del stack[start:]
+        else:
+            word = cls(value, executable, first_token + idx, source, tag)
+        stack.append(word)
 
-    def check_arity(self, *signature):
-        assert len(self.operand_stack) >= len(signature), 'operand stack underflow'
-        retvals = []
-        for expected_type, arg in zip(reversed(signature), reversed(self.operand_stack)):
-            if isinstance(expected_type, types.UnionType):
-                valid_types = typing.get_args(expected_type)
+    return stack
+
+CHECKSUM_SIZE = hashlib.sha256().digest_size
+
+def cache_filename(filename):
+    '''
+    Where the compiled form of the program in filename gets cached - alongside Python's own
+    bytecode cache
+    '''
+    directory, name = os.path.split(os.path.abspath(filename))
+    return os.path.join(directory, '__pycache__', name + '.psc')
+
+def load_program(filename, use_cache=True):
+    '''
+    Scan and parse the program in filename, returning a list of top-level words for
+    Interpreter.run/execute.  When use_cache is set the parsed program is loaded from its cache
+    file if that was built from identical source by this version of the interpreter, and the
+    cache file is (re)written otherwise.  Source locations, tags and %args survive the round
+    trip, so cached programs can be debugged just the same.
+
+    A cache file is the magic number (which includes a fingerprint of the interpreter), the
+    SHA-256 of the source, the SHA-256 of the payload, and the marshalled payload - the payload
+    is only decoded if its hash checks out, and a file that's damaged in any way is just rebuilt.
+    '''
+    with open(filename, 'rb') as f:
+        source = f.read()
+
+    if not use_cache:
+        return list(parse_program(Scanner(source)))
+
+    header = CACHE_MAGIC + hashlib.sha256(source).digest()
+    cache = cache_filename(filename)
+
+    try:
+        with open(cache, 'rb') as f:
+            cached = f.read()
+    except OSError:
+        cached = None
+
+    if cached is not None and cached.startswith(header):
+        checksum = cached[len(header):len(header) + CHECKSUM_SIZE]
+        payload = memoryview(cached)[len(header) + CHECKSUM_SIZE:]
+        if hashlib.sha256(payload).digest() == checksum:
+            # decoding allocates a lot of objects but never any cycles, so don't let the cyclic
+            # garbage collector keep scanning them as they're made
+            gc_was_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                return _decode_program(marshal.loads(payload))
+            except Exception:
+                # the checksum makes this very unlikely, but whatever's wrong, rebuilding fixes it
+                pass
+            finally:
+                if gc_was_enabled:
+                    gc.enable()
+
+    words = list(parse_program(Scanner(source)))
+
+    try:
+        os.makedirs(os.path.dirname(cache), exist_ok=True)
+        # write to a temporary file first, so a concurrent run never sees half a cache file
+        temp = f'{cache}.{os.getpid()}.tmp'
+        payload = marshal.dumps(_encode_program(words))
+        with open(temp, 'wb') as f:
+            f.write(header)
+            f.write(hashlib.sha256(payload).digest())
+            f.write(payload)
+        os.replace(temp, cache)
+    except OSError:
+        # caching is only an optimization, so eg. a read-only directory isn't an error
+        pass
+
+    return words
+
+# transformation matrices are [a b c d tx ty] like PostScript's, mapping (x, y) to
+# (a*x + c*y + tx, b*x + d*y + ty) - they're immutable tuples, so graphics states can share them
+IDENTITY_MATRIX = (1.0, 0.0, 0.0, 1.0, 0.0, 0.0)
+
+def _concat_matrices(m, n):
+    '''
+    The matrix that applies m and then n
+    '''
+    a, b, c, d, tx, ty = m
+    na, nb, nc, nd, ntx, nty = n
+    return (
+        a * na + b * nc,
+        a * nb + b * nd,
+        c * na + d * nc,
+        c * nb + d * nd,
+        tx * na + ty * nc + ntx,
+        tx * nb + ty * nd + nty,
+    )
+
+def _invert_matrix(m):
+    a, b, c, d, tx, ty = m
+    det = a * d - b * c
+    assert det != 0, 'undefinedresult'
+    return (d / det, -b / det, -c / det, a / det, (c * ty - d * tx) / det, (b * tx - a * ty) / det)
+
+def _transform_point(m, point):
+    a, b, c, d, tx, ty = m
+    x, y = point
+    return (a * x + c * y + tx, b * x + d * y + ty)
+
+def _transform_segments(m, segments):
+    if m == IDENTITY_MATRIX:
+        return segments
+    a, b, c, d, tx, ty = m
+    return [
+        (a * x0 + c * y0 + tx, b * x0 + d * y0 + ty, a * x1 + c * y1 + tx, b * x1 + d * y1 + ty)
+        for x0, y0, x1, y1 in segments
+    ]
+
+@dataclass
+class GraphicsState:
+    '''
+    The parts of the PostScript graphics state we model.
+
+    The current path is kept in user space as line segments (x0, y0, x1, y1), each preceded by
+    the matrix that was current when it was added whenever that changes, and only transformed
+    to device space - one run of segments at a time - when it's painted.
+
+    gsave copies the state shallowly, so the copies share the path list and the (immutable)
+    matrix.  Each state remembers how much of a shared path list is its own - grestore trims
+    off whatever the discarded state added, and a state only copies the list if something else
+    has appended past its part in the meantime.
+    '''
+    path: list = field(default_factory=list)
+    path_length: int = 0
+    # the matrix that applies to the last segments in path
+    path_matrix: Optional[tuple] = None
+
+    # these are in user space
+    current_point: Optional[tuple[float, float]] = None
+    # where the current subpath started, for closepath
+    subpath_start: Optional[tuple[float, float]] = None
+
+    ctm: tuple = IDENTITY_MATRIX
+    line_width: float = 1.0
+    color: tuple[float, float, float] = (0.0, 0.0, 0.0)
+
+    def copy(self):
+        return dataclasses.replace(self)
+
+    def add_segment(self, segment):
+        path = self.path
+        if len(path) != self.path_length:
+            # whoever we share this path with has added to it - take our own copy
+            path = self.path = path[:self.path_length]
+        if self.path_matrix is not self.ctm:
+            path.append(self.ctm)
+            self.path_matrix = self.ctm
+        path.append(segment)
+        self.path_length = len(path)
+
+    def clear_path(self):
+        self.path = []
+        self.path_length = 0
+        self.path_matrix = None
+        self.current_point = self.subpath_start = None
+
+    def set_ctm(self, ctm):
+        # the current point stays put on the page, so it moves in user space
+        if self.current_point is not None:
+            to_user = _invert_matrix(ctm)
+            self.current_point = _transform_point(to_user, _transform_point(self.ctm, self.current_point))
+            self.subpath_start = _transform_point(to_user, _transform_point(self.ctm, self.subpath_start))
+        self.ctm = ctm
+
+    def device_segments(self):
+        '''
+        The current path in device space
+        '''
+        segments = []
+        run = []
+        matrix = None
+        for entry in itertools.islice(self.path, self.path_length):
+            if len(entry) == 6:
+                segments.extend(_transform_segments(matrix, run) if run else ())
+                run = []
+                matrix = entry
             else:
-                valid_types = (expected_type,)
+                run.append(entry)
+        if run:
+            segments.extend(_transform_segments(matrix, run))
+        return segments
 
-            unwrap = not any(issubclass(t, Value) for t in valid_types)
+    def device_line_width(self):
+        # a line width scales with the matrix's average stretch
+        a, b, c, d, _, _ = self.ctm
+        return self.line_width * abs(a * d - b * c) ** 0.5
+
+class Device:
+    '''
+    Where painting operators send their output - this one just throws it away, subclasses
+    actually draw something
+    '''
+    def stroke(self, segments, line_width, color):
+        pass
 
-            if any(issubclass(t, Value) for t in valid_types):
-                assert all(issubclass(t, Value) for t in valid_types), 'if any of the types are Value subclasses, all of them must be'
+    def showpage(self):
+        pass
+
+    def close(self):
+        '''
+        Called once the program has finished, to finish off any output
+        '''
+        pass
+
+def _page_filename(output, page):
+    # a %d in an output filename is replaced with the page number, like Ghostscript does
+    return output.replace('%d', str(page))
+
+def _format_number(n):
+    if isinstance(n, int) or n == int(n):
+        return str(int(n))
+    return f'{n:.4f}'.rstrip('0').rstrip('.')
+
+def _polylines(segments):
+    '''
+    Join up runs of segments where each one starts where the last one ended, yielding a list
+    of points for each run - this is what paths look like when they're built with lineto
+    '''
+    points = None
+    for x0, y0, x1, y1 in segments:
+        if points is not None and points[-1] == (x0, y0):
+            points.append((x1, y1))
+        else:
+            if points is not None:
+                yield points
+            points = [(x0, y0), (x1, y1)]
+    if points is not None:
+        yield points
+
+class SVGDevice(Device):
+    '''
+    Writes each stroked path straight out to an SVG file as it's painted, so pages with any
+    number of paths take constant memory - a %d in output is replaced with the page number,
+    since an SVG file only holds one page
+    '''
+    def __init__(self, output='page-%d.svg', width=612, height=792):
+        self.output = output
+        self.width = width
+        self.height = height
+        self.page = 1
+        self.file = None
+
+    def _begin_page(self):
+        self.file = open(_page_filename(self.output, self.page), 'w')
+        self.file.write(
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width}" height="{self.height}" '
+            f'viewBox="0 0 {self.width} {self.height}">\n'
+            # PostScript's origin is at the bottom left, SVG's is at the top left
+            f'<g transform="matrix(1 0 0 -1 0 {self.height})" fill="none" stroke-linecap="round" stroke-linejoin="round">\n'
+        )
+
+    def _end_page(self):
+        self.file.write('</g>\n</svg>\n')
+        self.file.close()
+        self.file = None
+
+    def stroke(self, segments, line_width, color):
+        if not segments:
+            return
+        if self.file is None:
+            self._begin_page()
+
+        commands = []
+        for points in _polylines(segments):
+            (x, y), *rest = points
+            commands.append(f'M{_format_number(x)} {_format_number(y)}')
+            commands.extend(f'L{_format_number(x)} {_format_number(y)}' for x, y in rest)
+
+        r, g, b = (round(c * 255) for c in color)
+        self.file.write(f'<path d="{" ".join(commands)}" stroke="#{r:02x}{g:02x}{b:02x}" stroke-width="{_format_number(line_width)}"/>\n')
+
+    def showpage(self):
+        if self.file is None:
+            self._begin_page()
+        self._end_page()
+        self.page += 1
+
+    def close(self):
+        if self.file is not None:
+            self._end_page()
+
+class PDFDevice(Device):
+    '''
+    Writes a minimal PDF, streaming each stroked path into the current page's content stream as
+    it's painted - only the byte offsets of objects (a few per page) are kept in memory, for
+    the cross-reference table written by close
+    '''
+    # object numbers of the catalog and page tree, which are written last since they refer to
+    # every page
+    CATALOG = 1
+    PAGES = 2
+
+    def __init__(self, output='output.pdf', width=612, height=792):
+        self.width = width
+        self.height = height
+        self.file = open(output, 'wb')
+        self.offsets = {}
+        self.next_object = self.PAGES + 1
+        self.pages = []
+        # (content stream object, its length object, where its data started) for the open page
+        self.content = None
+
+        self.file.write(b'%PDF-1.4\n')
+
+    def _begin_object(self, number):
+        self.offsets[number] = self.file.tell()
+        self.file.write(f'{number} 0 obj\n'.encode('ascii'))
+
+    def _allocate(self, count):
+        first = self.next_object
+        self.next_object += count
+        return range(first, first + count)
+
+    def _begin_page(self):
+        contents, length = self._allocate(2)
+        self._begin_object(contents)
+        self.file.write(f'<< /Length {length} 0 R >>\nstream\n'.encode('ascii'))
+        self.content = (contents, length, self.file.tell())
+
+    def _end_page(self):
+        contents, length, start = self.content
+        size = self.file.tell() - start
+        self.file.write(b'endstream\nendobj\n')
+
+        # the stream's length is an indirect object, since it isn't known until now
+        self._begin_object(length)
+        self.file.write(f'{size}\nendobj\n'.encode('ascii'))
+
+        page, = self._allocate(1)
+        self._begin_object(page)
+        self.file.write((
+            f'<< /Type /Page /Parent {self.PAGES} 0 R /MediaBox [0 0 {self.width} {self.height}] '
+            f'/Contents {contents} 0 R >>\nendobj\n'
+        ).encode('ascii'))
+        self.pages.append(page)
+        self.content = None
+
+    def stroke(self, segments, line_width, color):
+        if not segments:
+            return
+        if self.content is None:
+            self._begin_page()
+
+        commands = [f'{_format_number(line_width)} w', ' '.join(_format_number(c) for c in color) + ' RG']
+        for points in _polylines(segments):
+            (x, y), *rest = points
+            commands.append(f'{_format_number(x)} {_format_number(y)} m')
+            commands.extend(f'{_format_number(x)} {_format_number(y)} l' for x, y in rest)
+        commands.append('S\n')
+        self.file.write('\n'.join(commands).encode('ascii'))
+
+    def showpage(self):
+        if self.content is None:
+            self._begin_page()
+        self._end_page()
+
+    def close(self):
+        if self.content is not None:
+            self._end_page()
+
+        self._begin_object(self.PAGES)
+        kids = ' '.join(f'{page} 0 R' for page in self.pages)
+        self.file.write(f'<< /Type /Pages /Kids [{kids}] /Count {len(self.pages)} >>\nendobj\n'.encode('ascii'))
+        self._begin_object(self.CATALOG)
+        self.file.write(f'<< /Type /Catalog /Pages {self.PAGES} 0 R >>\nendobj\n'.encode('ascii'))
+
+        xref = self.file.tell()
+        self.file.write(f'xref\n0 {self.next_object}\n0000000000 65535 f \n'.encode('ascii'))
+        for number in range(1, self.next_object):
+            self.file.write(f'{self.offsets[number]:010d} 00000 n \n'.encode('ascii'))
+        self.file.write((
+            f'trailer\n<< /Size {self.next_object} /Root {self.CATALOG} 0 R >>\n'
+            f'startxref\n{xref}\n%%EOF\n'
+        ).encode('ascii'))
+        self.file.close()
+
+class RasterDevice(Device):
+    '''
+    Paints into an RGB framebuffer (a NumPy array) at one pixel per point, writing each page
+    out as a PNG or PPM (format, which defaults to output's extension) on showpage - a %d in
+    output is replaced with the page number
+    '''
+    def __init__(self, output='page-%d.png', width=612, height=792, format=None):
+        # only needed for actually drawing things, so it's not a hard dependency
+        import numpy
+
+        self.np = numpy
+        self.output = output
+        self.format = format or os.path.splitext(output)[1].removeprefix('.').lower()
+        self.width = width
+        self.height = height
+        self.page = 1
+        self.pixels = numpy.full((height, width, 3), 255, dtype=numpy.uint8)
+
+    def stroke(self, segments, line_width, color):
+        '''
+        Draw every segment in one vectorized batch - sample each segment at least once per
+        pixel along its length, then stamp a round pen of the line width at every sample
+        '''
+        np = self.np
+        if not segments:
+            return
+
+        segments = np.asarray(segments, dtype=np.float64)
+        start = segments[:, :2]
+        delta = segments[:, 2:] - start
+
+        counts = np.ceil(np.hypot(delta[:, 0], delta[:, 1])).astype(np.intp) + 1
+        owner = np.repeat(np.arange(len(segments)), counts)
+        # position of each sample along its segment, from 0 to 1
+        steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        t = steps / np.maximum(counts - 1, 1)[owner]
+        samples = np.rint(start[owner] + delta[owner] * t[:, None]).astype(np.intp)
+
+        radius = max(line_width, 1) / 2
+        reach = int(np.ceil(radius))
+        dx, dy = np.mgrid[-reach:reach+1, -reach:reach+1]
+        inside = dx * dx + dy * dy <= radius * radius
+        pen = np.stack([dx[inside], dy[inside]], axis=1)
+
+        points = (samples[:, None, :] + pen[None, :, :]).reshape(-1, 2)
+        x = points[:, 0]
+        # PostScript's origin is at the bottom left, the framebuffer's is at the top left
+        y = self.height - 1 - points[:, 1]
+        visible = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+
+        self.pixels[y[visible], x[visible]] = np.rint(np.asarray(color) * 255).astype(np.uint8)
+
+    def showpage(self):
+        with open(_page_filename(self.output, self.page), 'wb') as f:
+            if self.format == 'ppm':
+                self.write_ppm(f)
             else:
-                valid_types = tuple(itertools.chain.from_iterable(typing.get_args(TYPE_MAPPING[t]) if isinstance(TYPE_MAPPING[t], types.UnionType) else (TYPE_MAPPING[t],) for t in valid_types))
+                self.write_png(f)
+
+        self.page += 1
+        self.pixels[...] = 255
+
+    def write_ppm(self, f):
+        f.write(f'P6 {self.width} {self.height} 255\n'.encode('ascii'))
+        f.write(self.pixels.tobytes())
+
+    def write_png(self, f):
+        np = self.np
+
+        def chunk(kind, data):
+            f.write(struct.pack('>I', len(data)) + kind + data)
+            f.write(struct.pack('>I', zlib.crc32(kind + data)))
+
+        # every row starts with a filter type byte, which is 0 (none) for all of them
+        rows = np.zeros((self.height, 1 + self.width * 3), dtype=np.uint8)
+        rows[:, 1:] = self.pixels.reshape(self.height, -1)
+
+        f.write(b'\x89PNG\r\n\x1a\n')
+        chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, 2, 0, 0, 0))
+        chunk(b'IDAT', zlib.compress(rows.tobytes()))
+        chunk(b'IEND', b'')
+
+DEVICE_FORMATS = ('png', 'ppm', 'svg', 'pdf')
+
+def open_device(output, format=None):
+    '''
+    Make a device that writes to output, in format (one of DEVICE_FORMATS) or else whatever
+    output's extension says
+    '''
+    format = format or os.path.splitext(output)[1].removeprefix('.').lower()
+    if format in ('png', 'ppm'):
+        return RasterDevice(output, format=format)
+    elif format == 'svg':
+        return SVGDevice(output)
+    elif format == 'pdf':
+        return PDFDevice(output)
+    raise ValueError(f'unknown output format {format!r}')
+
+def _uses_tags(word):
+    if word.tag is not None:
+        return True
+    if isinstance(word, ArrayValue):
+        return word.args is not None or any(_uses_tags(w) for w in word.value)
+    return False
+
+# dictionary stack versions, shared by all interpreters so that no two are ever the same
+dictionary_versions = itertools.count()
+
+# changes whenever an array's been changed in place (by bind), so anything that caches arrays'
+# printed forms knows to forget them
+array_edits = 0
+
+class Interpreter:
+    def __init__(self, bind_procs=False, jit_threshold=None, optimize=False, device=None, limits=None):
+        self.operand_stack = OperandStack()
+        self.execution_stack = deque()
+        # definitions go into userdict (or whatever's been begun since), never systemdict, so
+        # interpreters don't see each other's
+        self.userdict = {}
+        self.dictionary_stack = ChainMap(self.userdict, systemdict)
+        # changes whenever what a name looks up to might have - anything that changes the
+        # dictionary stack calls dictionary_changed
+        self.dictionary_version = next(dictionary_versions)
+        self.graphics_state = GraphicsState()
+        # saved by gsave
+        self.graphics_state_stack = []
+        self.device = device if device is not None else Device()
+
+        # whether to automatically bind procedures as they're built
+        self.bind_procs = bind_procs
+
+        # whether to run the peephole optimizer over procedures as they're built
+        self.optimize = optimize
+
+        # if set, procedures are compiled to Python functions once they've been called this many
+        # times - this only happens under run, since compiled procedures can't be stepped through
+        self.jit_threshold = jit_threshold
+        self.jit_active = False
+        self.jit_depth = 0
+
+        # if set, run enforces these (see Limits) - operations and allocated are totals over
+        # the interpreter's lifetime
+        self.limits = limits
+        self.operations = 0
+        # elements in the arrays and dictionaries made so far, which operators that make them add to
+        self.allocated = 0
+        # how deep the execution stack was when execute asked it for the word it last yielded -
+        # see Debugger.step_over
+        self.step_depth = 0
 
-            assert isinstance(arg, valid_types), f'got {type(arg).__name__}, expected any of {", ".join(t.__name__ for t in valid_types)}'
-            retvals.append(arg.value if unwrap else arg)
+    def _describe_graphics_state(self):
+        gs = self.graphics_state
+        if gs.current_point is None:
+            point = '(no current point)'
+        else:
+            point = f'({gs.current_point[0]}, {gs.current_point[1]})'
+        segments = sum(1 for entry in itertools.islice(gs.path, gs.path_length) if len(entry) == 4)
+        return '\n'.join([
+            point,
+            f'{segments} segments',
+            'matrix [{} {} {} {} {} {}]'.format(*gs.ctm),
+            f'line width {gs.line_width}',
+            'color ({}, {}, {})'.format(*gs.color),
+            f'{len(self.graphics_state_stack)} saved',
+        ])
 
-        # we didn't want to alter the stack unless everything looks good - now that we know that, we
-        # can pop the values we've gathered
-        for _ in signature:
-            self.operand_stack.pop()
+    def look_up(self, name):
+        '''
+        What name (a string or a symbol) is currently defined as
+        '''
+        if isinstance(name, str):
+            name = symbols.intern(name)
+        try:
+            return self.dictionary_stack[name]
+        except KeyError:
+            # report the name rather than its id
+            raise KeyError(symbols.name(name)) from None
+
+    def dictionary_changed(self):
+        '''
+        Invalidate names' cached lookups - see NameValue.lookup_cache
+        '''
+        self.dictionary_version = next(dictionary_versions)
+
+    def bind(self, proc, recursive=True):
+        '''
+        Replace executable names in proc that currently refer to operators with direct
+        references to those operators, so executing them skips the dictionary lookup
+        '''
+        global array_edits
+        array_edits += 1
+        proc.compiled = None
+        words = proc.value
+        for idx, word in enumerate(words):
+            if isinstance(word, NameValue) and word.executable:
+                c = self.dictionary_stack.get(word.symbol)
+                if c is not None and not isinstance(c, Value):
+                    words[idx] = OperatorValue(
+                        value=c,
+                        name=word.value,
+                        executable=True,
+                        # the same location (and tag) as the name, without registering a copy
+                        token=word.token,
+                        source=word.source,
+                    )
+            elif recursive and isinstance(word, ArrayValue) and word.executable:
+                self.bind(word)
 
-        return reversed(retvals)
+    def check_arity(self, *signature):
+        return pop_operands(self, compile_signature(signature), len(signature))
+
+    def assemble(self, tokens):
+        '''
+        Turn a stream of tokens from a Scanner (or words already parsed by parse_program, eg.
+        from load_program) into a stream of top-level words ready to execute
+        '''
+        for word in parse_program(tokens):
+            if not isinstance(self.operand_stack, TaggedOperandStack) and _uses_tags(word):
+                self.enable_tags()
+            yield self._finish(word)
+
+    def enable_tags(self):
+        '''
+        Start tracking operand tags, which the interpreter does as soon as it comes across
+        a program that uses them
+        '''
+        if not isinstance(self.operand_stack, TaggedOperandStack):
+            self.operand_stack = TaggedOperandStack(self.operand_stack)
+            # compiled procedures don't keep tags with values they move around
+            self.jit_active = False
+
+    def _finish(self, word):
+        '''
+        Do the parts of assembling a parsed word that depend on the interpreter's state -
+        resolving //names, and binding and optimizing procedures, innermost first
+        '''
+        if isinstance(word, ImmediateNameValue):
+            c = self.look_up(word.symbol)
+            if not isinstance(c, Value):
+                c = OperatorValue(value=c, name=word.value, executable=True, token=word.token, source=word.source)
+            return c
+
+        if isinstance(word, ArrayValue) and word.executable:
+            words = word.value
+            for idx, w in enumerate(words):
+                if isinstance(w, (ImmediateNameValue, ArrayValue)):
+                    words[idx] = self._finish(w)
+
+            if self.bind_procs:
+                self.bind(word, recursive=False)
+            if self.optimize:
+                optimize_procedure(self, word)
+
+        return word
+
+    def _unwind(self, depth):
+        while len(self.execution_stack) > depth:
+            self.execution_stack.pop().leave(self)
 
     def execute(self, program):
-        f = Frame(program)
-        self.execution_stack.append(f)
+        '''
+        Execute program one word at a time, yielding each word before it's executed - this is
+        what the debugger uses to step through a program.  Limits aren't enforced here, only in
+        run (see Limits).
+        '''
+        xs = self.execution_stack
+        base = len(xs)
+        xs.append(ProgramFrame(self.assemble(program)))
 
         try:
-            for word in program:
-                assert f == self.execution_stack[-1] # XXX sanity check
-
-                if self._is_building_executable_array():
-                    if isinstance(word, EndProcValue):
-                        array = []
-                        while not isinstance(self.operand_stack[-1], StartProcValue):
-                            array.append(self.operand_stack.pop())
-                        start_proc_word = self.operand_stack.pop() # pop the start proc
-                        array.reverse()
-                        self.operand_stack.append(ArrayValue(
-                            value=array,
-                            executable=True,
-                            line=start_proc_word.line,
-                            column=start_proc_word.column,
-                            length=1,
-                            tag=word.tag,
-                            args=start_proc_word.args,
-                        ))
-                    else:
-                        self.operand_stack.append(word)
+            while len(xs) > base:
+                self.step_depth = len(xs)
+                word = xs[-1].next_word(self)
+                if word is None:
+                    xs.pop().leave(self)
                 else:
                     yield word
-                    maybe_gen = word.execute(self, direct=True)
-                    if inspect.isgenerator(maybe_gen):
-                        yield from maybe_gen
+                    word.execute(self, direct=True)
         finally:
-            self.execution_stack.pop()
-        assert not self._is_building_executable_array() # XXX right?
+            self._unwind(base)
+
+    def run(self, program):
+        '''
+        Execute program to completion without yielding - this is the same dispatch loop as
+        execute, minus the per-word generator machinery that stepping needs, so it's what batch
+        runs should use.
+        '''
+        xs = self.execution_stack
+        base = len(xs)
+        xs.append(ProgramFrame(self.assemble(program)))
+
+        jit_active = self.jit_active
+        # compiled procedures don't go through the dispatch loop, so limits couldn't be enforced,
+        # and they don't keep tags with the values they move around (see enable_tags)
+        self.jit_active = self.jit_threshold is not None and self.limits is None and not isinstance(self.operand_stack, TaggedOperandStack)
+        try:
+            if self.limits is None:
+                self.run_frames(base)
+            else:
+                self._run_limited(base)
+        finally:
+            self.jit_active = jit_active
+            self._unwind(base)
+
+    def run_frames(self, base):
+        '''
+        Run the dispatch loop until the execution stack is back down to base frames
+        '''
+        xs = self.execution_stack
+        while len(xs) > base:
+            word = xs[-1].next_word(self)
+            if word is None:
+                xs.pop().leave(self)
+            else:
+                word.execute(self, direct=True)
+
+    def _run_limited(self, base):
+        '''
+        run_frames, checking limits as it goes - everything's checked here rather than in
+        operators, so they cost nothing at all when there are no limits.
+
+        The stacks and allocations are checked after every step, since a single step (copy,
+        dict) can grow them a long way.  Only the operation count and the clock are left to
+        every LIMIT_CHECK_INTERVAL steps: max_operations is still exact, since a batch never
+        runs past it, and the clock costs about as much as a step to read.
+        '''
+        limits = self.limits
+        max_operations = _limit(limits.max_operations)
+        max_operand_stack = _limit(limits.max_operand_stack)
+        max_execution_stack = _limit(limits.max_execution_stack)
+        max_allocated = _limit(limits.max_allocated)
+        deadline = math.inf if limits.time_limit is None else time.monotonic() + limits.time_limit
+
+        xs = self.execution_stack
+        while len(xs) > base:
+            # every time round counts, so even a loop with an empty body runs out eventually
+            if self.operations >= max_operations:
+                raise LimitCheck(f'more than {max_operations} operations')
+            if time.monotonic() > deadline:
+                raise LimitCheck(f'ran for more than {limits.time_limit} seconds')
+
+            steps = 0
+            try:
+                for steps in range(1, min(LIMIT_CHECK_INTERVAL, max_operations - self.operations) + 1):
+                    word = xs[-1].next_word(self)
+                    if word is None:
+                        xs.pop().leave(self)
+                        # only the frame run started with can take us back down to base
+                        if len(xs) <= base:
+                            break
+                    else:
+                        word.execute(self, direct=True)
+
+                        if len(xs) > max_execution_stack:
+                            raise LimitCheck(f'execution stack deeper than {max_execution_stack}')
+                        if len(self.operand_stack) > max_operand_stack:
+                            raise LimitCheck(f'operand stack deeper than {max_operand_stack}')
+                        if self.allocated > max_allocated:
+                            raise LimitCheck(f'more than {max_allocated} array and dictionary elements')
+            finally:
+                self.operations += steps
 
-def postscript_function(fn):
-    expected_types = [ param.annotation for param in inspect.signature(fn).parameters.values() if param.name != 'i' ]
+class PostScriptError(Exception):
+    '''
+    An error in a PostScript program that's reported by name, like PostScript's own errors
+    '''
+    name = None
+
+    def __str__(self):
+        return f'{self.name}: {super().__str__()}'
 
-    @functools.wraps(fn)
-    def wrapper(i):
-        args = i.check_arity(*expected_types)
+class LimitCheck(PostScriptError):
+    '''
+    A program went over one of its interpreter's limits
+    '''
+    name = 'limitcheck'
 
-        return fn(i, *args)
+@dataclass(frozen=True)
+class Limits:
+    '''
+    Limits for Interpreter.run to enforce, raising LimitCheck when a program goes over one -
+    None means no limit.
 
+    Only run enforces them.  Interpreter.execute (and so the debugger) doesn't check them, and
+    neither do Profiler, TraceRecorder and MemoryTracker, which step the program themselves -
+    so a program that isn't trusted should only be given to run.
+    '''
+    # words executed (and frames finished), over the interpreter's lifetime
+    max_operations: Optional[int] = None
+    max_operand_stack: Optional[int] = None
+    max_execution_stack: Optional[int] = None
+    # elements in all arrays and dictionaries made, over the interpreter's lifetime
+    max_allocated: Optional[int] = None
+    # seconds each call of run may take
+    time_limit: Optional[float] = None
+
+# how many operations go by between checks of the limits
+LIMIT_CHECK_INTERVAL = 1024
+
+def _limit(n):
+    return math.inf if n is None else n
+
+# operator name -> compiled signature, for everything decorated with postscript_function
+operator_signatures = {}
+
+def postscript_function(fn):
+    expected_types = tuple( param.annotation for param in inspect.signature(fn).parameters.values() if param.name != 'i' )
+    signature = compile_signature(expected_types)
+    operator_signatures[fn.__name__] = signature
+
+    # the common arities get unrolled wrappers that validate and pop operands without
+    # building any intermediate lists
+    match signature:
+        case ((valid_types, unwrap),):
+            @functools.wraps(fn)
+            def wrapper(i):
+                stack = i.operand_stack
+                assert len(stack) >= 1, 'operand stack underflow'
+                a = stack[-1]
+                assert isinstance(a, valid_types), _type_mismatch(a, valid_types)
+                stack.pop()
+                return fn(i, a.value if unwrap else a)
+        case ((valid_types_a, unwrap_a), (valid_types_b, unwrap_b)):
+            @functools.wraps(fn)
+            def wrapper(i):
+                stack = i.operand_stack
+                assert len(stack) >= 2, 'operand stack underflow'
+                b = stack[-1]
+                a = stack[-2]
+                assert isinstance(a, valid_types_a), _type_mismatch(a, valid_types_a)
+                assert isinstance(b, valid_types_b), _type_mismatch(b, valid_types_b)
+                stack.pop()
+                stack.pop()
+                return fn(i, a.value if unwrap_a else a, b.value if unwrap_b else b)
+        case _:
+            arity = len(signature)
+
+            @functools.wraps(fn)
+            def wrapper(i):
+                return fn(i, *pop_operands(i, signature, arity))
+
+    wrapper.signature = signature
     return wrapper
 
 @postscript_function
 def op_add(i: Interpreter, lhs: int|float, rhs: int|float):
     res = lhs + rhs
-    if isinstance(res, float):
-        i.operand_stack.append(RealValue(
-            value=res,
-        ))
-    else:
-        i.operand_stack.append(IntegerValue(
-            value=res,
-        ))
+    i.operand_stack.append(number_value(res))
+
+@postscript_function
+def op_bind(i: Interpreter, proc: ArrayValue):
+    i.bind(proc)
+    i.operand_stack.append(proc)
 
 @postscript_function
 def op_copy(i: Interpreter, n: int):
-    for _ in range(n):
-        i.operand_stack.append(i.operand_stack[-n])
+    i.operand_stack.copy_top(n)
+
+def op_clear(i: Interpreter):
+    i.operand_stack.clear()
+
+def op_cleartomark(i: Interpreter):
+    i.operand_stack.pop_to_mark()
 
 def op_count(i: Interpreter):
-    i.operand_stack.append(IntegerValue(value=len(i.operand_stack)))
+    i.operand_stack.append(integer_value(len(i.operand_stack)))
+
+def op_counttomark(i: Interpreter):
+    i.operand_stack.append(integer_value(i.operand_stack.count_to_mark()))
+
+@postscript_function
+def op_def(i: Interpreter, key: NameValue | StringValue, value: Value):
+    i.dictionary_stack[dictionary_key(key, define=True)] = value
+    i.dictionary_changed()
 
 @postscript_function
-def op_def(i: Interpreter, name: str, value: Value):
-    i.dictionary_stack[name] = value
+def op_store(i: Interpreter, key: NameValue | StringValue, value: Value):
+    # replace the topmost definition, or define it in the current dictionary if there isn't one
+    name = dictionary_key(key, define=True)
+    for d in i.dictionary_stack.maps[:-1]:
+        if name in d:
+            break
+    else:
+        d = i.dictionary_stack.maps[0]
+    d[name] = value
+    i.dictionary_changed()
 
 def op_dup(i: Interpreter):
-    i.operand_stack.append(i.operand_stack[-1])
+    i.operand_stack.push_copy(0)
 
-@postscript_function
-def op_exch(i: Interpreter, lhs: Value, rhs: Value):
-    i.operand_stack.append(rhs)
-    i.operand_stack.append(lhs)
+def op_exch(i: Interpreter):
+    i.operand_stack.exch()
 
 @postscript_function
 def op_exec(i: Interpreter, fn: ArrayValue):
-    return fn.execute(i, direct=False)
+    fn.execute(i, direct=False)
 
 @postscript_function
 def op_for(i: Interpreter, init: int, incr: int, limit: int, fn: ArrayValue):
-    for j in range(init, limit+1, incr):
-        i.operand_stack.append(IntegerValue(
-            value=j,
-        ))
-        maybe_gen = fn.execute(i, direct=False)
-        if inspect.isgenerator(maybe_gen):
-            yield from maybe_gen
+    i.execution_stack.append(ForFrame(init, incr, limit, fn))
 
 @postscript_function
-def op_get(i: Interpreter, d: Value, key: Value):
-    i.operand_stack.append(d.value[key])
+def op_get(i: Interpreter, d: DictionaryValue, key: Value):
+    try:
+        value = d.value[dictionary_key(key)]
+    except KeyError:
+        raise KeyError(key.value) from None
+    i.operand_stack.append(value)
 
 @postscript_function
 def op_ifelse(i: Interpreter, cond: bool, proc_true: Value, proc_false: Value):
     if cond:
-        return proc_true.execute(i, direct=False)
+        proc_true.execute(i, direct=False)
     else:
-        return proc_false.execute(i, direct=False)
+        proc_false.execute(i, direct=False)
 
 @postscript_function
 def op_if(i: Interpreter, cond: bool, proc_true: Value):
     if cond:
-        return proc_true.execute(i, direct=False)
+        proc_true.execute(i, direct=False)
 
 @postscript_function
 def op_index(i: Interpreter, idx: int):
     assert idx >= 0
 
-    i.operand_stack.append(i.operand_stack[-1 - idx])
+    i.operand_stack.push_copy(idx)
 
 @postscript_function
-def op_known(i: Interpreter, d: Value, key: Value):
-    i.operand_stack.append(BooleanValue(
-        value=key in d.value,
-    ))
+def op_known(i: Interpreter, d: DictionaryValue, key: Value):
+    i.operand_stack.append(boolean_value(dictionary_key(key) in d.value))
 
 @postscript_function
 def op_mul(i: Interpreter, lhs: int|float, rhs: int|float):
     res = lhs * rhs
-
-    if isinstance(res, float):
-        i.operand_stack.append(RealValue(
-            value=res,
-        ))
-    else:
-        i.operand_stack.append(IntegerValue(
-            value=res,
-        ))
+    i.operand_stack.append(number_value(res))
 
 def op_pop(i: Interpreter):
     assert len(i.operand_stack) > 0, 'operand stack underflow'
@@ -515,8 +2239,8 @@ def op_pstack(i: Interpreter):
         i.print(v.__ps_repr__())
 
 def op_ptags(i: Interpreter):
-    for v in reversed(i.operand_stack):
-        i.print(str(v.tag))
+    for idx in range(len(i.operand_stack) - 1, -1, -1):
+        i.print(str(i.operand_stack.tag(idx)))
 
 def op_roll(i: Interpreter):
     # make sure we have enough arguments
@@ -530,31 +2254,12 @@ def op_roll(i: Interpreter):
 
     assert n > 0
 
-    window = deque(list(i.operand_stack)[-n:])
-
-    if j > 0:
-        for _ in range(j):
-            window.appendleft(window.pop())
-    else:
-        for _ in range(-j):
-            window.append(window.popleft())
+    i.operand_stack.roll(n, j)
 
-    for _ in range(n):
-        i.operand_stack.pop()
-    i.operand_stack.extend(window)
-
-# XXX return value (XXX would that mess with generators/stepping?)
 @postscript_function
 def op_sub(i: Interpreter, lhs: int|float, rhs: int|float):
     res = lhs - rhs
-    if isinstance(res, float):
-        i.operand_stack.append(RealValue(
-            value=res,
-        ))
-    else:
-        i.operand_stack.append(IntegerValue(
-            value=res,
-        ))
+    i.operand_stack.append(number_value(res))
 
 def stub(nargs: int, nret: int = 0):
     def stub_function(i: Interpreter):
@@ -566,70 +2271,153 @@ def stub(nargs: int, nret: int = 0):
     return stub_function
 
 def op_mark(i: Interpreter):
-    i.operand_stack.append(MarkValue())
+    i.operand_stack.append(MARK)
 
 def op_create_dictionary(i: Interpreter):
-    dict_args = []
-    while len(i.operand_stack) > 0 and not isinstance(i.operand_stack[-1], MarkValue):
-        dict_args.append(i.operand_stack.pop())
-    dict_args.reverse()
-
-    # pop the mark
-    i.operand_stack.pop()
+    dict_args = i.operand_stack.pop_to_mark()
+    i.allocated += len(dict_args) // 2
 
     i.operand_stack.append(DictionaryValue(
-        value={ k:v for k, v in zip(dict_args[0::2], dict_args[1::2]) },
+        value={ dictionary_key(k, define=True): v for k, v in zip(dict_args[0::2], dict_args[1::2]) },
     ))
 
-def op_create_array(i: Interpreter):
-    values = []
-    while len(i.operand_stack) > 0 and not isinstance(i.operand_stack[-1], MarkValue):
-        values.append(i.operand_stack.pop())
-    values.reverse()
+@postscript_function
+def op_dict(i: Interpreter, capacity: int):
+    assert capacity >= 0, 'rangecheck'
+    # capacity is just a hint - dictionaries grow as needed - but it still counts as allocated,
+    # so asking for a huge one is caught by Limits
+    i.allocated += capacity
+    i.operand_stack.append(DictionaryValue(value={}))
 
-    # pop the mark
-    i.operand_stack.pop()
+@postscript_function
+def op_begin(i: Interpreter, d: DictionaryValue):
+    i.dictionary_stack.maps.insert(0, d.value)
+    i.dictionary_changed()
+
+def op_end(i: Interpreter):
+    # userdict and systemdict can't be ended
+    assert len(i.dictionary_stack.maps) > 2, 'dictstackunderflow'
+    del i.dictionary_stack.maps[0]
+    i.dictionary_changed()
+
+def op_currentdict(i: Interpreter):
+    i.operand_stack.append(DictionaryValue(value=i.dictionary_stack.maps[0]))
+
+def op_create_array(i: Interpreter):
+    values = i.operand_stack.pop_to_mark()
+    i.allocated += len(values)
 
     i.operand_stack.append(ArrayValue(
         value=values,
     ))
 
 def op_currentpoint(i: Interpreter):
-    assert i.graphics_state is not None and i.graphics_state[0] is not None, 'no current point'
+    point = i.graphics_state.current_point
+    assert point is not None, 'no current point'
 
-    i.operand_stack.append(IntegerValue(
-        value=i.graphics_state[0],
-    ))
+    i.operand_stack.append(number_value(point[0]))
+    i.operand_stack.append(number_value(point[1]))
 
-    i.operand_stack.append(IntegerValue(
-        value=i.graphics_state[1],
-    ))
+@postscript_function
+def op_moveto(i: Interpreter, x: int|float, y: int|float):
+    gs = i.graphics_state
+    gs.current_point = gs.subpath_start = (x, y)
+
+@postscript_function
+def op_rmoveto(i: Interpreter, dx: int|float, dy: int|float):
+    gs = i.graphics_state
+    assert gs.current_point is not None, 'no current point'
+
+    x, y = gs.current_point
+    gs.current_point = gs.subpath_start = (x + dx, y + dy)
 
 @postscript_function
-def op_moveto(i: Interpreter, x: int, y: int):
-    assert i.graphics_state is not None, 'no current path'
-    i.graphics_state = (x, y)
+def op_lineto(i: Interpreter, x: int|float, y: int|float):
+    gs = i.graphics_state
+    assert gs.current_point is not None, 'no current point'
+
+    x0, y0 = gs.current_point
+    gs.add_segment((x0, y0, x, y))
+    gs.current_point = (x, y)
 
 @postscript_function
-def op_rmoveto(i: Interpreter, dx: int, dy: int):
-    assert i.graphics_state is not None, 'no current path'
-    assert i.graphics_state[0] is not None, 'no current point'
+def op_rlineto(i: Interpreter, dx: int|float, dy: int|float):
+    gs = i.graphics_state
+    assert gs.current_point is not None, 'no current point'
 
-    x, y = i.graphics_state
-    i.graphics_state = (x + dx, y + dy)
+    x0, y0 = gs.current_point
+    x, y = x0 + dx, y0 + dy
+    gs.add_segment((x0, y0, x, y))
+    gs.current_point = (x, y)
+
+def op_closepath(i: Interpreter):
+    gs = i.graphics_state
+    if gs.current_point is None:
+        return
+
+    if gs.current_point != gs.subpath_start:
+        gs.add_segment(gs.current_point + gs.subpath_start)
+    gs.current_point = gs.subpath_start
 
 def op_newpath(i: Interpreter):
-    i.graphics_state = (None, None)
+    i.graphics_state.clear_path()
 
 def op_stroke(i: Interpreter):
-    assert i.graphics_state is not None, 'no current path'
-    i.graphics_state = None
+    gs = i.graphics_state
+    i.device.stroke(gs.device_segments(), gs.device_line_width(), gs.color)
+    gs.clear_path()
+
+def op_gsave(i: Interpreter):
+    i.graphics_state_stack.append(i.graphics_state)
+    i.graphics_state = i.graphics_state.copy()
+
+def op_grestore(i: Interpreter):
+    # a grestore without a matching gsave does nothing
+    if i.graphics_state_stack:
+        restored = i.graphics_state_stack.pop()
+        if restored.path is i.graphics_state.path:
+            # whatever was added to the shared path since the gsave belonged to the state we're
+            # throwing away, so it can go without anyone having to copy the path
+            del restored.path[restored.path_length:]
+        i.graphics_state = restored
+
+@postscript_function
+def op_translate(i: Interpreter, tx: int|float, ty: int|float):
+    gs = i.graphics_state
+    gs.set_ctm(_concat_matrices((1.0, 0.0, 0.0, 1.0, tx, ty), gs.ctm))
+
+@postscript_function
+def op_scale(i: Interpreter, sx: int|float, sy: int|float):
+    gs = i.graphics_state
+    gs.set_ctm(_concat_matrices((sx, 0.0, 0.0, sy, 0.0, 0.0), gs.ctm))
+
+@postscript_function
+def op_rotate(i: Interpreter, angle: int|float):
+    gs = i.graphics_state
+    cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+    gs.set_ctm(_concat_matrices((cos, sin, -sin, cos, 0.0, 0.0), gs.ctm))
+
+@postscript_function
+def op_setlinewidth(i: Interpreter, width: int|float):
+    i.graphics_state.line_width = width
+
+@postscript_function
+def op_setrgbcolor(i: Interpreter, r: int|float, g: int|float, b: int|float):
+    i.graphics_state.color = tuple(min(max(c, 0.0), 1.0) for c in (r, g, b))
+
+@postscript_function
+def op_setgray(i: Interpreter, gray: int|float):
+    gray = min(max(gray, 0.0), 1.0)
+    i.graphics_state.color = (gray, gray, gray)
+
+def op_showpage(i: Interpreter):
+    i.device.showpage()
+    i.graphics_state = GraphicsState()
+    i.graphics_state_stack.clear()
 
 @postscript_function
 def op_eq(i: Interpreter, lhs: Value, rhs: Value):
-    i.operand_stack.append(BooleanValue(
-        value=lhs.value == rhs.value,
-    ))
+    i.operand_stack.append(boolean_value(lhs.value == rhs.value))
 
 core_vocabulary = {
     '<<':           op_mark,
@@ -638,39 +2426,1475 @@ core_vocabulary = {
     '[':            op_mark,
     ']':            op_create_array,
     'add':          op_add,
+    'begin':        op_begin,
+    'bind':         op_bind,
+    'clear':        op_clear,
+    'closepath':    op_closepath,
+    'cleartomark':  op_cleartomark,
     'copy':         op_copy,
     'count':        op_count,
+    'counttomark':  op_counttomark,
+    'currentdict':  op_currentdict,
     'currentpoint': op_currentpoint,
     'def':          op_def,
+    'dict':         op_dict,
     'dup':          op_dup,
+    'end':          op_end,
     'eq':           op_eq,
     'exch':         op_exch,
     'exec':         op_exec,
-    'false':        BooleanValue(value=False),
+    'false':        FALSE,
     'findfont':     stub(1, 1),
     'for':          op_for,
     'get':          op_get,
+    'grestore':     op_grestore,
+    'gsave':        op_gsave,
     'if':           op_if,
     'ifelse':       op_ifelse,
     'index':        op_index,
     'known':        op_known,
-    'lineto':       op_moveto,
+    'lineto':       op_lineto,
     'moveto':       op_moveto,
     'mul':          op_mul,
     'newpath':      op_newpath,
     'pop':          op_pop,
     'pstack':       op_pstack,
     'ptags':        op_ptags,
-    'rlineto':      op_rmoveto,
+    'rlineto':      op_rlineto,
     'rmoveto':      op_rmoveto,
     'roll':         op_roll,
+    'rotate':       op_rotate,
+    'scale':        op_scale,
     'scalefont':    stub(2, 1),
     'setfont':      stub(1),
-    'setlinewidth': stub(1),
-    'setrgbcolor':  stub(3),
+    'setgray':      op_setgray,
+    'setlinewidth': op_setlinewidth,
+    'setrgbcolor':  op_setrgbcolor,
     'show':         stub(1),
-    'showpage':     stub(0),
+    'showpage':     op_showpage,
+    'store':        op_store,
     'stroke':       op_stroke,
     'sub':          op_sub,
-    'true':         BooleanValue(value=True),
+    'translate':    op_translate,
+    'true':         TRUE,
+}
+
+# what's at the bottom of every interpreter's dictionary stack - shared between them, so it
+# can't be changed
+systemdict = types.MappingProxyType({ symbols.intern(name): op for name, op in core_vocabulary.items() })
+
+def _span(first, last):
+    '''
+    Source location keyword arguments for a value replacing the words first..last
+    '''
+    length = first.length
+    if first.line is not None and first.line == last.line:
+        length = last.column + last.length - first.column
+    return {'source': first.source, 'line': first.line, 'column': first.column, 'length': length}
+
+def _is_plain_number(v):
+    # tagged literals stay put, so that the tags still show up on the stack
+    return type(v) in (IntegerValue, RealValue) and v.tag is None
+
+def _is_plain_integer(v):
+    return type(v) is IntegerValue and v.tag is None
+
+ARITHMETIC_OPERATORS = {
+    op_add: operator.add,
+    op_sub: operator.sub,
+    op_mul: operator.mul,
+}
+
+def _fused_roll(n, j):
+    def roll(i):
+        i.operand_stack.roll(n, j)
+    return roll
+
+def _fused_index(k):
+    def index(i):
+        i.operand_stack.push_copy(k)
+    return index
+
+# the fused arithmetic below checks its operands before taking any of them, and leaves anything
+# that would fail to the operator itself, so errors leave the stack just as they would unfused
+
+def _fused_arith_const(op, rhs):
+    fn = ARITHMETIC_OPERATORS[op]
+    def arith_const(i):
+        stack = i.operand_stack
+        if not stack or not isinstance(stack[-1], NUMBER_TYPES):
+            stack.append(rhs)
+            op(i)
+            return
+        stack.append(number_value(fn(stack.pop().value, rhs.value)))
+    return arith_const
+
+def _fused_index_arith(k, op):
+    fn = ARITHMETIC_OPERATORS[op]
+    def index_arith(i):
+        stack = i.operand_stack
+        if len(stack) <= k or not isinstance(stack[-1], NUMBER_TYPES) or not isinstance(stack[-1 - k], NUMBER_TYPES):
+            stack.push_copy(k)
+            op(i)
+            return
+        rhs = stack[-1 - k]
+        stack.append(number_value(fn(stack.pop().value, rhs.value)))
+    return index_arith
+
+# (operands taken, operands left in their place) for operators whose effect on the stack
+# depth is fixed
+STACK_EFFECTS = {
+    op_add:  (2, 1),
+    op_sub:  (2, 1),
+    op_mul:  (2, 1),
+    op_dup:  (1, 2),
+    op_exch: (2, 2),
+    op_pop:  (1, 0),
 }
+
+LITERAL_TYPES = (IntegerValue, RealValue, StringValue, BooleanValue, ArrayValue, DictionaryValue, MarkValue)
+
+def _known_depth_after(word, op, before):
+    '''
+    How many operands are sure to be on the stack after word, given that before were sure to be
+    there beforehand - words we know nothing about could leave any number
+    '''
+    if isinstance(word, LITERAL_TYPES) or (type(word) is NameValue and not word.executable):
+        return before + 1
+    if op in STACK_EFFECTS:
+        taken, left = STACK_EFFECTS[op]
+        return max(before, taken) - taken + left
+    return 0
+
+def optimize_procedure(i, proc):
+    '''
+    Peephole-optimize an executable array in place: literal arithmetic is folded, `exch exch`
+    and `dup pop` are dropped, and literal-argument roll/index/arithmetic are fused into
+    superinstructions.  Like bind, this resolves the operators involved at the time it runs.
+    Fused values keep the source span of the words they replace, and tagged literals are left
+    alone, so the debugger still has something sensible to show.
+
+    Pairs are only dropped when earlier words in the procedure are known to have pushed the
+    operands they'd use, so a procedure that would underflow still does.
+    '''
+    def operator_of(word):
+        if isinstance(word, OperatorValue):
+            return word.value
+        if isinstance(word, NameValue) and word.executable:
+            c = i.dictionary_stack.get(word.symbol)
+            if c is not None and not isinstance(c, Value):
+                return c
+        return None
+
+    def bound(word, op):
+        if isinstance(word, OperatorValue):
+            return word
+        return OperatorValue(value=op, name=word.value, executable=True, token=word.token, source=word.source)
+
+    def fuse(words, fn):
+        return SuperinstructionValue(value=tuple(words), fn=fn, executable=True, **_span(words[0], words[-1]))
+
+    def fused_index(v):
+        if isinstance(v, SuperinstructionValue) and len(v.value) == 2 and operator_of(v.value[1]) is op_index:
+            return v.value[0].value
+        return None
+
+    out = []
+    # known[k] is how many operands are sure to be on the stack after out[k] - ones the
+    # procedure pushed itself, or that the words so far would have raised an error without.
+    # It's worked out as needed, and rewrites only ever touch the last word or two of out, so
+    # only the end of it can go stale.
+    known = []
+
+    def known_before(k):
+        while len(known) < k:
+            w = out[len(known)]
+            known.append(_known_depth_after(w, operator_of(w), known[-1] if known else 0))
+        return known[k - 1] if k > 0 else 0
+
+    for word in proc.value:
+        del known[max(len(out) - 1, 0):]
+        op = operator_of(word)
+
+        if op in ARITHMETIC_OPERATORS:
+            fn = ARITHMETIC_OPERATORS[op]
+            if len(out) >= 2 and _is_plain_number(out[-2]) and _is_plain_number(out[-1]):
+                lhs, rhs = out[-2], out[-1]
+                folded = _arith(lhs, rhs, fn)
+                out[-2:] = [type(folded)(value=folded.value, **_span(lhs, word))]
+                continue
+            if out and (k := fused_index(out[-1])) is not None:
+                out[-1] = fuse(out[-1].value + (bound(word, op),), _fused_index_arith(k, op))
+                continue
+            if out and _is_plain_number(out[-1]):
+                out[-1] = fuse((out[-1], bound(word, op)), _fused_arith_const(op, out[-1]))
+                continue
+        elif op is op_exch:
+            if out and operator_of(out[-1]) is op_exch and known_before(len(out) - 1) >= 2:
+                out.pop()
+                continue
+        elif op is op_pop:
+            if out and operator_of(out[-1]) is op_dup and known_before(len(out) - 1) >= 1:
+                out.pop()
+                continue
+        elif op is op_roll:
+            if len(out) >= 2 and _is_plain_integer(out[-2]) and _is_plain_integer(out[-1]) and out[-2].value > 0:
+                n, j = out[-2].value, out[-1].value
+                out[-2:] = [fuse((out[-2], out[-1], bound(word, op)), _fused_roll(n, j))]
+                continue
+        elif op is op_index:
+            if out and _is_plain_integer(out[-1]) and out[-1].value >= 0:
+                out[-1] = fuse((out[-1], bound(word, op)), _fused_index(out[-1].value))
+                continue
+
+        out.append(word)
+
+    proc.value = out
+    proc.compiled = None
+
+MAX_JIT_DEPTH = 100
+
+def _underflow():
+    raise AssertionError('operand stack underflow')
+
+def _check_type(v, valid_types):
+    assert isinstance(v, valid_types), _type_mismatch(v, valid_types)
+    return v
+
+def _arith(lhs, rhs, fn):
+    _check_type(lhs, (IntegerValue, RealValue))
+    _check_type(rhs, (IntegerValue, RealValue))
+    return number_value(fn(lhs.value, rhs.value))
+
+def _for_range(init, incr, limit):
+    if incr > 0:
+        return range(init, limit + 1, incr)
+    elif incr < 0:
+        return range(init, limit - 1, incr)
+    else:
+        return itertools.repeat(init) if init <= limit else ()
+
+class ProcCompiler:
+    '''
+    Translates an executable array into the source of an equivalent Python function
+
+    Operands that are pushed and consumed within a straight run of inlinable words (literals,
+    stack shuffling, arithmetic) live in Python locals - the "virtual stack" - and are only
+    flushed onto the real operand stack before anything that might look at it.  Bound
+    operators (see Interpreter.bind) can be inlined; names are still looked up at run time,
+    since they could be redefined.
+    '''
+
+    # how deeply to inline nested procedure bodies (Python limits statically nested blocks)
+    MAX_NESTING = 8
+
+    def __init__(self):
+        self.constants = {}
+        self.constant_names = {}
+        self.lines = []
+        self.indent = 1
+        self.nesting = 0
+        self.temps = 0
+
+        # list of (expression, known Value type or None, known constant or None)
+        self.vstack = []
+
+    def emit(self, line):
+        self.lines.append('    ' * self.indent + line)
+
+    def constant(self, obj):
+        name = self.constant_names.get(id(obj))
+        if name is None:
+            name = f'k{len(self.constants)}'
+            self.constants[name] = obj
+            self.constant_names[id(obj)] = name
+        return name
+
+    def temp(self):
+        self.temps += 1
+        return f't{self.temps}'
+
+    def flush(self):
+        if len(self.vstack) == 1:
+            self.emit(f'stack.append({self.vstack[0][0]})')
+        elif self.vstack:
+            self.emit(f'stack.extend(({", ".join(expr for expr, _, _ in self.vstack)},))')
+        self.vstack = []
+
+    def operand(self, depth):
+        '''
+        An expression for the operand depth places down from the top, and its known type, without
+        popping anything
+        '''
+        if depth < len(self.vstack):
+            expr, known, _ = self.vstack[-1 - depth]
+            return expr, known
+        return f'stack[{len(self.vstack) - 1 - depth}]', None
+
+    def require(self, op, n, valid_types=()):
+        '''
+        Check that there are at least n operands, and that the topmost len(valid_types) of them
+        (given bottom-first, None meaning anything goes) have the right types, before anything is
+        popped - if not, the virtual stack is flushed and op itself is called to raise the error,
+        so the stack is left just as the interpreter would leave it
+        '''
+        conditions = []
+        if n > len(self.vstack):
+            conditions.append(f'len(stack) >= {n - len(self.vstack)}')
+        for depth, types in zip(range(len(valid_types) - 1, -1, -1), valid_types):
+            expr, known = self.operand(depth)
+            if types is None or (known is not None and issubclass(known, types)):
+                continue
+            conditions.append(f'isinstance({expr}, {self.constant(types)})')
+
+        if conditions:
+            self.emit(f'if not ({" and ".join(conditions)}):')
+            self.indent += 1
+            if self.vstack:
+                self.emit(f'stack.extend(({", ".join(expr for expr, _, _ in self.vstack)},))')
+            self.emit(f'{self.constant(op)}(i)')
+            self.indent -= 1
+
+    def operands(self, n):
+        '''
+        Take the top n operands off the virtual stack, popping any that aren't there off the
+        real stack, and return them bottom-first - call require first, since this doesn't check
+        that they're there
+        '''
+        from_virtual = min(n, len(self.vstack))
+        from_real = n - from_virtual
+
+        real = []
+        if from_real:
+            for _ in range(from_real):
+                t = self.temp()
+                self.emit(f'{t} = stack.pop()')
+                real.append((t, None, None))
+            real.reverse()
+
+        virtual = self.vstack[len(self.vstack) - from_virtual:]
+        del self.vstack[len(self.vstack) - from_virtual:]
+        return real + virtual
+
+    def top_constant(self, idx=-1):
+        '''
+        The constant value at the given position on the virtual stack, if there is one
+        '''
+        if len(self.vstack) >= -idx:
+            return self.vstack[idx][2]
+        return None
+
+    def call(self, expr):
+        self.flush()
+        self.emit(expr)
+        # anything we call might push frames (procedure calls, loops) - run them to completion
+        self.emit('if len(xs) != depth: i.run_frames(depth)')
+
+    def compile_words(self, words):
+        for word in words:
+            if isinstance(word, OperatorValue):
+                inline = INLINE_OPERATORS.get(word.value)
+                if inline is None or not inline(self):
+                    self.call(f'{self.constant(word.value)}(i)')
+            elif isinstance(word, NameValue) and word.executable:
+                self.call(f'{self.constant(word)}.execute(i, True)')
+            elif isinstance(word, SuperinstructionValue):
+                # we can do better than the optimizer's fused implementation by inlining the
+                # original words
+                self.compile_words(word.value)
+            else:
+                self.vstack.append((self.constant(word), type(word), word))
+
+    def inlinable_proc(self, v):
+        return isinstance(v, ArrayValue) and v.executable and v.args is None and self.nesting < self.MAX_NESTING
+
+    def compile_body(self, proc, block=True):
+        '''
+        Compile a nested procedure body inline - if it's the body of a Python block, the
+        virtual stack is flushed on the way in and out so that every path agrees on it
+        '''
+        self.nesting += 1
+        if block:
+            self.flush()
+            self.indent += 1
+            start = len(self.lines)
+            self.compile_words(proc.value)
+            self.flush()
+            if len(self.lines) == start:
+                self.emit('pass')
+            self.indent -= 1
+        else:
+            self.compile_words(proc.value)
+        self.nesting -= 1
+
+    def source(self, proc):
+        self.compile_words(proc.value)
+        self.flush()
+        header = [
+            'def compiled(i):',
+            '    stack = i.operand_stack',
+            '    xs = i.execution_stack',
+            '    depth = len(xs)',
+        ]
+        return '\n'.join(header + self.lines) + '\n'
+
+NUMBER_TYPES = (IntegerValue, RealValue)
+
+# roll and copy windows bigger than this are left to the operators themselves, rather than
+# generating code for every element
+MAX_INLINE_WINDOW = 16
+
+def _inline_arith(op, fn):
+    symbol = {operator.add: '+', operator.sub: '-', operator.mul: '*'}[fn]
+
+    def inline(c):
+        c.require(op, 2, (NUMBER_TYPES, NUMBER_TYPES))
+        (lhs, lhs_type, _), (rhs, rhs_type, _) = c.operands(2)
+        t = c.temp()
+        checks = [ f'type({expr}) is IntegerValue' for expr, known in ((lhs, lhs_type), (rhs, rhs_type)) if known is not IntegerValue ]
+        fast = f'{t} = integer_value({lhs}.value {symbol} {rhs}.value)'
+        if checks:
+            c.emit(f'if {" and ".join(checks)}: {fast}')
+            c.emit(f'else: {t} = _arith({lhs}, {rhs}, {c.constant(fn)})')
+        else:
+            c.emit(fast)
+        c.vstack.append((t, None, None))
+        return True
+    return inline
+
+def _inline_dup(c):
+    c.require(op_dup, 1)
+    if c.vstack:
+        c.vstack.append(c.vstack[-1])
+    else:
+        t = c.temp()
+        c.emit(f'{t} = stack[-1]')
+        c.vstack.append((t, None, None))
+    return True
+
+def _inline_pop(c):
+    c.require(op_pop, 1)
+    if c.vstack:
+        c.vstack.pop()
+    else:
+        c.emit('stack.pop()')
+    return True
+
+def _inline_exch(c):
+    c.require(op_exch, 2)
+    lhs, rhs = c.operands(2)
+    c.vstack.extend((rhs, lhs))
+    return True
+
+def _literal_int(c, idx=-1):
+    v = c.top_constant(idx)
+    if type(v) is IntegerValue:
+        return v.value
+    return None
+
+def _inline_index(c):
+    idx = _literal_int(c)
+    if idx is None or idx < 0:
+        return False
+    c.require(op_index, idx + 2)
+    c.vstack.pop()
+    if idx < len(c.vstack):
+        c.vstack.append(c.vstack[-1 - idx])
+    else:
+        t = c.temp()
+        c.emit(f'{t} = stack[{len(c.vstack) - 1 - idx}]')
+        c.vstack.append((t, None, None))
+    return True
+
+def _inline_copy(c):
+    n = _literal_int(c)
+    if n is None or not 0 <= n <= MAX_INLINE_WINDOW:
+        return False
+    c.require(op_copy, n + 1)
+    c.vstack.pop()
+    values = c.operands(n)
+    c.vstack.extend(values + values)
+    return True
+
+def _inline_roll(c):
+    n = _literal_int(c, -2)
+    j = _literal_int(c, -1)
+    if n is None or j is None or not 0 < n <= MAX_INLINE_WINDOW:
+        return False
+    c.require(op_roll, n + 2)
+    del c.vstack[-2:]
+    window = c.operands(n)
+    j %= n
+    c.vstack.extend(window[n - j:] + window[:n - j])
+    return True
+
+def _inline_exec(c):
+    proc = c.top_constant()
+    if not c.inlinable_proc(proc):
+        return False
+    c.vstack.pop()
+    c.compile_body(proc, block=False)
+    return True
+
+def _inline_if(c):
+    proc = c.top_constant()
+    if not c.inlinable_proc(proc):
+        return False
+    c.require(op_if, 2, ((BooleanValue,), None))
+    c.vstack.pop()
+    (cond, _, _), = c.operands(1)
+    c.flush()
+    c.emit(f'if {cond}.value:')
+    c.compile_body(proc)
+    return True
+
+def _inline_ifelse(c):
+    proc_true = c.top_constant(-2)
+    proc_false = c.top_constant(-1)
+    if not c.inlinable_proc(proc_true) or not c.inlinable_proc(proc_false):
+        return False
+    c.require(op_ifelse, 3, ((BooleanValue,), None, None))
+    del c.vstack[-2:]
+    (cond, _, _), = c.operands(1)
+    c.flush()
+    c.emit(f'if {cond}.value:')
+    c.compile_body(proc_true)
+    c.emit('else:')
+    c.compile_body(proc_false)
+    return True
+
+def _inline_for(c):
+    proc = c.top_constant()
+    if not c.inlinable_proc(proc):
+        return False
+    c.require(op_for, 4, ((IntegerValue,), (IntegerValue,), (IntegerValue,), None))
+    c.vstack.pop()
+    init, incr, limit = ( expr for expr, _, _ in c.operands(3) )
+    c.flush()
+    counter = c.temp()
+    c.emit(f'for {counter} in _for_range({init}.value, {incr}.value, {limit}.value):')
+    c.indent += 1
+    c.nesting += 1
+    pushed = c.temp()
+    c.emit(f'{pushed} = integer_value({counter})')
+    c.vstack.append((pushed, IntegerValue, None))
+    c.compile_words(proc.value)
+    c.flush()
+    c.nesting -= 1
+    c.indent -= 1
+    return True
+
+INLINE_OPERATORS = {
+    op_add:    _inline_arith(op_add, operator.add),
+    op_sub:    _inline_arith(op_sub, operator.sub),
+    op_mul:    _inline_arith(op_mul, operator.mul),
+    op_dup:    _inline_dup,
+    op_pop:    _inline_pop,
+    op_exch:   _inline_exch,
+    op_index:  _inline_index,
+    op_copy:   _inline_copy,
+    op_roll:   _inline_roll,
+    op_exec:   _inline_exec,
+    op_if:     _inline_if,
+    op_ifelse: _inline_ifelse,
+    op_for:    _inline_for,
+}
+
+def compile_procedure(proc):
+    '''
+    Compile an executable array into a Python function taking the interpreter
+    '''
+    c = ProcCompiler()
+    source = c.source(proc)
+
+    namespace = {
+        'IntegerValue': IntegerValue,
+        'BooleanValue': BooleanValue,
+        'integer_value': integer_value,
+        '_arith': _arith,
+        '_for_range': _for_range,
+        **c.constants,
+    }
+    filename = f'<proc at line {proc.line}>' if proc.line is not None else '<proc>'
+    exec(compile(source, filename, 'exec'), namespace)
+    compiled = namespace['compiled']
+    compiled.source = source
+    return compiled
+
+def _call_name(word):
+    '''
+    The name a profile files time spent executing word under, or None if it isn't a call of
+    anything (eg. a literal)
+    '''
+    if isinstance(word, NameValue):
+        return word.value if word.executable else None
+    elif isinstance(word, OperatorValue):
+        return word.name
+    elif isinstance(word, SuperinstructionValue):
+        return word.__ps_repr__()
+    return None
+
+class Profiler:
+    '''
+    Runs programs while timing every call of an operator or procedure - counting calls and
+    cumulative and self time by name, self time by source location of the calling word, and
+    self time by call stack (for flame graphs).
+
+    This has its own copy of the dispatch loop, so Interpreter.run doesn't pay anything for
+    profiling being possible.  Compiled procedures aren't used while profiling.
+    '''
+    def __init__(self, i, root='(top level)'):
+        self.i = i
+        self.root = root
+
+        self.calls = Counter()
+        self.cumulative = Counter()
+        self.self_time = Counter()
+        # (line, column) -> self time
+        self.locations = Counter()
+        # tuple of names, outermost first -> self time
+        self.stacks = Counter()
+
+    def run(self, program):
+        i = self.i
+        xs = i.execution_stack
+        base = len(xs)
+        xs.append(ProgramFrame(i.assemble(program)))
+        clock = time.perf_counter_ns
+
+        # calls that haven't finished yet, mirroring the execution stack - each is [name, depth,
+        # start time, time spent in calls it made, calling word] and finishes once the execution
+        # stack is back down to depth, ie. once any frames it pushed are done with
+        open_calls = [[self.root, base, clock(), 0, None]]
+
+        try:
+            while len(xs) > base:
+                word = xs[-1].next_word(i)
+                if word is None:
+                    xs.pop().leave(i)
+                else:
+                    name = _call_name(word)
+                    if name is not None:
+                        open_calls.append([name, len(xs), clock(), 0, word])
+                    word.execute(i, direct=True)
+
+                # procedures pop their own frame before returning their last word (so tail
+                # calls don't grow the execution stack), so this only happens after executing it
+                while len(open_calls) > 1 and len(xs) <= open_calls[-1][1]:
+                    self._finish(open_calls, clock())
+        finally:
+            i._unwind(base)
+            now = clock()
+            while open_calls:
+                self._finish(open_calls, now)
+
+    def _finish(self, open_calls, now):
+        name, _, start, callee_time, word = open_calls.pop()
+        elapsed = now - start
+        own = elapsed - callee_time
+
+        self.calls[name] += 1
+        self.self_time[name] += own
+        # recursive calls are already counted by the outermost one
+        if all(call[0] != name for call in open_calls):
+            self.cumulative[name] += elapsed
+        if word is not None and word.line is not None:
+            self.locations[(word.line, word.column)] += own
+        self.stacks[tuple(call[0] for call in open_calls) + (name,)] += own
+
+        if open_calls:
+            open_calls[-1][3] += elapsed
+
+    def report(self, limit=20):
+        '''
+        Lines of a human-readable summary - the calls and source locations with the most time
+        '''
+        lines = [f'{"calls":>10} {"cumulative ms":>14} {"self ms":>10}  name']
+        for name, cumulative in self.cumulative.most_common(limit):
+            lines.append(f'{self.calls[name]:>10} {cumulative / 1e6:>14.3f} {self.self_time[name] / 1e6:>10.3f}  {name}')
+
+        lines.append('')
+        lines.append(f'{"self ms":>10}  line:column')
+        for (line, column), own in self.locations.most_common(limit):
+            lines.append(f'{own / 1e6:>10.3f}  {line}:{column}')
+
+        return lines
+
+    def write_collapsed_stacks(self, f):
+        '''
+        Write self time (in microseconds) by call stack in the "collapsed" format that
+        flamegraph.pl, speedscope, inferno and friends read - one `a;b;c count` line per stack
+        '''
+        for stack, own in sorted(self.stacks.items()):
+            micros = own // 1000
+            if micros > 0:
+                f.write(';'.join(name.replace(';', ':').replace(' ', '_') for name in stack) + f' {micros}\n')
+
+def _location(word):
+    return None if word is None or word.line is None else (word.line, word.column)
+
+class MemoryTracker:
+    '''
+    Steps through programs keeping track of how much they use - operand stack depth and
+    dictionary stack size after every step (a histogram of depths, and where they peaked), and
+    every Value created, by type and by the operator that created it (or "(source)" for values
+    from the program text, whether they're scanned or loaded from cache).  Interned values
+    aren't allocations, so they aren't counted.  What's kept doesn't grow with the length of
+    the run.
+
+    execute is a drop-in for Interpreter.execute, so the debugger can show this live.  Only
+    values created while our interpreter is taking a step are counted, on whichever thread is
+    stepping it, so other interpreters running at the same time don't show up.
+    '''
+    def __init__(self, i):
+        self.i = i
+
+        self.steps = 0
+        # operand stack depth -> how many steps ended with the stack that deep
+        self.stack_depths = Counter()
+        self.peak_stack_depth = 0
+        self.peak_stack_location = None
+        self.peak_dictionaries = 0
+        self.peak_definitions = 0
+        self.peak_definitions_location = None
+
+        self.allocations_by_type = Counter()
+        self.allocations_by_operator = Counter()
+        # type name -> (number of elements, location, creating operator) of the biggest one made
+        self.largest = {}
+
+        self.current_word = None
+
+    def _allocated(self, value):
+        creator = '(source)' if value.source is not None else (_call_name(self.current_word) or '(literal)')
+        kind = type(value).__name__
+        self.allocations_by_type[kind] += 1
+        self.allocations_by_operator[creator] += 1
+
+        if isinstance(value, (ArrayValue, DictionaryValue)) and value.value is not None:
+            size = len(value.value)
+            if size > self.largest.get(kind, (-1,))[0]:
+                self.largest[kind] = (size, _location(self.current_word), creator)
+
+    def _record_step(self):
+        i = self.i
+        word = self.current_word
+
+        depth = len(i.operand_stack)
+        self.stack_depths[depth] += 1
+        if depth > self.peak_stack_depth:
+            self.peak_stack_depth = depth
+            self.peak_stack_location = _location(word)
+
+        maps = i.dictionary_stack.maps
+        self.peak_dictionaries = max(self.peak_dictionaries, len(maps))
+        definitions = sum(len(m) for m in maps)
+        if definitions > self.peak_definitions:
+            self.peak_definitions = definitions
+            self.peak_definitions_location = _location(word)
+
+        self.steps += 1
+
+    def execute(self, program):
+        stepper = self.i.execute(program)
+        try:
+            while True:
+                # the step happens while the stepper is working out the next word
+                previous_hook = allocation_hook.hook
+                allocation_hook.hook = self._allocated
+                try:
+                    word = next(stepper, None)
+                finally:
+                    allocation_hook.hook = previous_hook
+
+                if self.current_word is not None:
+                    self._record_step()
+                if word is None:
+                    break
+                self.current_word = word
+                yield word
+        finally:
+            stepper.close()
+            self.current_word = None
+
+    def run(self, program):
+        for _ in self.execute(program):
+            pass
+
+    def summary(self):
+        '''
+        A few lines for the debugger's live panel
+        '''
+        def at(location):
+            return '' if location is None else f' at {location[0]}:{location[1]}'
+
+        return [
+            f'stack {len(self.i.operand_stack)}, peak {self.peak_stack_depth}{at(self.peak_stack_location)}',
+            f'dicts {len(self.i.dictionary_stack.maps)}, peak definitions {self.peak_definitions}{at(self.peak_definitions_location)}',
+            f'{sum(self.allocations_by_type.values())} values allocated in {self.steps} steps',
+        ] + [
+            f'  {count} {name}' for name, count in self.allocations_by_operator.most_common(3)
+        ]
+
+    def report(self, limit=10):
+        '''
+        Lines of an end-of-run report
+        '''
+        def at(location):
+            return '' if location is None else f' at line {location[0]}, column {location[1]}'
+
+        i = self.i
+        lines = [
+            f'steps: {self.steps}',
+            f'operand stack: peak depth {self.peak_stack_depth}{at(self.peak_stack_location)}, {len(i.operand_stack)} left at the end',
+            f'dictionary stack: peak {self.peak_dictionaries} dictionaries, peak {self.peak_definitions} definitions{at(self.peak_definitions_location)}',
+            f'allocations: {sum(self.allocations_by_type.values())}',
+        ]
+
+        lines.append('  by type:')
+        for name, count in self.allocations_by_type.most_common(limit):
+            lines.append(f'{count:>10}  {name}')
+        lines.append('  by operator:')
+        for name, count in self.allocations_by_operator.most_common(limit):
+            lines.append(f'{count:>10}  {name}')
+
+        for kind, (size, location, creator) in sorted(self.largest.items()):
+            lines.append(f'largest {kind}: {size} elements{at(location)}, made by {creator}')
+
+        if i.operand_stack:
+            lines.append('left on the operand stack:')
+            for v in list(reversed(i.operand_stack))[:limit]:
+                lines.append(f'  {v.__ps_repr__()}{at(_location(v))}')
+
+        return lines
+
+DEPTH_COMPARISONS = {
+    '<': operator.lt,
+    '<=': operator.le,
+    '=': operator.eq,
+    '==': operator.eq,
+    '!=': operator.ne,
+    '>=': operator.ge,
+    '>': operator.gt,
+}
+
+DEPTH_CONDITION_RE = re.compile(r'depth\s*(' + '|'.join(sorted(map(re.escape, DEPTH_COMPARISONS), key=len, reverse=True)) + r')\s*(\d+)')
+
+@dataclass(eq=False)
+class Breakpoint:
+    '''
+    A place for Debugger to stop - a source line, or calls of an operator or procedure by name,
+    optionally only when the operand stack depth satisfies a condition (eg. ('>=', 10)).  A
+    breakpoint with just a condition stops wherever the condition becomes true.
+    '''
+    line: Optional[int] = None
+    name: Optional[str] = None
+    condition: Optional[tuple[str, int]] = None
+
+    @classmethod
+    def parse(cls, spec):
+        '''
+        Parse breakpoints as written on the command line - "12", "add", "12 if depth > 3",
+        "depth >= 100"
+        '''
+        where, _, condition = spec.partition(' if ')
+        where = where.strip()
+        condition = condition.strip()
+        if not condition and DEPTH_CONDITION_RE.fullmatch(where):
+            where, condition = '', where
+
+        line = name = None
+        if where.isdigit():
+            line = int(where)
+        elif where:
+            name = where
+
+        if condition:
+            m = DEPTH_CONDITION_RE.fullmatch(condition)
+            if m is None:
+                raise ValueError(f'invalid breakpoint condition {condition!r}')
+            condition = (m.group(1), int(m.group(2)))
+        else:
+            condition = None
+
+        if line is None and name is None and condition is None:
+            raise ValueError(f'empty breakpoint {spec!r}')
+        return cls(line=line, name=name, condition=condition)
+
+    def matches(self, word, depth):
+        if self.line is not None and word.line != self.line:
+            return False
+        if self.name is not None and self.name not in _called_names(word):
+            return False
+        if self.condition is not None:
+            comparison, n = self.condition
+            return DEPTH_COMPARISONS[comparison](depth, n)
+        return True
+
+    def __str__(self):
+        pieces = []
+        if self.line is not None:
+            pieces.append(f'line {self.line}')
+        if self.name is not None:
+            pieces.append(self.name)
+        if self.condition is not None:
+            pieces.append('if depth {} {}'.format(*self.condition))
+        return ' '.join(pieces)
+
+def _called_names(word):
+    if isinstance(word, SuperinstructionValue):
+        return [ _call_name(w) for w in word.value ]
+    return [_call_name(word)]
+
+class Debugger:
+    '''
+    Drives a stepper (Interpreter.execute, or a drop-in like MemoryTracker.execute) for the
+    debugger UI - single steps, stepping over and out of procedure calls, and running on to the
+    next breakpoint.  Each of these returns the word the program has stopped at, which is the
+    next one to be executed, or None once the program is done.
+
+    Nothing here touches the UI, so continuing runs as fast as the stepper does and the UI only
+    needs redrawing once it's stopped.
+
+    Line breakpoints stop when execution arrives on the line rather than at every word on it, and
+    condition-only ones when their condition becomes true; ones on a name stop at every call.
+
+    The UI changes breakpoints while a worker thread is running the program, so the list is
+    replaced rather than changed in place - a run checks whichever list was there when it looked.
+    '''
+    def __init__(self, i, stepper):
+        self.i = i
+        self.stepper = stepper
+        self.breakpoints = []
+        self.word = None
+        self.finished = False
+        # the breakpoint we last stopped at, if we stopped at one
+        self.hit = None
+        # breakpoints that matched the word we're stopped at, so we don't stop for them again
+        # until they stop matching
+        self.matched = set()
+
+    def toggle_line_breakpoint(self, line):
+        breakpoints = self.breakpoints
+        for bp in breakpoints:
+            if bp.line == line and bp.name is None and bp.condition is None:
+                self.breakpoints = [ other for other in breakpoints if other is not bp ]
+                return None
+        bp = Breakpoint(line=line)
+        self.breakpoints = breakpoints + [bp]
+        return bp
+
+    def breakpoint_lines(self):
+        return { bp.line for bp in self.breakpoints if bp.line is not None }
+
+    def _advance(self):
+        self.word = next(self.stepper, None)
+        if self.word is None:
+            self.finished = True
+        return self.word
+
+    def _hit_breakpoint(self):
+        '''
+        Check the breakpoints against the word we've just stopped at, returning the first one
+        that's been hit (if any)
+        '''
+        word = self.word
+        depth = len(self.i.operand_stack)
+        hit = None
+        matched = set()
+        for bp in self.breakpoints:
+            if bp.matches(word, depth):
+                matched.add(bp)
+                if hit is None and (bp.name is not None or bp not in self.matched):
+                    hit = bp
+        self.matched = matched
+        return hit
+
+    def _level(self):
+        '''
+        How deep in the execution stack the current word is - the depth of the frame that
+        returned it, which for the last word of a procedure is one more than the execution
+        stack depth, since that procedure has already popped its frame (see ProcFrame)
+        '''
+        xs = self.i.execution_stack
+        top = xs[-1]
+        if isinstance(top, ProgramFrame):
+            own = top.word is self.word
+        elif isinstance(top, ProcFrame):
+            own = top.pc > 0 and top.words[top.pc - 1] is self.word
+        else:
+            own = False
+        return len(xs) if own else len(xs) + 1
+
+    def _run_until(self, depth):
+        '''
+        Run until a breakpoint is hit, or until the next word comes from a frame that was asked
+        for it with the execution stack no deeper than depth (see Interpreter.step_depth)
+        '''
+        if self.finished:
+            return None
+        hit = None
+        while self._advance() is not None:
+            # always check breakpoints, so the ones that don't stop us here can still stop us
+            # when they stop and start matching again
+            hit = self._hit_breakpoint() if self.breakpoints else None
+            if hit is not None or (depth is not None and self.i.step_depth <= depth):
+                break
+        self.hit = hit if self.word is not None else None
+        return self.word
+
+    def step(self):
+        '''
+        Execute the current word, stopping at the next one wherever it is
+        '''
+        return self._run_until(math.inf)
+
+    def step_over(self):
+        '''
+        Execute the current word and anything it calls, stopping at the next word at this level
+        or above (or at a breakpoint on the way)
+        '''
+        if self.word is None:
+            return self.step()
+        # anything the word calls goes on top of the execution stack as it is now - which, for
+        # the last word of a procedure, is already without the procedure's own frame, so a tail
+        # call can't be mistaken for more of the procedure
+        return self._run_until(len(self.i.execution_stack))
+
+    def step_out(self):
+        '''
+        Run until the procedure the current word belongs to has returned (or a breakpoint is hit),
+        or to the end at the top level
+        '''
+        if self.word is None:
+            return self.step()
+        return self._run_until(self._level() - 1)
+
+    def continue_(self):
+        '''
+        Run until a breakpoint is hit or the program finishes
+        '''
+        return self._run_until(None)
+
+TRACE_VERSION = 1
+TRACE_MAGIC = b'PST' + bytes([TRACE_VERSION])
+
+# how much of a value's printed form goes into a trace, so a huge array costs no more to record
+# than a modest one
+TRACE_REPR_LIMIT = 1000
+
+class _WatchedStack:
+    '''
+    Mixed into an operand stack's class while TraceRecorder is recording, to keep track of the
+    lowest slot that's been popped, replaced or moved since low_water was last reset - every
+    slot below it still holds what it did then
+    '''
+    def _changed(self, idx):
+        if isinstance(idx, slice):
+            start = idx.indices(len(self))[0]
+        else:
+            start = idx + len(self) if idx < 0 else idx
+        if start < self.low_water:
+            self.low_water = max(start, 0)
+
+    def pop(self, idx=-1):
+        if idx == -1:
+            # the common case, so it gets a shortcut
+            top = len(self) - 1
+            if top < self.low_water:
+                self.low_water = top if top > 0 else 0
+        else:
+            self._changed(idx)
+        return super().pop(idx)
+
+    def __setitem__(self, idx, value):
+        self._changed(idx)
+        super().__setitem__(idx, value)
+
+    def __delitem__(self, idx):
+        self._changed(idx)
+        super().__delitem__(idx)
+
+    def insert(self, idx, value):
+        self._changed(idx)
+        super().insert(idx, value)
+
+    def clear(self):
+        self.low_water = 0
+        super().clear()
+
+    def exch(self):
+        self._changed(-2)
+        super().exch()
+
+    def roll(self, n, j):
+        if n > 0:
+            self._changed(-n)
+        super().roll(n, j)
+
+@functools.cache
+def _watched_class(cls):
+    return type('Watched' + cls.__name__, (_WatchedStack, cls), {})
+
+class TraceRecorder:
+    '''
+    Runs programs while writing a trace of every word executed to a file, for the debugger to
+    step through (forwards or backwards) afterwards without running the program again - see
+    Trace.
+
+    A trace is a series of marshalled chunks after a header: for each step the source location
+    of the word and how it changed the operand stack (how many values it dropped from the top,
+    and the ones it pushed, as indexes into a table of their printed forms), plus a checkpoint of
+    the whole operand stack every interval steps.  A checkpoint only holds the part of the stack
+    that has changed since the previous one, since whatever is below the lowest point the stack
+    has got down to since then is shared with it.  Steps are written in compressed blocks, one
+    per checkpoint.
+
+    While recording, the operand stack keeps track of the lowest slot each step changed (see
+    _WatchedStack), so working out a step's changes costs about as much as the step itself
+    rather than anything proportional to the depth of the stack.  Values are printed (up to
+    TRACE_REPR_LIMIT characters) as they're recorded, and only procedures' printed forms are
+    remembered between steps, a bounded number of them, so memory use doesn't grow with the
+    length of the run beyond the trace's own tables.  Like Profiler this has its own dispatch
+    loop and doesn't use compiled procedures.
+    '''
+    # how many procedures' printed forms, and how many distinct printed forms, to remember before
+    # starting afresh
+    MAX_CACHED_PROCEDURES = 1024
+    MAX_CACHED_STRINGS = 65536
+
+    def __init__(self, i, f, interval=4096, source_filename=None):
+        self.i = i
+        self.f = f
+        self.interval = interval
+        self.source_filename = source_filename
+
+        self.step = 0
+        # printed form -> index in the trace's table of them, for recently seen ones
+        self.strings = {}
+        self.string_count = 0
+        self.new_strings = []
+        # procedures are pushed over and over (eg. by `if` in a loop), so they're only printed
+        # again if they might have changed (see array_edits) - id -> (procedure, string index),
+        # holding on to the procedure so its id can't be reused
+        self.proc_strings = {}
+        self.array_edits = array_edits
+        # (source map, token id) -> index in the trace's table of locations, with 0 meaning "no
+        # location"
+        self.location_indexes = {}
+        self.new_locations = []
+
+        self.locations = array('I')
+        self.pops = array('I')
+        self.pushes = array('I')
+        self.pushed = array('I')
+        self.output = []
+
+        # the operand stack we're watching, and its class before we started
+        self.watched = None
+        self.watched_class = None
+        # the string indexes of the operand stack as of the last step
+        self.mirror = []
+        # the lowest the stack has been since the last checkpoint
+        self.low = 0
+
+    def _string(self, v):
+        is_proc = type(v) is ArrayValue and v.executable
+        if is_proc:
+            known = self.proc_strings.get(id(v))
+            if known is not None:
+                return known[1]
+
+        if isinstance(v, (ArrayValue, DictionaryValue)):
+            s = truncated_repr(v, TRACE_REPR_LIMIT)
+        else:
+            s = v.__ps_repr__()
+            if len(s) > TRACE_REPR_LIMIT:
+                s = s[:TRACE_REPR_LIMIT - 1] + '…'
+        idx = self.strings.get(s)
+        if idx is None:
+            if len(self.strings) >= self.MAX_CACHED_STRINGS:
+                # anything forgotten just goes into the trace again if it comes back
+                self.strings.clear()
+            idx = self.strings[s] = self.string_count
+            self.string_count += 1
+            self.new_strings.append(s)
+
+        if is_proc:
+            if len(self.proc_strings) >= self.MAX_CACHED_PROCEDURES:
+                self.proc_strings.clear()
+            self.proc_strings[id(v)] = (v, idx)
+        return idx
+
+    def _watch(self, stack):
+        self.watched = stack
+        self.watched_class = type(stack)
+        stack.__class__ = _watched_class(type(stack))
+        stack.low_water = len(stack)
+
+    def _unwatch(self):
+        stack = self.watched
+        if stack is not None:
+            stack.__class__ = self.watched_class
+            del stack.low_water
+            self.watched = None
+
+    def _location(self, word):
+        token = word.token
+        if token is None:
+            return 0
+        key = (word.source, token)
+        idx = self.location_indexes.get(key)
+        if idx is None:
+            idx = self.location_indexes[key] = len(self.location_indexes) + 1
+            self.new_locations.append(word.source.location(token))
+        return idx
+
+    def _record_stack(self):
+        stack = self.i.operand_stack
+        if stack is self.watched:
+            low = stack.low_water
+        else:
+            # the interpreter's switched to another stack (see Interpreter.enable_tags), so we
+            # can't tell what's changed
+            self._unwatch()
+            self._watch(stack)
+            low = 0
+        if self.array_edits != array_edits:
+            # something's been bound, which changes how it's printed wherever it is on the stack
+            self.array_edits = array_edits
+            self.proc_strings.clear()
+            low = 0
+
+        mirror = self.mirror
+        n = len(stack)
+        m = len(mirror)
+        if low > n:
+            low = n
+        if low > m:
+            low = m
+
+        self.pops.append(m - low)
+        self.pushes.append(n - low)
+        if low < m:
+            del mirror[low:]
+            if low < self.low:
+                self.low = low
+        if low < n:
+            string = self._string
+            added = [ string(v) for v in stack[low:] ]
+            mirror.extend(added)
+            self.pushed.extend(added)
+        stack.low_water = n
+
+    def _write(self, kind, payload):
+        marshal.dump((kind, payload), self.f)
+
+    def _flush(self):
+        '''
+        Write out everything recorded since the last flush - tables first, since the steps
+        refer to them
+        '''
+        if self.new_strings:
+            self._write('strings', self.new_strings)
+            self.new_strings = []
+        if self.new_locations:
+            self._write('locations', tuple(_pack_integers(values) for values in zip(*self.new_locations)))
+            self.new_locations = []
+        if self.locations:
+            self._write('steps', zlib.compress(marshal.dumps((
+                _pack_integers(self.locations),
+                _pack_integers(self.pops),
+                _pack_integers(self.pushes),
+                _pack_integers(self.pushed),
+            ))))
+            self.locations = array('I')
+            self.pops = array('I')
+            self.pushes = array('I')
+            self.pushed = array('I')
+        if self.output:
+            self._write('output', self.output)
+            self.output = []
+
+    def _checkpoint(self):
+        self._flush()
+        self._write('checkpoint', (self.step, self.low, _pack_integers(self.mirror[self.low:])))
+        self.low = len(self.mirror)
+
+    def _print(self, value):
+        self.output.append((self.step - 1, str(value)))
+        if self.print is not None:
+            self.print(value)
+
+    def run(self, program):
+        i = self.i
+        xs = i.execution_stack
+        base = len(xs)
+        xs.append(ProgramFrame(i.assemble(program)))
+
+        self.f.write(TRACE_MAGIC)
+        self._write('header', (self.interval, self.source_filename))
+        self.mirror = [ self._string(v) for v in i.operand_stack ]
+        self._watch(i.operand_stack)
+        self._checkpoint()
+
+        self.print = getattr(i, 'print', None)
+        i.print = self._print
+        interval = self.interval
+        try:
+            while len(xs) > base:
+                word = xs[-1].next_word(i)
+                if word is None:
+                    xs.pop().leave(i)
+                    continue
+
+                # the previous step's changes include anything frames did to the stack
+                # between it and this one (eg. a for loop pushing its control variable)
+                if self.step:
+                    self._record_stack()
+                    if self.step % interval == 0:
+                        self._checkpoint()
+                self.locations.append(self._location(word))
+                self.step += 1
+                word.execute(i, direct=True)
+        finally:
+            if self.print is None:
+                del i.print
+            else:
+                i.print = self.print
+            i._unwind(base)
+            if self.step:
+                self._record_stack()
+            self._unwatch()
+            self._flush()
+            self._write('end', self.step)
+
+class Trace:
+    '''
+    A trace written by TraceRecorder, loaded for stepping through
+
+    Operand stacks are persistent linked lists of (string index, rest of the stack, depth) tuples,
+    top first, so each checkpoint shares everything below its changes with the one before it.
+    The stack at any step is rebuilt from the nearest checkpoint before it, by replaying at most
+    interval steps' worth of changes.
+    '''
+    def __init__(self):
+        self.interval = None
+        self.source_filename = None
+        self.steps = 0
+        self.strings = []
+        # locations are indexed from 1, index 0 being "no location"
+        self.lines = array('I', [0])
+        self.columns = array('I', [0])
+        self.lengths = array('I', [0])
+
+        self.locations = array('I')
+        self.pops = array('I')
+        self.pushes = array('I')
+        self.pushed = array('I')
+        # where each step's pushed values start in pushed
+        self.push_offsets = array('Q')
+        self.checkpoints = []
+        self.output = []
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            return cls.read(f)
+
+    @classmethod
+    def read(cls, f):
+        if f.read(len(TRACE_MAGIC)) != TRACE_MAGIC:
+            raise ValueError('not a trace file, or one from another version')
+
+        trace = cls()
+        stack = None
+        while True:
+            kind, payload = marshal.load(f)
+            if kind == 'header':
+                trace.interval, trace.source_filename = payload
+            elif kind == 'strings':
+                trace.strings.extend(payload)
+            elif kind == 'locations':
+                for values, packed in zip((trace.lines, trace.columns, trace.lengths), payload):
+                    values.fromlist(_unpack_integers(packed).tolist())
+            elif kind == 'steps':
+                locations, pops, pushes, pushed = marshal.loads(zlib.decompress(payload))
+                pushes = _unpack_integers(pushes).tolist()
+                offset = len(trace.pushed)
+                for n in pushes:
+                    trace.push_offsets.append(offset)
+                    offset += n
+                trace.locations.fromlist(_unpack_integers(locations).tolist())
+                trace.pops.fromlist(_unpack_integers(pops).tolist())
+                trace.pushes.fromlist(pushes)
+                trace.pushed.fromlist(_unpack_integers(pushed).tolist())
+            elif kind == 'checkpoint':
+                step, keep, strings = payload
+                assert step == len(trace.checkpoints) * trace.interval, 'missing checkpoint'
+                stack = _drop(stack, _depth(stack) - keep)
+                for s in _unpack_integers(strings):
+                    stack = _push(stack, s)
+                trace.checkpoints.append(stack)
+            elif kind == 'output':
+                trace.output.extend(payload)
+            elif kind == 'end':
+                trace.steps = payload
+                return trace
+            else:
+                raise ValueError(f'unknown trace chunk {kind!r}')
+
+    def location(self, step):
+        '''
+        The (line, column, length) of the word executed at step, if it has one
+        '''
+        idx = self.locations[step]
+        if idx == 0:
+            return None
+        return (self.lines[idx], self.columns[idx], self.lengths[idx])
+
+    def stack_at(self, step):
+        '''
+        The operand stack (as a persistent list) just before step - or after the last step,
+        for step == steps
+        '''
+        assert 0 <= step <= self.steps, f'step {step} out of range'
+        checkpoint = min(step // self.interval, len(self.checkpoints) - 1)
+        stack = self.checkpoints[checkpoint]
+        pops, pushes, pushed, offsets = self.pops, self.pushes, self.pushed, self.push_offsets
+        for s in range(checkpoint * self.interval, step):
+            stack = _drop(stack, pops[s])
+            offset = offsets[s]
+            for idx in range(offset, offset + pushes[s]):
+                stack = _push(stack, pushed[idx])
+        return stack
+
+    def stack(self, step):
+        '''
+        The printed forms of the values on the operand stack just before step, bottom first
+        '''
+        strings = self.strings
+        values = []
+        node = self.stack_at(step)
+        while node is not None:
+            values.append(strings[node[0]])
+            node = node[1]
+        values.reverse()
+        return values
+
+    def output_before(self, step):
+        '''
+        Everything printed by the steps before step
+        '''
+        return [ text for s, text in self.output if s < step ]
+
+def _depth(stack):
+    return 0 if stack is None else stack[2]
+
+def _push(stack, item):
+    return (item, stack, _depth(stack) + 1)
+
+def _drop(stack, n):
+    for _ in range(n):
+        stack = stack[1]
+    return stack
@@ -1,17 +1,19 @@
-import io
 import sys
+import threading
+import time
 
 from rich.segment import Segment
 from rich.style import Style
 from textual.app import App
 from textual.binding import Binding
 from textual.containers import Horizontal, Vertical
-from textual.geometry import Size
+from textual.geometry import Region, Size
 from textual.scroll_view import ScrollView
 from textual.strip import Strip
 from textual.widgets import Footer, Log, Static
 
-from interpreter import Interpreter, Scanner
+import interpreter
+from interpreter import DEVICE_FORMATS, ArrayValue, Breakpoint, Debugger, Interpreter, MemoryTracker, Profiler, Scanner, TaggedOperandStack, Trace, TraceRecorder, load_program, open_device, truncated_repr
 
 class SourceCode(ScrollView):
     def __init__(self, text, **kwargs):
@@ -19,6 +21,7 @@ class SourceCode(ScrollView):
         self.lines = text.splitlines()
         self.virtual_size = Size(max(len(line) for line in self.lines), len(self.lines))
         self.highlight_pos = None
+        self.breakpoint_lines = set()
 
     def render_line(self, y: int) -> Strip:
         scroll_x, scroll_y = self.scroll_offset
@@ -37,15 +40,32 @@ class SourceCode(ScrollView):
             case None:
                 segments = [Segment(target_line)]
 
+        if (idx + 1) in self.breakpoint_lines:
+            segments = [ Segment(s.text, (s.style or Style()) + Style(bgcolor='dark_red')) for s in segments ]
+
         strip = Strip(segments)
-        strip.crop(scroll_x, scroll_x + self.size.width)
-        return strip
+        return strip.crop(scroll_x, scroll_x + self.size.width)
+
+    def refresh_source_line(self, line):
+        '''
+        Redraw just the given (1-based) line, if it's on screen
+        '''
+        y = line - 1 - self.scroll_offset.y
+        if 0 <= y < self.size.height:
+            self.refresh(Region(0, y, self.size.width, 1))
 
     def highlight(self, line, col_start, col_end):
+        previous = self.highlight_pos
         self.highlight_pos = (line, col_start, col_end)
+        if previous is not None and previous[0] != line:
+            self.refresh_source_line(previous[0])
+        self.refresh_source_line(line)
 
     def unhilight(self):
+        previous = self.highlight_pos
         self.highlight_pos = None
+        if previous is not None:
+            self.refresh_source_line(previous[0])
 
     def scroll_into_view(self, line, column):
         line -= 1
@@ -56,58 +76,212 @@ class SourceCode(ScrollView):
 
         self.scroll_to(y=line)
 
+class StackView(ScrollView):
+    '''
+    The operand stack, top first - only the rows on screen are rendered, each cut down to the
+    width of the view, so a deep stack or a huge array costs no more to show than a small one
+    '''
+    # how many values' reprs to remember before starting afresh
+    MAX_CACHED_REPRS = 10000
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.values = []
+        self.tag = lambda idx: None
+        # id -> (value, width, repr) - only for arrays, holding onto the value so its id isn't
+        # reused.  bind changes arrays in place, so everything's forgotten whenever it's run
+        # (see interpreter.array_edits).
+        self.reprs = {}
+        self.array_edits = interpreter.array_edits
+
+    def show(self, values, tag=None):
+        '''
+        Show values (a list of Values or already-printed strings, bottom first), with tag(idx)
+        giving the tag of each slot
+        '''
+        self.values = values
+        self.tag = tag or (lambda idx: None)
+        self.virtual_size = Size(self.size.width, len(values))
+        self.refresh()
+
+    def describe(self, v, width):
+        if isinstance(v, str):
+            return v if len(v) <= width else v[:width - 1] + '…'
+        if type(v) is not ArrayValue:
+            return truncated_repr(v, width)
+
+        if self.array_edits != interpreter.array_edits:
+            self.reprs.clear()
+            self.array_edits = interpreter.array_edits
+        cached = self.reprs.get(id(v))
+        if cached is not None and cached[1] == width:
+            return cached[2]
+        if len(self.reprs) >= self.MAX_CACHED_REPRS:
+            self.reprs.clear()
+        text = truncated_repr(v, width)
+        self.reprs[id(v)] = (v, width, text)
+        return text
+
+    def render_line(self, y: int) -> Strip:
+        width = self.size.width
+        idx = len(self.values) - 1 - (self.scroll_offset.y + y)
+        if idx < 0:
+            return Strip.blank(width)
+
+        text = self.describe(self.values[idx], width)
+        segments = [Segment(text)]
+        tag = self.tag(idx)
+        if tag is not None and len(text) + 1 < width:
+            segments.append(Segment(' ' + tag[:width - len(text) - 1], Style(color='grey42')))
+        return Strip(segments)
+
 class DebuggerApp(App):
     CSS_PATH = 'layout.tcss'
 
     BINDINGS = [
         ('enter', 'step()', 'Step'),
+        ('n', 'step_over()', 'Step over'),
+        ('o', 'step_out()', 'Step out'),
+        ('c', 'continue()', 'Continue'),
+        ('r', 'animate()', 'Run/Pause'),
+        ('b', 'toggle_breakpoint()', 'Breakpoint'),
         ('q', 'quit()', 'Quit'),
     ]
 
-    def __init__(self, source_filename, **kwargs):
+    # how often the UI is redrawn while animating
+    FRAMES_PER_SECOND = 30
+
+    def __init__(self, source_filename, bind_procs=False, optimize=False, use_cache=True, breakpoints=(), **kwargs):
         super().__init__(**kwargs)
         self.source_filename = source_filename
+        self.bind_procs = bind_procs
+        self.optimize = optimize
+        self.use_cache = use_cache
+        self.breakpoints = list(breakpoints)
+        self.finished_shown = False
+        # set while the program's running in the background - clearing it pauses
+        self.animating = False
 
-    def compose(self):
+    def setup(self):
         # XXX is this the right place to put this?
-        self.interp = Interpreter()
+        self.interp = Interpreter(bind_procs=self.bind_procs, optimize=self.optimize)
+        self.memory = MemoryTracker(self.interp)
+        self.debugger = Debugger(self.interp, self.memory.execute(load_program(self.source_filename, use_cache=self.use_cache)))
+        self.debugger.breakpoints = list(self.breakpoints)
 
+        # XXX this is such a hack
+        self.ui_thread = threading.get_ident()
+        self.interp.print = self.write_output
+
+    def write_output(self, text):
+        if threading.get_ident() == self.ui_thread:
+            self.log_widget.write_line(text)
+        else:
+            self.call_from_thread(self.log_widget.write_line, text)
+
+    def compose(self):
         with open(self.source_filename, 'r') as f:
             source_code = f.read()
-        self.stepper = self.interp.execute(Scanner(io.StringIO(source_code)))
 
         self.log_widget = Log(classes='output_pane')
         self.log_widget.border_title = 'Output'
 
-        # XXX this is such a hack
-        self.interp.print = self.log_widget.write_line
+        self.setup()
 
         with Vertical():
             with Horizontal():
                 self.src = SourceCode(source_code, classes='box')
+                self.src.breakpoint_lines = { bp.line for bp in self.breakpoints if bp.line is not None }
                 self.src.border_title = 'Code'
                 yield self.src
 
                 with Vertical():
-                    self.stack_widget = Static('', classes='stack_widget')
+                    self.stack_widget = StackView(classes='stack_widget')
                     self.stack_widget.border_title = 'Stack'
                     yield self.stack_widget
 
                     self.graphics_state_widget = Static('', classes='graphics_state_widget')
                     self.graphics_state_widget.border_title = 'Graphics State'
                     yield self.graphics_state_widget
+
+                    self.memory_widget = Static('', classes='memory_widget')
+                    self.memory_widget.border_title = 'Memory'
+                    yield self.memory_widget
             yield self.log_widget
         yield Footer()
 
     def action_quit(self):
+        self.animating = False
         self.exit()
 
     def action_step(self):
+        if not self.animating:
+            self.show(self.debugger.step())
+
+    def action_step_over(self):
+        if not self.animating:
+            self.show(self.debugger.step_over())
+
+    def action_step_out(self):
+        if not self.animating:
+            self.show(self.debugger.step_out())
+
+    def action_continue(self):
+        if not self.animating:
+            self.show(self.debugger.continue_())
+
+    def action_animate(self):
+        if self.animating:
+            # the worker checks this before every word, so it stops right away
+            self.animating = False
+        elif not self.debugger.finished:
+            self.animating = True
+            self.run_worker(self.animate, thread=True, exclusive=True, group='animate')
+
+    def animate(self):
+        '''
+        Step through the program as fast as possible in a worker thread, redrawing at most
+        FRAMES_PER_SECOND times a second, until paused, finished or stopped at a breakpoint
+        '''
+        debugger = self.debugger
+        frame_interval = 1 / self.FRAMES_PER_SECOND
+        next_frame = 0
+        word = debugger.word
         try:
-            next_word = next(self.stepper)
-        except StopIteration:
+            while self.animating:
+                word = debugger.step()
+                if word is None or debugger.hit is not None:
+                    break
+                now = time.monotonic()
+                if now >= next_frame:
+                    # this waits for the UI to take everything it needs from the interpreter
+                    self.call_from_thread(self.show, word)
+                    next_frame = now + frame_interval
+        finally:
+            self.animating = False
+            if self.is_running:
+                self.call_from_thread(self.show, word)
+
+    def action_toggle_breakpoint(self):
+        # on the line we're stopped at, or the top line of the code view if we haven't started
+        if self.src.highlight_pos is not None:
+            line = self.src.highlight_pos[0]
+        else:
+            line = self.src.scroll_offset.y + 1
+        bp = self.debugger.toggle_line_breakpoint(line)
+        self.log_widget.write_line(f'Breakpoint set at line {line}.' if bp is not None else f'Breakpoint at line {line} cleared.')
+        self.src.breakpoint_lines = self.debugger.breakpoint_lines()
+        self.src.refresh_source_line(line)
+
+    def show(self, next_word):
+        '''
+        Redraw everything for the word we've stopped at
+        '''
+        if next_word is None and not self.finished_shown:
             self.log_widget.write_line('\nProgram finished.')
-            next_word = None
+            self.finished_shown = True
+        elif self.debugger.hit is not None:
+            self.log_widget.write_line(f'Stopped at breakpoint: {self.debugger.hit}')
 
         if next_word is not None:
             assert next_word.line is not None, repr(next_word)
@@ -117,14 +291,85 @@ class DebuggerApp(App):
         else:
             self.src.unhilight()
 
-        self.src.refresh()
-        stack_widget_lines = reversed([ v.__ps_repr__() + (f' [grey42]{v.tag}[/grey42]' if v.tag is not None else '') for v in self.interp.operand_stack ])
-        self.stack_widget.update('\n'.join(stack_widget_lines))
+        # copy the stack, since the view draws it later on, and by then a running program may
+        # have changed it
+        stack = self.interp.operand_stack
+        tags = list(stack.tags) if isinstance(stack, TaggedOperandStack) else None
+        self.stack_widget.show(list(stack), tags.__getitem__ if tags is not None else None)
         self.graphics_state_widget.update(self.interp._describe_graphics_state())
+        self.memory_widget.update('\n'.join(self.memory.summary()))
+
+class ReplayApp(DebuggerApp, inherit_bindings=False):
+    '''
+    Steps forwards and backwards through a trace recorded with --record, rather than running
+    the program
+    '''
+    BINDINGS = [
+        ('enter', 'forward()', 'Step'),
+        ('right', 'forward()', 'Forward'),
+        ('left', 'back()', 'Back'),
+        ('home', 'go_to(0)', 'Start'),
+        ('end', 'go_to(-1)', 'End'),
+        ('q', 'quit()', 'Quit'),
+    ]
+
+    def __init__(self, trace_filename, source_filename=None, **kwargs):
+        self.trace = Trace.load(trace_filename)
+        super().__init__(source_filename or self.trace.source_filename, **kwargs)
+        self.step = 0
+
+    def setup(self):
+        pass
+
+    def on_mount(self):
+        self.go_to(0)
+
+    def action_forward(self):
+        self.go_to(min(self.step + 1, self.trace.steps))
+
+    def action_back(self):
+        self.go_to(max(self.step - 1, 0))
+
+    def action_go_to(self, step):
+        self.go_to(step if step >= 0 else self.trace.steps)
+
+    def go_to(self, step):
+        trace = self.trace
+        self.step = step
+
+        location = trace.location(step) if step < trace.steps else None
+        if location is not None:
+            line, column, length = location
+            self.src.highlight(line=line, col_start=column, col_end=column+length)
+            self.src.scroll_into_view(line, column)
+        else:
+            self.src.unhilight()
+
+        self.stack_widget.show(trace.stack(step))
+        self.graphics_state_widget.update('(not recorded)')
+        self.memory_widget.update(f'step {step} of {trace.steps}')
+
+        self.log_widget.clear()
+        for text in trace.output_before(step):
+            self.log_widget.write_line(text)
+        if step == trace.steps:
+            self.log_widget.write_line('\nProgram finished.')
 
 if __name__ == '__main__':
     mode = 'run'
     source_filename = None
+    bind_procs = False
+    jit_threshold = None
+    optimize = False
+    use_cache = True
+    output = None
+    output_format = None
+    profile = False
+    profile_stacks = None
+    memory = False
+    breakpoints = []
+    record = None
+    replay = None
 
     for arg in sys.argv[1:]:
         if arg == '--tokens':
@@ -133,6 +378,36 @@ if __name__ == '__main__':
             mode = 'interactive'
         elif arg == '--run':
             mode = 'run'
+        elif arg == '--bind':
+            bind_procs = True
+        elif arg == '--optimize':
+            optimize = True
+        elif arg == '--no-cache':
+            use_cache = False
+        elif arg.startswith('--output='):
+            output = arg.removeprefix('--output=')
+        elif arg.startswith('--format='):
+            output_format = arg.removeprefix('--format=')
+            if output_format not in DEVICE_FORMATS:
+                raise Exception(f'unrecognized output format {output_format!r}')
+        elif arg == '--profile':
+            profile = True
+        elif arg.startswith('--profile-stacks='):
+            profile = True
+            profile_stacks = arg.removeprefix('--profile-stacks=')
+        elif arg == '--memory':
+            memory = True
+        elif arg.startswith('--record='):
+            record = arg.removeprefix('--record=')
+        elif arg.startswith('--replay='):
+            mode = 'replay'
+            replay = arg.removeprefix('--replay=')
+        elif arg.startswith('--break='):
+            breakpoints.append(Breakpoint.parse(arg.removeprefix('--break=')))
+        elif arg == '--jit':
+            jit_threshold = 8
+        elif arg.startswith('--jit='):
+            jit_threshold = int(arg.removeprefix('--jit='))
         elif arg.startswith('-'):
             raise Exception(f'unrecognized flag {arg!r}')
         else:
@@ -144,13 +419,38 @@ if __name__ == '__main__':
                 for w in Scanner(f):
                     print(w)
         case 'interactive':
-            app = DebuggerApp(source_filename)
+            app = DebuggerApp(source_filename, bind_procs=bind_procs, optimize=optimize, use_cache=use_cache, breakpoints=breakpoints)
+            app.run()
+        case 'replay':
+            app = ReplayApp(replay, source_filename)
             app.run()
         case 'run':
-            t = Interpreter()
+            if output is None and output_format is not None:
+                output = 'output.pdf' if output_format == 'pdf' else f'page-%d.{output_format}'
+            device = open_device(output, output_format) if output is not None else None
+            t = Interpreter(bind_procs=bind_procs, jit_threshold=jit_threshold, optimize=optimize, device=device)
             t.print = print
-            with open(source_filename, 'r') as f:
-                for _ in t.execute(Scanner(f)):
-                    pass
+            profiler = Profiler(t, root=source_filename) if profile else None
+            tracker = MemoryTracker(t) if memory else None
+            try:
+                if record is not None:
+                    with open(record, 'wb') as f:
+                        TraceRecorder(t, f, source_filename=source_filename).run(load_program(source_filename, use_cache=use_cache))
+                elif profiler is not None:
+                    profiler.run(load_program(source_filename, use_cache=use_cache))
+                elif tracker is not None:
+                    tracker.run(load_program(source_filename, use_cache=use_cache))
+                else:
+                    t.run(load_program(source_filename, use_cache=use_cache))
+            finally:
+                t.device.close()
+
+            if profiler is not None:
+                print('\n'.join(profiler.report()), file=sys.stderr)
+                if profile_stacks is not None:
+                    with open(profile_stacks, 'w') as f:
+                        profiler.write_collapsed_stacks(f)
+            if tracker is not None:
+                print('\n'.join(tracker.report()), file=sys.stderr)
         case _:
             raise Exception(f'invalid mode {mode!r}')
@@ -1,6 +1,6 @@
 import io
 
-from .interpreter import Interpreter, Scanner
+from .interpreter import Interpreter, Scanner, TaggedOperandStack
 
 def run_and_gather_output(program):
     i = Interpreter()
@@ -55,3 +55,50 @@ ptags
     assert output.splitlines() == [
         'one',
     ]
+
+def test_args_on_interned_values():
+    program = '''
+/tagtop { %args top
+  ptags
+} def
+
+0 1 add
+0 1 add
+tagtop
+    '''
+
+    output = run_and_gather_output(program)
+    assert output.splitlines() == [
+        'top',
+        'None',
+    ]
+
+def test_args_tag_slots_not_values():
+    program = '''
+/tagtop { %args top
+  ptags
+} def
+
+1 %tag one
+dup
+tagtop
+ptags
+    '''
+
+    output = run_and_gather_output(program)
+    assert output.splitlines() == [
+        'top',
+        'one',
+
+        'one',
+        'one',
+    ]
+
+def test_args_leave_operands_alone():
+    i = Interpreter()
+    program = '/tagtop { %args top\n} def\n1 2 add tagtop'
+    for _ in i.execute(Scanner(io.StringIO(program))):
+        pass
+    assert isinstance(i.operand_stack, TaggedOperandStack)
+    assert i.operand_stack.tag(-1) is None
+    assert i.operand_stack[-1].tag is None
@@ -0,0 +1,83 @@
+import os
+
+from .interpreter import ArrayValue, Interpreter, cache_filename, load_program
+
+PROGRAM = '''
+/double { %args n
+    2 mul
+} def
+/greeting (hello (nested) world) def
+1.5 double %tag three
+//double 16#10 /name
+'''
+
+def describe(words):
+    described = []
+    for w in words:
+        value = describe(w.value) if isinstance(w, ArrayValue) else w.value
+        args = w.args if isinstance(w, ArrayValue) else None
+        described.append((type(w), value, w.executable, w.line, w.column, w.length, w.tag, args))
+    return described
+
+def write_program(tmp_path, program=PROGRAM):
+    filename = tmp_path / 'program.ps'
+    filename.write_text(program)
+    return str(filename)
+
+def test_round_trip(tmp_path):
+    filename = write_program(tmp_path)
+    uncached = load_program(filename, use_cache=False)
+    assert not os.path.exists(cache_filename(filename))
+
+    built = load_program(filename)
+    assert os.path.exists(cache_filename(filename))
+    loaded = load_program(filename)
+
+    assert describe(built) == describe(uncached)
+    assert describe(loaded) == describe(uncached)
+
+def test_cached_program_runs(tmp_path):
+    filename = write_program(tmp_path)
+    load_program(filename)
+
+    i = Interpreter()
+    i.run(load_program(filename))
+    assert i.operand_stack[0].value == 3.0
+    assert i.operand_stack[1] is i.look_up('double')
+    assert [ v.value for v in i.operand_stack[2:] ] == [16, 'name']
+
+def test_stale_cache_is_rebuilt(tmp_path):
+    filename = write_program(tmp_path)
+    load_program(filename)
+
+    write_program(tmp_path, '1 2 add')
+    assert [ w.value for w in load_program(filename) ] == [1, 2, 'add']
+
+def test_corrupt_cache_is_rebuilt(tmp_path):
+    filename = write_program(tmp_path)
+    load_program(filename)
+
+    with open(cache_filename(filename), 'r+b') as f:
+        f.seek(-10, os.SEEK_END)
+        f.write(b'\xff' * 10)
+
+    assert describe(load_program(filename)) == describe(load_program(filename, use_cache=False))
+
+def test_any_damage_is_rebuilt(tmp_path):
+    filename = write_program(tmp_path)
+    load_program(filename)
+    expected = describe(load_program(filename, use_cache=False))
+
+    with open(cache_filename(filename), 'rb') as f:
+        intact = f.read()
+
+    for offset in range(len(intact)):
+        damaged = bytearray(intact)
+        damaged[offset] ^= 1 << (offset % 8)
+        with open(cache_filename(filename), 'wb') as f:
+            f.write(damaged)
+        assert describe(load_program(filename)) == expected, offset
+
+    with open(cache_filename(filename), 'wb') as f:
+        f.write(intact[:len(intact) // 2])
+    assert describe(load_program(filename)) == expected
@@ -1,6 +1,8 @@
 import io
 
-from .interpreter import Interpreter, Scanner
+import pytest
+
+from .interpreter import Interpreter, Scanner, symbols, systemdict
 
 def run_and_gather_stack(program):
     i = Interpreter()
@@ -136,3 +138,132 @@ def test_if():
     program = 'false { (true) } if'
     values = run_and_gather_stack(program)
     assert values == []
+
+def test_bind():
+    program = '{ 1 2 add { 3 mul } exec } bind exec'
+    values = run_and_gather_stack(program)
+    assert values == [9]
+
+def test_bind_replaces_operator_names():
+    i = Interpreter()
+    i.run(Scanner(io.StringIO('{ 1 2 add { 3 mul } } bind')))
+    proc = i.operand_stack[-1]
+    assert proc.value[2].__ps_repr__() == '--add--'
+    assert proc.value[3].value[1].__ps_repr__() == '--mul--'
+
+def test_bind_ignores_procedures():
+    program = '/pushthree { 3 } def { pushthree } bind exec'
+    values = run_and_gather_stack(program)
+    assert values == [3]
+
+def test_immediate_names():
+    i = Interpreter()
+    i.run(Scanner(io.StringIO('/three 3 def { //three //add }')))
+    proc = i.operand_stack[-1]
+    assert proc.value[0].value == 3
+    assert proc.value[1].__ps_repr__() == '--add--'
+
+def test_autobind():
+    i = Interpreter(bind_procs=True)
+    i.run(Scanner(io.StringIO('/addtwo { 2 add } def 1 addtwo')))
+    assert [ v.value for v in i.operand_stack ] == [3]
+    assert i.look_up('addtwo').value[1].__ps_repr__() == '--add--'
+
+def test_operand_type_mismatch():
+    with pytest.raises(AssertionError, match='got StringValue, expected any of IntegerValue, RealValue'):
+        run_and_gather_stack('(one) 1 add')
+
+def test_operand_stack_underflow():
+    with pytest.raises(AssertionError, match='operand stack underflow'):
+        run_and_gather_stack('1 add')
+
+    with pytest.raises(AssertionError, match='operand stack underflow'):
+        run_and_gather_stack('1 2 for')
+
+def test_roll_negative():
+    program = '1 2 3 4 4 -1 roll'
+    values = run_and_gather_stack(program)
+    assert values == [2, 3, 4, 1]
+
+def test_roll_window():
+    program = '1 2 3 4 5 6 3 7 roll'
+    values = run_and_gather_stack(program)
+    assert values == [1, 2, 3, 6, 4, 5]
+
+def test_roll_underflow():
+    with pytest.raises(AssertionError, match='operand stack underflow'):
+        run_and_gather_stack('1 2 3 2 roll')
+
+def test_index_underflow():
+    with pytest.raises(AssertionError, match='operand stack underflow'):
+        run_and_gather_stack('1 2 5 index')
+
+def test_copy_zero():
+    program = '1 2 0 copy'
+    values = run_and_gather_stack(program)
+    assert values == [1, 2]
+
+def test_clear():
+    program = '1 2 3 clear 4'
+    values = run_and_gather_stack(program)
+    assert values == [4]
+
+def test_cleartomark():
+    program = '1 [ 2 3 cleartomark 4'
+    values = run_and_gather_stack(program)
+    assert values == [1, 4]
+
+def test_counttomark():
+    program = '1 [ 2 3 counttomark'
+    values = run_and_gather_stack(program)
+    assert values[2:] == [2, 3, 2]
+
+def test_definitions_are_per_interpreter():
+    first = Interpreter()
+    first.run(Scanner(io.StringIO('/x 1 def /add { pop pop 0 } def')))
+    assert symbols.intern('x') in first.userdict
+
+    second = Interpreter()
+    second.run(Scanner(io.StringIO('1 2 add')))
+    assert [ v.value for v in second.operand_stack ] == [3]
+    assert symbols.intern('x') not in second.dictionary_stack
+
+def test_systemdict_is_read_only():
+    with pytest.raises(TypeError):
+        systemdict[symbols.intern('add')] = None
+
+def test_begin_end():
+    program = '''
+/x 1 def
+3 dict begin
+  /x 2 def
+  x
+  currentdict /x get
+end
+x
+'''
+    i = Interpreter()
+    i.run(Scanner(io.StringIO(program)))
+    assert [ v.value for v in i.operand_stack ] == [2, 2, 1]
+    assert i.userdict[symbols.intern('x')].value == 1
+
+def test_begin_literal_dictionary():
+    i = Interpreter()
+    i.run(Scanner(io.StringIO('<< /x 5 >> begin x 1 add end')))
+    assert [ v.value for v in i.operand_stack ] == [6]
+
+def test_end_underflow():
+    i = Interpreter()
+    with pytest.raises(AssertionError, match='dictstackunderflow'):
+        i.run(Scanner(io.StringIO('end')))
+
+def test_interpreters_in_threads():
+    from concurrent.futures import ThreadPoolExecutor
+
+    def job(n):
+        i = Interpreter()
+        i.run(Scanner(io.StringIO(f'/x {n} def 1 1 100 {{ pop x }} for')))
+        return { v.value for v in i.operand_stack }
+
+    with ThreadPoolExecutor(8) as pool:
+        assert list(pool.map(job, range(50))) == [ {n} for n in range(50) ]
@@ -0,0 +1,129 @@
+import io
+
+import pytest
+
+from .interpreter import Breakpoint, Debugger, Interpreter, NameValue, Scanner
+
+PROGRAM = '''/inner { 1 add } def
+/outer {
+  inner
+  inner
+} def
+0
+outer
+2 mul
+1 1 3 { pop outer } for
+'''
+
+def debugger(program=PROGRAM):
+    i = Interpreter()
+    return Debugger(i, i.execute(Scanner(io.StringIO(program))))
+
+def describe(word):
+    if word is None:
+        return None
+    return (word.value if isinstance(word, NameValue) and word.executable else word.__ps_repr__(), word.line)
+
+def step_to(d, description):
+    while describe(d.word) != description:
+        assert d.step() is not None
+
+def test_step():
+    d = debugger()
+    assert describe(d.step()) == ('/inner', 1)
+    assert describe(d.step()) == ('{ 1 /add }', 1)
+
+def test_step_over():
+    d = debugger()
+    step_to(d, ('outer', 7))
+    assert describe(d.step_over()) == ('2', 8)
+    assert [ v.value for v in d.i.operand_stack ] == [2]
+
+def test_step_over_a_tail_call():
+    d = debugger('/g { 1 pop } def /f { g } def f 9')
+    step_to(d, ('g', 1))
+    assert describe(d.step_over()) == ('9', 1)
+
+def test_step_over_the_end_of_a_loop_body():
+    d = debugger()
+    step_to(d, ('outer', 9))
+    assert describe(d.step_over()) == ('pop', 9)
+    assert [ v.value for v in d.i.operand_stack ] == [6, 2]
+
+def test_step_out():
+    d = debugger()
+    step_to(d, ('add', 1))
+    # out of inner, back into outer
+    assert describe(d.step_out()) == ('inner', 4)
+    # inner's the last word of outer, so stepping out of the inner it calls lands back at the top level
+    d.step()
+    assert describe(d.step_out()) == ('2', 8)
+    assert d.step_out() is None
+    assert d.finished
+
+def test_line_breakpoint():
+    d = debugger()
+    d.toggle_line_breakpoint(3)
+    assert describe(d.continue_()) == ('inner', 3)
+    # called once at the top level and three times from the loop
+    hits = 1
+    while d.continue_() is not None:
+        hits += 1
+    assert hits == 4
+    assert [ v.value for v in d.i.operand_stack ] == [10]
+
+def test_toggle_line_breakpoint():
+    d = debugger()
+    d.toggle_line_breakpoint(3)
+    d.toggle_line_breakpoint(3)
+    assert d.breakpoints == []
+    assert d.continue_() is None
+
+def test_toggling_replaces_the_breakpoint_list():
+    # a run in another thread may be part way through the old list
+    d = debugger()
+    before = d.breakpoints
+    bp = d.toggle_line_breakpoint(3)
+    assert before == [] and d.breakpoints == [bp]
+    during = d.breakpoints
+    d.toggle_line_breakpoint(3)
+    assert during == [bp] and d.breakpoints == []
+
+def test_name_breakpoint_stops_every_call():
+    d = debugger()
+    d.breakpoints.append(Breakpoint(name='inner'))
+    hits = 0
+    while d.continue_() is not None:
+        hits += 1
+    assert hits == 8
+
+def test_depth_breakpoint():
+    d = debugger('1 2 3 pop pop 4 5 6')
+    d.breakpoints.append(Breakpoint.parse('depth >= 3'))
+    assert describe(d.continue_()) == ('pop', 1)
+    # stays true through the next word, and becomes true again after 5
+    assert describe(d.continue_()) == ('6', 1)
+    assert d.continue_() is None
+
+def test_conditional_breakpoint():
+    d = debugger('1 1 5 { 1 add } for')
+    d.breakpoints.append(Breakpoint.parse('add if depth > 3'))
+    assert describe(d.continue_()) == ('add', 1)
+    assert [ v.value for v in d.i.operand_stack ] == [2, 3, 3, 1]
+
+def test_parse():
+    assert str(Breakpoint.parse('12')) == 'line 12'
+    assert str(Breakpoint.parse('add')) == 'add'
+    assert str(Breakpoint.parse('12 if depth<3')) == 'line 12 if depth < 3'
+    assert Breakpoint.parse('depth == 2').condition == ('==', 2)
+    with pytest.raises(ValueError):
+        Breakpoint.parse('add if deep > 3')
+
+def test_hit():
+    d = debugger()
+    bp = Breakpoint(name='mul')
+    d.breakpoints.append(bp)
+    d.step()
+    assert d.hit is None
+    assert describe(d.continue_()) == ('mul', 8)
+    assert d.hit is bp
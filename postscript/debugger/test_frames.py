@@ -0,0 +1,57 @@
+import io
+
+import pytest
+
+from .interpreter import Interpreter, Scanner
+
+def run_and_gather_stack(program):
+    i = Interpreter()
+    i.run(Scanner(io.StringIO(program)))
+    return [ v.value for v in i.operand_stack ]
+
+def max_execution_depth(program):
+    i = Interpreter()
+    depth = 0
+    for _ in i.execute(Scanner(io.StringIO(program))):
+        depth = max(depth, len(i.execution_stack))
+    return depth
+
+def test_for_negative_increment():
+    program = '3 -1 1 { } for'
+    values = run_and_gather_stack(program)
+    assert values == [3, 2, 1]
+
+def test_for_empty_range():
+    program = '1 1 0 { } for'
+    values = run_and_gather_stack(program)
+    assert values == []
+
+def test_deep_recursion():
+    # the recursive call isn't in tail position, so this nests 3000 frames deep
+    program = '/down { dup 0 eq { } { dup 1 sub down 0 add } ifelse } def 3000 down count'
+    values = run_and_gather_stack(program)
+    assert len(values) == 3002
+    assert values[-1] == 3001
+
+def test_tail_calls_reuse_frames():
+    program = '/countdown { dup 0 eq { pop } { 1 sub countdown } ifelse } def 1000 countdown'
+    assert max_execution_depth(program) < 5
+
+def test_nested_loops_step_in_order():
+    program = '1 1 2 { 1 1 2 { } for } for'
+    i = Interpreter()
+    words = [ (w.line, w.column) for w in i.execute(Scanner(io.StringIO(program))) ]
+    inner_loop = [(1, 9), (1, 11), (1, 13), (1, 15), (1, 19)]
+    assert words == [(1, 1), (1, 3), (1, 5), (1, 7), (1, 25)] + inner_loop * 2
+
+def test_assemble_nested_procedures():
+    i = Interpreter()
+    words = list(i.assemble(Scanner(io.StringIO('1 { 2 { 3 } } 4'))))
+    assert [ w.__ps_repr__() for w in words ] == ['1', '{ 2 { 3 } }', '4']
+
+def test_assemble_unbalanced_braces():
+    i = Interpreter()
+    with pytest.raises(AssertionError, match='unterminated procedure'):
+        list(i.assemble(Scanner(io.StringIO('{ 1'))))
+    with pytest.raises(AssertionError, match='unmatched }'):
+        list(i.assemble(Scanner(io.StringIO('1 }'))))
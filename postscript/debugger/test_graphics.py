@@ -0,0 +1,183 @@
+import io
+import re
+
+import pytest
+
+from .interpreter import Device, Interpreter, PDFDevice, Scanner, SVGDevice
+
+class RecordingDevice(Device):
+    def __init__(self):
+        self.strokes = []
+        self.pages = 0
+
+    def stroke(self, segments, line_width, color):
+        self.strokes.append((list(segments), line_width, color))
+
+    def showpage(self):
+        self.pages += 1
+
+def run_and_record(program):
+    device = RecordingDevice()
+    i = Interpreter(device=device)
+    i.run(Scanner(io.StringIO(program)))
+    return i, device
+
+def test_path_segments():
+    _, device = run_and_record('newpath 10 20 moveto 30 20 lineto 0 5 rlineto 5 5 rmoveto 1 1 rlineto stroke')
+    assert device.strokes == [([(10, 20, 30, 20), (30, 20, 30, 25), (35, 30, 36, 31)], 1.0, (0.0, 0.0, 0.0))]
+
+def test_closepath():
+    _, device = run_and_record('newpath 0 0 moveto 10 0 lineto 10 10 lineto closepath stroke')
+    assert device.strokes[0][0] == [(0, 0, 10, 0), (10, 0, 10, 10), (10, 10, 0, 0)]
+
+def test_line_width_and_color():
+    _, device = run_and_record('3 setlinewidth 1 0.5 2 setrgbcolor newpath 0 0 moveto 1 1 lineto stroke')
+    assert device.strokes[0][1:] == (3, (1, 0.5, 1.0))
+
+def test_stroke_clears_path():
+    i, device = run_and_record('newpath 0 0 moveto 1 1 lineto stroke 2 2 moveto')
+    assert i.graphics_state.path == []
+    assert i.graphics_state.current_point == (2, 2)
+
+def test_currentpoint():
+    i, _ = run_and_record('newpath 5 6 moveto 1 2 rlineto currentpoint')
+    assert [ v.value for v in i.operand_stack ] == [6, 8]
+
+def test_lineto_needs_current_point():
+    with pytest.raises(AssertionError, match='no current point'):
+        run_and_record('newpath 1 1 lineto')
+
+def test_showpage():
+    i, device = run_and_record('2 setlinewidth showpage')
+    assert device.pages == 1
+    assert i.graphics_state.line_width == 1.0
+
+def test_raster_stroke(tmp_path):
+    np = pytest.importorskip('numpy')
+    from .interpreter import RasterDevice
+
+    output = str(tmp_path / 'page-%d.ppm')
+    device = RasterDevice(output, width=20, height=10)
+    i = Interpreter(device=device)
+    i.run(Scanner(io.StringIO('1 0 0 setrgbcolor newpath 2 2 moveto 17 2 lineto stroke')))
+
+    # y is flipped, so y=2 is the third row from the bottom
+    row = device.pixels[10 - 1 - 2]
+    assert (row[2:18] == [255, 0, 0]).all()
+    assert (row[:2] == 255).all() and (row[18:] == 255).all()
+    assert (device.pixels[:7] == 255).all()
+
+    i.run(Scanner(io.StringIO('showpage')))
+    with open(tmp_path / 'page-1.ppm', 'rb') as f:
+        assert f.read(13) == b'P6 20 10 255\n'
+        assert len(f.read()) == 20 * 10 * 3
+    assert (device.pixels == 255).all()
+
+def test_raster_line_width():
+    np = pytest.importorskip('numpy')
+    from .interpreter import RasterDevice
+
+    device = RasterDevice(width=20, height=20)
+    device.stroke([(10, 2, 10, 17)], 5, (0, 0, 0))
+    painted_columns = np.nonzero((device.pixels[10] == 0).all(axis=1))[0]
+    assert list(painted_columns) == [8, 9, 10, 11, 12]
+
+def test_raster_png(tmp_path):
+    pytest.importorskip('numpy')
+    from .interpreter import RasterDevice
+
+    device = RasterDevice(str(tmp_path / 'out.png'), width=4, height=3)
+    device.showpage()
+    with open(tmp_path / 'out.png', 'rb') as f:
+        assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+
+def test_svg_output(tmp_path):
+    import xml.etree.ElementTree as ET
+
+    device = SVGDevice(str(tmp_path / 'page-%d.svg'), width=100, height=100)
+    i = Interpreter(device=device)
+    i.run(Scanner(io.StringIO('''
+2 setlinewidth 1 0 0 setrgbcolor
+newpath 10 10 moveto 20 10 lineto 20 20 lineto 50 50 moveto 60 60 lineto stroke
+showpage
+newpath 0 0 moveto 1.5 1 lineto stroke
+showpage
+    ''')))
+    device.close()
+
+    paths = ET.parse(tmp_path / 'page-1.svg').getroot().iter('{http://www.w3.org/2000/svg}path')
+    assert [ (p.get('d'), p.get('stroke'), p.get('stroke-width')) for p in paths ] == [
+        ('M10 10 L20 10 L20 20 M50 50 L60 60', '#ff0000', '2'),
+    ]
+    paths = ET.parse(tmp_path / 'page-2.svg').getroot().iter('{http://www.w3.org/2000/svg}path')
+    assert [ p.get('d') for p in paths ] == ['M0 0 L1.5 1']
+
+def test_pdf_output(tmp_path):
+    output = tmp_path / 'out.pdf'
+    device = PDFDevice(str(output))
+    i = Interpreter(device=device)
+    i.run(Scanner(io.StringIO('newpath 10 10 moveto 20 10 lineto stroke showpage showpage')))
+    device.close()
+
+    data = output.read_bytes()
+    assert data.startswith(b'%PDF-1.4\n')
+    assert b'10 10 m\n20 10 l\nS\n' in data
+    assert b'/Count 2' in data
+
+    # every cross-reference entry should point at the object it's for
+    xref = int(re.search(rb'startxref\n(\d+)', data).group(1))
+    entries = data[xref:].split(b'\n')
+    count = int(entries[1].split()[1])
+    for number, entry in enumerate(entries[3:3 + count - 1], start=1):
+        offset = int(entry.split()[0])
+        assert data[offset:].startswith(f'{number} 0 obj'.encode())
+
+def test_gsave_grestore():
+    i, device = run_and_record('''
+newpath 0 0 moveto 10 0 lineto
+gsave
+  3 setlinewidth 1 0 0 setrgbcolor 10 10 lineto stroke
+grestore
+0 10 lineto stroke
+''')
+    assert device.strokes == [
+        ([(0, 0, 10, 0), (10, 0, 10, 10)], 3, (1, 0, 0)),
+        ([(0, 0, 10, 0), (10, 0, 0, 10)], 1.0, (0.0, 0.0, 0.0)),
+    ]
+    assert i.graphics_state_stack == []
+
+def test_gsave_shares_path_and_matrix():
+    i, _ = run_and_record('newpath 0 0 moveto 10 0 lineto 5 5 translate gsave')
+    saved = i.graphics_state_stack[-1]
+    shared_path = saved.path
+    assert i.graphics_state.path is shared_path
+    assert i.graphics_state.ctm is saved.ctm
+
+    # adding to the path after the gsave doesn't copy it, and grestore just drops the addition
+    i.run(Scanner(io.StringIO('1 1 lineto grestore')))
+    assert i.graphics_state is saved
+    assert saved.path is shared_path
+    assert saved.device_segments() == [(0, 0, 10, 0)]
+
+    i.run(Scanner(io.StringIO('2 2 lineto')))
+    assert saved.path is shared_path
+    assert saved.device_segments() == [(0, 0, 10, 0), (10, 0, 7.0, 7.0)]
+
+def test_grestore_without_gsave():
+    i, _ = run_and_record('2 setlinewidth grestore')
+    assert i.graphics_state.line_width == 2
+
+def test_translate_and_scale():
+    _, device = run_and_record('100 50 translate 2 3 scale newpath 0 0 moveto 1 1 lineto stroke')
+    assert device.strokes == [([(100, 50, 102, 53)], pytest.approx(6 ** 0.5), (0.0, 0.0, 0.0))]
+
+def test_rotate():
+    _, device = run_and_record('90 rotate newpath 0 0 moveto 10 0 lineto stroke')
+    (x0, y0, x1, y1), = device.strokes[0][0]
+    assert (x0, y0) == (0, 0)
+    assert (x1, y1) == (pytest.approx(0), pytest.approx(10))
+
+def test_matrix_change_mid_path():
+    i, device = run_and_record('newpath 10 10 moveto 10 0 translate currentpoint 20 10 lineto stroke')
+    assert [ v.value for v in i.operand_stack ] == [0, 10]
+    assert device.strokes[0][0] == [(10, 10, 30, 10)]
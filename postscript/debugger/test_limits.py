@@ -0,0 +1,82 @@
+import io
+
+import pytest
+
+from .interpreter import Interpreter, LimitCheck, Limits, Scanner
+
+def run(program, **limits):
+    i = Interpreter(limits=Limits(**limits))
+    i.run(Scanner(io.StringIO(program)))
+    return i
+
+def test_within_limits():
+    i = run('0 1 1 100 { add } for [ 1 2 3 ]', max_operations=1000, max_operand_stack=10, max_execution_stack=10, max_allocated=10, time_limit=10)
+    assert i.operand_stack[0].value == 5050
+    assert i.allocated == 3
+
+def test_max_operations():
+    with pytest.raises(LimitCheck, match='limitcheck: more than 1000 operations'):
+        run('1 1 1000000000 { pop } for', max_operations=1000)
+
+def test_max_operations_is_exact():
+    i = Interpreter(limits=Limits(max_operations=5000))
+    with pytest.raises(LimitCheck):
+        i.run(Scanner(io.StringIO('1 1 1000000000 { pop } for')))
+    assert i.operations == 5000
+
+def test_empty_loop_bodies_count():
+    with pytest.raises(LimitCheck):
+        run('1 1 1000000000 { } for', max_operations=1000)
+
+def test_literal_loop_bodies_are_checked():
+    with pytest.raises(LimitCheck, match='operand stack deeper than 100'):
+        run('1 1 1000000000 [ ] for', max_operand_stack=100)
+
+def test_max_operand_stack():
+    with pytest.raises(LimitCheck, match='operand stack deeper than 100'):
+        run('1 1 1 1000000000 { pop 1 copy } for', max_operand_stack=100)
+
+def test_a_single_copy_is_caught():
+    i = Interpreter(limits=Limits(max_operand_stack=100))
+    with pytest.raises(LimitCheck, match='operand stack deeper than 100'):
+        i.run(Scanner(io.StringIO('1 1 1 22 { pop count copy } for')))
+    # caught straight after the copy that went over, which at most doubles the stack
+    assert len(i.operand_stack) <= 200
+
+    i = Interpreter(limits=Limits(max_operand_stack=150))
+    i.run(Scanner(io.StringIO('1 1 100 { } for')))
+    with pytest.raises(LimitCheck):
+        i.run(Scanner(io.StringIO('100 copy')))
+    assert len(i.operand_stack) == 200
+
+def test_a_single_dict_is_caught():
+    i = Interpreter(limits=Limits(max_allocated=100))
+    with pytest.raises(LimitCheck, match='more than 100 array and dictionary elements'):
+        i.run(Scanner(io.StringIO('1 1 1000 { 1000000 dict pop } for')))
+    assert i.allocated == 1000000
+
+def test_max_execution_stack():
+    with pytest.raises(LimitCheck, match='execution stack deeper than 50'):
+        # not a tail call, so every call nests
+        run('/f { f 1 } def f', max_execution_stack=50)
+
+def test_max_allocated():
+    with pytest.raises(LimitCheck, match='more than 100 array and dictionary elements'):
+        run('1 1 1000 { [ 1 2 3 ] pop } for', max_allocated=100)
+    with pytest.raises(LimitCheck):
+        run('1000000000 dict', max_allocated=100)
+
+def test_time_limit():
+    with pytest.raises(LimitCheck, match='ran for more than'):
+        run('1 1 1000000000 { pop } for', time_limit=0.1)
+
+def test_limits_disable_compilation():
+    i = Interpreter(jit_threshold=1, limits=Limits(max_operations=1000))
+    with pytest.raises(LimitCheck):
+        i.run(Scanner(io.StringIO('/f { pop } def 1 1 1000000 { f } for')))
+
+def test_operations_accumulate_over_runs():
+    i = Interpreter(limits=Limits(max_operations=10))
+    i.run(Scanner(io.StringIO('1 2 3 4 5')))
+    with pytest.raises(LimitCheck):
+        i.run(Scanner(io.StringIO('6 7 8 9 10')))
@@ -0,0 +1,70 @@
+import io
+
+from .interpreter import Interpreter, Scanner, parse_program, symbols
+
+def run(program, i=None):
+    i = i or Interpreter()
+    i.run(Scanner(io.StringIO(program)))
+    return [ v.value for v in i.operand_stack ]
+
+def test_redefinition_in_a_loop():
+    assert run('/x 0 def 1 1 3 { pop x /x x 1 add def } for x') == [0, 1, 2, 3]
+
+def test_begin_and_end():
+    program = '''
+/f { x } def
+/x 1 def
+f
+1 dict begin /x 2 def f end
+f
+'''
+    assert run(program) == [1, 2, 1]
+
+def test_begin_a_dictionary_that_changed_while_it_was_off_the_stack():
+    program = '''
+/x 1 def
+/d 1 dict def
+d begin /x 2 def end
+/f { x } def
+f
+d begin f end
+f
+'''
+    assert run(program) == [1, 2, 1]
+
+def test_store():
+    program = '''
+/x 1 def
+/f { x } def
+1 dict begin
+  /x 2 store
+  f
+  currentdict /x known
+end
+f
+'''
+    assert run(program) == [2, False, 2]
+
+def test_cache_is_not_shared_between_interpreters():
+    # the same words run by two interpreters with different definitions
+    words = list(parse_program(Scanner('x')))
+    first = Interpreter()
+    run('/x 1 def', first)
+    second = Interpreter()
+    run('/x 2 def', second)
+
+    for _ in range(2):
+        first.run(words)
+        second.run(words)
+    assert [ v.value for v in first.operand_stack ] == [1, 1]
+    assert [ v.value for v in second.operand_stack ] == [2, 2]
+
+def test_lookups_are_cached():
+    i = Interpreter()
+    run('/x 1 def', i)
+    looked_up = []
+    look_up = i.look_up
+    i.look_up = lambda name: looked_up.append(name) or look_up(name)
+    run('1 1 10 { pop x } for', i)
+    # once each, not once per iteration
+    assert sorted(symbols.name(symbol) for symbol in looked_up) == ['for', 'pop', 'x']
@@ -0,0 +1,66 @@
+import io
+import threading
+
+from .interpreter import Interpreter, MemoryTracker, Scanner
+
+def track(program):
+    i = Interpreter()
+    tracker = MemoryTracker(i)
+    tracker.run(Scanner(io.StringIO(program)))
+    return i, tracker
+
+def test_stack_depth():
+    _, tracker = track('1 2 3\npop pop\n4')
+    assert tracker.stack_depths == {1: 2, 2: 3, 3: 1}
+    assert tracker.peak_stack_depth == 3
+    assert tracker.peak_stack_location == (1, 5)
+
+def test_allocations_by_type_and_operator():
+    _, tracker = track('[ 1 2 3 ] << /a 1 >> 2000 2000 add (s)')
+    assert tracker.allocations_by_type['ArrayValue'] == 1
+    assert tracker.allocations_by_type['DictionaryValue'] == 1
+    assert tracker.allocations_by_operator[']'] == 1
+    assert tracker.allocations_by_operator['>>'] == 1
+    # the sum is too big to be interned
+    assert tracker.allocations_by_operator['add'] == 1
+    # everything scanned from the program text
+    assert tracker.allocations_by_operator['(source)'] == 13
+
+def test_largest():
+    _, tracker = track('[ 1 2 ] pop\n[ 1 2 3 4 ]')
+    assert tracker.largest['ArrayValue'] == (4, (2, 11), ']')
+
+def test_definitions():
+    _, tracker = track('/a 1 def\n/b 2 def')
+    baseline = tracker.peak_definitions - 2
+    assert tracker.peak_definitions_location == (2, 6)
+    assert baseline > 0
+
+def test_hook_removed_afterwards():
+    from . import interpreter
+    track('1')
+    assert interpreter.allocation_hook.hook is None
+
+def test_other_threads_allocations_not_counted():
+    i = Interpreter()
+    tracker = MemoryTracker(i)
+    steps = tracker.execute(Scanner(io.StringIO('1 2 add')))
+    next(steps)
+
+    # the tracker's between steps here, so none of this is its interpreter's doing
+    def other():
+        Interpreter().run(Scanner(io.StringIO('[ 1 2 3 ] 5000 5000 add')))
+    thread = threading.Thread(target=other)
+    thread.start()
+    thread.join()
+
+    for _ in steps:
+        pass
+    assert tracker.allocations_by_type['ArrayValue'] == 0
+    assert tracker.allocations_by_operator['(source)'] == 3
+
+def test_report_lists_leftovers():
+    _, tracker = track('1 2\n(leak)')
+    report = '\n'.join(tracker.report())
+    assert 'peak depth 3 at line 2, column 1, 3 left at the end' in report
+    assert '(leak) at line 2, column 1' in report
@@ -0,0 +1,80 @@
+import io
+
+import pytest
+
+from .interpreter import Interpreter, Scanner, SuperinstructionValue
+
+def optimized_proc(program, **kwargs):
+    i = Interpreter(optimize=True, **kwargs)
+    i.run(Scanner(io.StringIO(program)))
+    return i.operand_stack[-1]
+
+def test_constant_folding():
+    proc = optimized_proc('{ 2 3 add 4 mul 1 sub }')
+    assert [ v.value for v in proc ] == [19]
+
+def test_constant_folding_keeps_source_span():
+    proc = optimized_proc('{ 2 3 add }')
+    folded, = proc.value
+    assert (folded.line, folded.column, folded.length) == (1, 3, 7)
+
+def test_tagged_literals_are_not_folded():
+    proc = optimized_proc('{ 2 %tag two\n 3 add }')
+    assert len(proc.value) == 2
+    assert proc.value[0].tag == 'two'
+
+def test_redundant_pairs_removed():
+    proc = optimized_proc('{ 1 2 exch exch dup pop }')
+    assert [ v.value for v in proc ] == [1, 2]
+
+def test_redundant_pairs_kept_if_they_might_underflow():
+    proc = optimized_proc('{ 1 exch exch dup pop }')
+    assert [ v.__ps_repr__() for v in proc ] == ['1', '/exch', '/exch']
+
+    i = Interpreter(optimize=True)
+    with pytest.raises(AssertionError, match='underflow'):
+        i.run(Scanner(io.StringIO('{ exch exch } exec')))
+    with pytest.raises(AssertionError, match='underflow'):
+        i.run(Scanner(io.StringIO('clear { dup pop } exec')))
+
+def test_superinstructions():
+    proc = optimized_proc('{ 3 1 roll 2 index mul 1 sub }')
+    assert all(isinstance(v, SuperinstructionValue) for v in proc.value)
+    assert [ v.__ps_repr__() for v in proc.value ] == ['3 1 --roll--', '2 --index-- --mul--', '1 --sub--']
+
+def test_superinstruction_location():
+    proc = optimized_proc('{\n  3 1 roll\n}')
+    roll, = proc.value
+    assert (roll.line, roll.column, roll.length) == (2, 3, 8)
+
+def test_nested_procedures_are_optimized():
+    proc = optimized_proc('{ { 1 1 add } }')
+    assert [ v.value for v in proc.value[0] ] == [2]
+
+def test_redefined_operators_are_left_alone():
+    proc = optimized_proc('/add { sub } def { 2 3 add }')
+    assert [ v.__ps_repr__() for v in proc.value ] == ['2', '3', '/add']
+
+    # and the redefinition doesn't leak into other interpreters
+    proc = optimized_proc('{ 2 3 add }')
+    assert [ v.value for v in proc ] == [5]
+
+def stack_after_error(program, **kwargs):
+    i = Interpreter(**kwargs)
+    with pytest.raises(Exception) as error:
+        i.run(Scanner(io.StringIO(program)))
+    return str(error.value), [ v.__ps_repr__() for v in i.operand_stack ]
+
+@pytest.mark.parametrize('program', [
+    '/f { 4 add 5 } def f',
+    '/f { true 5 mul } def f',
+    '/f { (x) 1 index sub } def 1 f',
+    '/f { 1 exch 1 index add } def (x) f',
+    '/f { 3 index add } def 1 2 f',
+])
+def test_superinstruction_errors_leave_the_same_stack(program):
+    i = Interpreter(optimize=True)
+    i.run(Scanner(io.StringIO(program.split(' def ')[0] + ' def')))
+    assert any(isinstance(v, SuperinstructionValue) for v in i.look_up('f').value)
+
+    assert stack_after_error(program, optimize=True) == stack_after_error(program)
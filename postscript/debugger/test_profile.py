@@ -0,0 +1,57 @@
+import io
+
+from .interpreter import Interpreter, Profiler, Scanner
+
+PROGRAM = '''
+/inner { 1 add } def
+/outer { inner inner } def
+0
+outer
+1 1 3 { pop outer } for
+'''
+
+def profile(program):
+    i = Interpreter()
+    profiler = Profiler(i)
+    profiler.run(Scanner(io.StringIO(program)))
+    return i, profiler
+
+def test_counts_calls():
+    i, profiler = profile(PROGRAM)
+    assert [ v.value for v in i.operand_stack ] == [8]
+    assert profiler.calls['outer'] == 4
+    assert profiler.calls['inner'] == 8
+    assert profiler.calls['add'] == 8
+    assert profiler.calls['for'] == 1
+    assert profiler.calls['(top level)'] == 1
+
+def test_cumulative_includes_callees():
+    _, profiler = profile(PROGRAM)
+    assert profiler.cumulative['outer'] >= profiler.cumulative['inner'] >= profiler.cumulative['add']
+    assert profiler.cumulative['for'] >= profiler.self_time['for']
+    assert profiler.cumulative['(top level)'] == sum(profiler.self_time.values())
+
+def test_tail_call_stays_in_callee():
+    _, profiler = profile(PROGRAM)
+    # inner's add is its last word, so inner's frame is gone by the time add runs
+    assert ('(top level)', 'outer', 'inner', 'add') in profiler.stacks
+    assert ('(top level)', 'for', 'outer', 'inner', 'add') in profiler.stacks
+    assert ('(top level)', 'add') not in profiler.stacks
+
+def test_recursion_counted_once():
+    _, profiler = profile('/down { dup 0 eq { pop } { 1 sub down } ifelse } def 5 down')
+    assert profiler.calls['down'] == 6
+    assert profiler.cumulative['down'] <= profiler.cumulative['(top level)']
+
+def test_locations():
+    _, profiler = profile('1 2\nadd\n3 mul')
+    assert set(profiler.locations) == {(2, 1), (3, 3)}
+
+def test_collapsed_stacks():
+    _, profiler = profile(PROGRAM)
+    f = io.StringIO()
+    profiler.write_collapsed_stacks(f)
+    for line in f.getvalue().splitlines():
+        stack, count = line.rsplit(' ', 1)
+        assert stack.startswith('(top_level)')
+        assert int(count) > 0
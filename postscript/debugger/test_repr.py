@@ -0,0 +1,28 @@
+import io
+
+from .interpreter import ArrayValue, IntegerValue, Interpreter, Scanner, integer_value, truncated_repr
+
+def stack_after(program):
+    i = Interpreter()
+    for _ in i.execute(Scanner(io.StringIO(program))):
+        pass
+    return i.operand_stack
+
+def test_matches_ps_repr():
+    for v in stack_after('1 (str) /name { 1 { 2 } add } [ ] [ 1 [ 2 ] ] << /a 1 /b [ 2 ] >> << >> true'):
+        assert truncated_repr(v, 100) == v.__ps_repr__()
+
+def test_truncates():
+    v, = stack_after('[ 1 2 3 4 5 ]')
+    assert truncated_repr(v, 13) == '[ 1 2 3 4 5 ]'
+    assert truncated_repr(v, 12) == '[ 1 2 3 4 5…'
+    assert truncated_repr(v, 3) == '[ …'
+
+def test_large_arrays_are_not_rendered_in_full():
+    class Exploding(IntegerValue):
+        def __ps_repr__(self):
+            raise AssertionError('rendered in full')
+
+    big = ArrayValue(value=[ integer_value(n % 10) for n in range(1_000_000) ])
+    nested = ArrayValue(value=[big, Exploding(value=0)])
+    assert truncated_repr(nested, 20) == '[ [ 0 1 2 3 4 5 6 7…'
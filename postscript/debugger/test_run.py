@@ -0,0 +1,109 @@
+import io
+import os
+
+import pytest
+
+from .interpreter import Interpreter, Scanner, compile_procedure
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), '..')
+
+def step_and_gather(program):
+    i = Interpreter()
+    output_lines = []
+    i.print = output_lines.append
+
+    for _ in i.execute(Scanner(io.StringIO(program))):
+        pass
+
+    return [ v.__ps_repr__() for v in i.operand_stack ], output_lines
+
+def run_and_gather(program, **kwargs):
+    i = Interpreter(**kwargs)
+    output_lines = []
+    i.print = output_lines.append
+
+    i.run(Scanner(io.StringIO(program)))
+
+    return [ v.__ps_repr__() for v in i.operand_stack ], output_lines
+
+PROGRAMS = [
+    '1 1 4 { 1 sub } for',
+    '{ 3 } exec',
+    '/pushthree { 3 } def pushthree pushthree add',
+    'true { (true) } { (false) } ifelse false { (true) } { (false) } ifelse',
+    'false { (true) } if true { 1 { 2 } exec } if',
+    '0 1 1 3 { 0 1 2 { add } for } for pstack',
+    '/kindapop { %args second first\n  ptags pop\n} def\n1 %tag one\n2 %tag two\nkindapop ptags',
+    '1 2 3 4 5 { 3 1 roll 2 index exch 2 copy pop pop 4 -1 roll dup mul } bind exec',
+    '{ 1 0.5 add 2 mul 7 sub 10 2 1 roll } bind exec',
+    '{ 1 2 3 true { 3 copy } { 0 index } ifelse false { pop } if } bind exec count',
+    '{ 0 1 1 5 { { add } exec } for 10 -2 0 { } for } bind exec',
+    '/down { dup 0 eq { } { dup 1 sub down 0 add } ifelse } bind def 300 down count',
+]
+
+JIT_CONFIGURATIONS = [
+    {'jit_threshold': 1},
+    {'jit_threshold': 1, 'bind_procs': True},
+    {'jit_threshold': 3, 'bind_procs': True},
+    {'jit_threshold': 1, 'optimize': True},
+]
+
+OPTIMIZER_CONFIGURATIONS = [
+    {'optimize': True},
+    {'optimize': True, 'bind_procs': True},
+]
+
+@pytest.mark.parametrize('program', PROGRAMS)
+def test_run_matches_execute(program):
+    assert run_and_gather(program) == step_and_gather(program)
+
+@pytest.mark.parametrize('program', PROGRAMS)
+@pytest.mark.parametrize('config', JIT_CONFIGURATIONS)
+def test_jit_matches_execute(program, config):
+    assert run_and_gather(program, **config) == step_and_gather(program)
+
+@pytest.mark.parametrize('program', PROGRAMS)
+@pytest.mark.parametrize('config', OPTIMIZER_CONFIGURATIONS)
+def test_optimizer_matches_execute(program, config):
+    assert run_and_gather(program, **config) == step_and_gather(program)
+
+@pytest.mark.parametrize('filename', ['drawcell.ps', 'grid.ps', 'hello.ps', 'squares.ps'])
+def test_run_examples(filename):
+    with open(os.path.join(EXAMPLES_DIR, filename)) as f:
+        program = f.read()
+    assert run_and_gather(program) == step_and_gather(program)
+    for config in JIT_CONFIGURATIONS + OPTIMIZER_CONFIGURATIONS:
+        assert run_and_gather(program, **config) == step_and_gather(program)
+
+def test_jit_compiles_hot_procedures():
+    i = Interpreter(jit_threshold=2, bind_procs=True)
+    i.run(Scanner(io.StringIO('/sq { dup mul } def 3 sq sq 2 sq')))
+    assert [ v.value for v in i.operand_stack ] == [81, 4]
+    assert i.look_up('sq').compiled is not None
+
+def test_jit_type_mismatch():
+    i = Interpreter(jit_threshold=1, bind_procs=True)
+    with pytest.raises(AssertionError, match='got StringValue'):
+        i.run(Scanner(io.StringIO('{ (one) 1 add } exec')))
+
+def run_until_error(program, **kwargs):
+    i = Interpreter(**kwargs)
+    with pytest.raises(AssertionError) as error:
+        i.run(Scanner(io.StringIO(program)))
+    return [ v.__ps_repr__() for v in i.operand_stack ], str(error.value)
+
+@pytest.mark.parametrize('program', [
+    '1 { 2 (x) add } exec',
+    '(s) { 1 exch { 1 } if } exec',
+    '1 (x) { 3 -1 roll } exec',
+    '{ 1 40 copy } exec',
+    '{ 1 2 5 index } exec',
+    '1 { 2 exch exch pop pop pop } exec',
+])
+def test_jit_errors_leave_the_same_stack(program):
+    assert run_until_error(program, jit_threshold=1, bind_procs=True) == run_until_error(program)
+
+def test_jit_leaves_big_rolls_to_the_operator():
+    i = Interpreter(jit_threshold=1, bind_procs=True)
+    i.run(Scanner(io.StringIO('{ 1000 1 roll 1000 copy } bind')))
+    assert len(compile_procedure(i.operand_stack[-1]).source.splitlines()) < 20
@@ -1,8 +1,11 @@
-import dataclasses
+import gc
 import io
+import weakref
 
-from .interpreter import IntegerValue, NameValue, RealValue
-from .interpreter import Scanner
+import pytest
+
+from .interpreter import ImmediateNameValue, IntegerValue, NameValue, RealValue, StringValue
+from .interpreter import Interpreter, Scanner
 
 EXAMPLES = [
     ('/foo', NameValue(value='foo')),
@@ -12,14 +15,15 @@ EXAMPLES = [
     ('/Times-Roman', NameValue(value='Times-Roman')),
 ]
 
+def describe(v):
+    return (type(v), v.value, v.executable, v.line, v.column, v.length, v.tag)
+
 def test_scans():
     for program, expected_value in EXAMPLES:
-        expected_value.line = 1
-        expected_value.column = 1
-        expected_value.length = len(program)
+        expected_value = type(expected_value)(value=expected_value.value, line=1, column=1, length=len(program))
 
         got_values = list(Scanner(io.StringIO(program)))
-        assert [ dataclasses.asdict(v) for v in got_values ] == [ dataclasses.asdict(expected_value) ]
+        assert [ describe(v) for v in got_values ] == [ describe(expected_value) ]
 
 def test_dictionary():
     got_values = list(Scanner(io.StringIO('<< /south true /west true /east true >>')))
@@ -34,7 +38,7 @@ def test_dictionary():
         NameValue(value='>>', line=1, column=38, length=2, executable=True),
     ]
 
-    assert [ dataclasses.asdict(v) for v in got_values ] == [ dataclasses.asdict(v) for v in expected_values ]
+    assert [ describe(v) for v in got_values ] == [ describe(v) for v in expected_values ]
 
 def test_array():
     got_values = list(Scanner(io.StringIO('[ /foo 17 ]')))
@@ -45,4 +49,109 @@ def test_array():
         NameValue(value=']', line=1, column=11, length=1, executable=True),
     ]
 
-    assert [ dataclasses.asdict(v) for v in got_values ] == [ dataclasses.asdict(v) for v in expected_values ]
+    assert [ describe(v) for v in got_values ] == [ describe(v) for v in expected_values ]
+
+def test_values_are_compact():
+    v, = Scanner(io.StringIO('17'))
+    assert not hasattr(v, '__dict__')
+    assert (v.line, v.column, v.length) == (1, 1, 2)
+
+def test_locations_are_freed_with_the_program():
+    i = Interpreter(bind_procs=True, optimize=True)
+    i.run(Scanner(io.StringIO('/sq { dup mul 1 2 add } def 3 sq')))
+    source = i.look_up('sq').source
+    # 11 tokens, the procedure, and the span of the folded `1 2 add` - binding reuses the names'
+    # locations rather than adding its own
+    assert len(source.lines) == 13
+
+    source = weakref.ref(source)
+    del i
+    gc.collect()
+    assert source() is None
+
+def scan(program):
+    return [ describe(v)[:3] for v in Scanner(io.StringIO(program)) ]
+
+def test_numbers():
+    assert scan('-17 +3 1.5 -.5 6. 1e3 2.5E-1 16#FF 2#101') == [
+        (IntegerValue, -17, False),
+        (IntegerValue, 3, False),
+        (RealValue, 1.5, False),
+        (RealValue, -0.5, False),
+        (RealValue, 6.0, False),
+        (RealValue, 1000.0, False),
+        (RealValue, 0.25, False),
+        (IntegerValue, 255, False),
+        (IntegerValue, 5, False),
+    ]
+
+def test_number_like_names():
+    assert scan('1abc 1.2.3 37#1') == [
+        (NameValue, '1abc', True),
+        (NameValue, '1.2.3', True),
+        (NameValue, '37#1', True),
+    ]
+
+def test_names():
+    assert scan('/Times-Roman == show //add') == [
+        (NameValue, 'Times-Roman', False),
+        (NameValue, '==', True),
+        (NameValue, 'show', True),
+        (ImmediateNameValue, 'add', False),
+    ]
+
+def test_delimiters_without_whitespace():
+    got_values = list(Scanner(io.StringIO('{1 2 add}[/a(b)]<<>>')))
+    assert [ (type(v).__name__, v.value, v.column, v.length) for v in got_values ] == [
+        ('StartProcValue', None, 1, 1),
+        ('IntegerValue', 1, 2, 1),
+        ('IntegerValue', 2, 4, 1),
+        ('NameValue', 'add', 6, 3),
+        ('EndProcValue', None, 9, 1),
+        ('NameValue', '[', 10, 1),
+        ('NameValue', 'a', 11, 2),
+        ('StringValue', 'b', 13, 3),
+        ('NameValue', ']', 16, 1),
+        ('NameValue', '<<', 17, 2),
+        ('NameValue', '>>', 19, 2),
+    ]
+
+def test_strings():
+    assert scan(r'(a (nested) string) (esc\)\n\101\\) (x%y)') == [
+        (StringValue, 'a (nested) string', False),
+        (StringValue, 'esc)\nA\\', False),
+        (StringValue, 'x%y', False),
+    ]
+
+def test_multi_line_string():
+    got_values = list(Scanner(io.StringIO('(one\ntwo) 1 %tag one\n  2')))
+    assert [ (v.value, v.line, v.column, v.tag) for v in got_values ] == [
+        ('one\ntwo', 1, 1, None),
+        (1, 2, 6, 'one'),
+        (2, 3, 3, None),
+    ]
+
+def test_hex_and_ascii85_strings():
+    assert scan('<48 65 6c6c6f> <7> <~87cURDZ~>') == [
+        (StringValue, 'Hello', False),
+        (StringValue, 'p', False),
+        (StringValue, 'Hello', False),
+    ]
+
+def test_bytes_buffer():
+    got_values = list(Scanner(b'/foo 17\n(bar) %tag t'))
+    assert [ (v.value, v.line, v.column, v.tag) for v in got_values ] == [
+        ('foo', 1, 1, None),
+        (17, 1, 6, None),
+        ('bar', 2, 1, 't'),
+    ]
+
+def test_iterable_of_lines():
+    expected = [ describe(v) for v in Scanner('1 2 add\n(x) =\n') ]
+    assert [ describe(v) for v in Scanner(['1 2 add\n', '(x) =\n']) ] == expected
+    assert [ describe(v) for v in Scanner([b'1 2 add\n', b'(x) =\n']) ] == expected
+
+def test_syntax_errors():
+    for program in ['(unterminated', '<4', '1 )', '>']:
+        with pytest.raises(SyntaxError):
+            list(Scanner(io.StringIO(program)))
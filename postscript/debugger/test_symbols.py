@@ -0,0 +1,55 @@
+import gc
+import io
+
+import pytest
+
+from .interpreter import Interpreter, NameValue, Scanner, StringValue, Symbol, dictionary_key, symbols
+
+def test_names_are_interned():
+    first, second = Scanner(io.StringIO('dup /dup'))
+    assert first.symbol == second.symbol == symbols.intern('dup')
+    assert first.value is second.value
+    assert symbols.name(first.symbol) == 'dup'
+
+def test_names_and_strings_are_the_same_key():
+    assert dictionary_key(NameValue(value='south')) == dictionary_key(StringValue(value='south')) == symbols.intern('south')
+
+def test_dictionaries_are_keyed_by_symbol():
+    i = Interpreter()
+    i.run(Scanner(io.StringIO('<< /south 1 (east) 2 3 4 >>')))
+    d, = i.operand_stack
+    assert [ k for k in d.value if isinstance(k, Symbol) ] == [symbols.intern('south'), symbols.intern('east')]
+    assert d.__ps_repr__() == '<< /south 1 /east 2 3 4 >>'
+
+    i.run(Scanner(io.StringIO('dup /east get exch (south) known')))
+    assert [ v.value for v in i.operand_stack ] == [2, True]
+
+def test_undefined_names_are_reported_by_name():
+    i = Interpreter()
+    with pytest.raises(KeyError, match='nowhere'):
+        i.run(Scanner(io.StringIO('nowhere')))
+    with pytest.raises(KeyError, match='nothing'):
+        i.run(Scanner(io.StringIO('<< /south 1 >> /nothing get')))
+
+def test_looking_up_strings_does_not_intern_them():
+    i = Interpreter()
+    i.run(Scanner(io.StringIO('<< /south 1 >> dup (never defined) known exch (south) known')))
+    assert [ v.value for v in i.operand_stack ] == [False, True]
+    assert 'never defined' not in symbols.by_name
+
+    i.run(Scanner(io.StringIO('(now defined) 3 def')))
+    assert i.look_up('now defined').value == 3
+
+def test_symbols_go_with_the_interpreters_using_them():
+    def run_one(n):
+        i = Interpreter()
+        i.run(Scanner(io.StringIO(f'/only_in_{n} 1 def (also_only_in_{n}) only_in_{n} def')))
+
+    run_one(0)
+    gc.collect()
+    before = len(symbols)
+    for n in range(1, 100):
+        run_one(n)
+    gc.collect()
+    assert len(symbols) == before
+    assert 'only_in_1' not in symbols.by_name
@@ -1,12 +1,12 @@
 import io
 
-from .interpreter import Interpreter, Scanner
+from .interpreter import Interpreter, OperandStack, Scanner, TaggedOperandStack
 
 def run_and_gather_tags(program):
     i = Interpreter()
     for _ in i.execute(Scanner(io.StringIO(program))):
         pass
-    return [ v.tag for v in i.operand_stack ]
+    return [ i.operand_stack.tag(k) for k in range(len(i.operand_stack)) ]
 
 def test_no_tag():
     program = '1'
@@ -50,6 +50,39 @@ def test_space_provides_no_tag():
     tags = run_and_gather_tags(program)
     assert tags == ['one']
 
+def test_dup_keeps_tag():
+    program = '1 %tag one\ndup'
+    tags = run_and_gather_tags(program)
+    assert tags == ['one', 'one']
+
+def test_exch_and_roll_move_tags():
+    program = '''
+1 %tag one
+2 %tag two
+3 %tag three
+exch
+3 1 roll
+    '''
+    tags = run_and_gather_tags(program)
+    assert tags == ['two', 'one', 'three']
+
+def test_created_values_have_no_tag():
+    program = '1 %tag one\n2 %tag two\nadd'
+    tags = run_and_gather_tags(program)
+    assert tags == [None]
+
+def test_untagged_program_uses_plain_stack():
+    i = Interpreter()
+    for _ in i.execute(Scanner(io.StringIO('1 2 add dup'))):
+        pass
+    assert type(i.operand_stack) is OperandStack
+
+def test_tagged_program_uses_tagged_stack():
+    i = Interpreter()
+    for _ in i.execute(Scanner(io.StringIO('1 %tag one'))):
+        pass
+    assert type(i.operand_stack) is TaggedOperandStack
+
 _comment='''
   - if a word is executed and does *not* have a tag…
     - if the stack isn't altered, nothing happens (obviously)
@@ -65,3 +98,21 @@ _comment='''
     - if a value is created…
   - look at those http://tunes.org/~iepos/joy.html things
 '''
+
+def test_tags_survive_a_second_run_with_the_jit():
+    program = '/f { %args x\n  { dup } exec ptags clear\n} def\n1 f'
+    i = Interpreter(jit_threshold=1, bind_procs=True)
+    output = []
+    i.print = output.append
+    i.run(Scanner(io.StringIO(program)))
+    i.run(Scanner(io.StringIO(program)))
+    assert output == ['x', 'x', 'x', 'x']
+
+def test_optimized_index_keeps_tags():
+    program = '/g { %args a b\n 1 index ptags } def 1 2 g'
+    for optimize in (False, True):
+        i = Interpreter(optimize=optimize)
+        output = []
+        i.print = output.append
+        i.run(Scanner(io.StringIO(program)))
+        assert output == ['a', 'b', 'a'], optimize
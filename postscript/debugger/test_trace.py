@@ -0,0 +1,84 @@
+import io
+
+from .interpreter import Interpreter, Scanner, Trace, TraceRecorder
+
+PROGRAM = '''/square { dup mul } def
+1 1 5 { square } for
+(done) =
+add add add add
+'''
+
+def record(program, interval=4096):
+    f = io.BytesIO()
+    i = Interpreter()
+    printed = []
+    i.print = printed.append
+    TraceRecorder(i, f, interval=interval, source_filename='test.ps').run(Scanner(io.StringIO(program)))
+    f.seek(0)
+    return Trace.read(f), printed
+
+def live_stacks(program):
+    '''
+    The operand stack before every step and after the last, from running program for real
+    '''
+    i = Interpreter()
+    i.print = lambda value: None
+    stacks = []
+    for _ in i.execute(Scanner(io.StringIO(program))):
+        stacks.append([ v.__ps_repr__() for v in i.operand_stack ])
+    stacks.append([ v.__ps_repr__() for v in i.operand_stack ])
+    return stacks
+
+def test_locations():
+    trace, _ = record('1 2\nadd')
+    assert trace.steps == 3
+    assert [ trace.location(s) for s in range(3) ] == [(1, 1, 1), (1, 3, 1), (2, 1, 3)]
+    assert trace.source_filename == 'test.ps'
+
+def test_stacks_match_a_live_run():
+    expected = live_stacks(PROGRAM)
+    for interval in (1, 3, 4096):
+        trace, _ = record(PROGRAM, interval=interval)
+        assert [ trace.stack(s) for s in range(trace.steps + 1) ] == expected
+
+def test_stepping_backwards():
+    trace, _ = record(PROGRAM, interval=4)
+    forwards = [ trace.stack(s) for s in range(trace.steps + 1) ]
+    backwards = [ trace.stack(s) for s in range(trace.steps, -1, -1) ]
+    assert backwards == forwards[::-1]
+    assert forwards[-1] == ['55']
+
+def test_checkpoints_share_structure():
+    trace, _ = record('1 2 3\n' + '4 pop\n' * 10, interval=4)
+    assert len(trace.checkpoints) == 6
+    # 1 2 3 never move, so every checkpoint shares them with the first one that has them
+    bottom = trace.checkpoints[1][1]
+    assert trace.stack(4) == ['1', '2', '3', '4']
+    for checkpoint in trace.checkpoints[2:]:
+        assert checkpoint[1] is bottom
+
+def test_output():
+    trace, printed = record(PROGRAM)
+    assert printed == ['done']
+    step = next(s for s in range(trace.steps) if trace.location(s)[:2] == (3, 8))
+    assert trace.output_before(step) == []
+    assert trace.output_before(step + 1) == ['done']
+
+def test_moving_repeated_values():
+    # dup'd and interned values look just the same in their old and new places, so the recorder
+    # can't tell what moved by looking at the stack
+    for program in ('0 1 1 3 { dup } for 3 -1 roll', '1 1 1 2 exch', '1 2 1 2 2 1 roll 4 2 roll clear 7'):
+        expected = live_stacks(program)
+        for interval in (1, 4096):
+            trace, _ = record(program, interval=interval)
+            assert [ trace.stack(s) for s in range(trace.steps + 1) ] == expected, program
+
+def test_procedures_are_printed_as_they_were():
+    trace, _ = record('{ 1 2 add } dup bind')
+    assert trace.stack(trace.steps) == ['{ 1 2 --add-- }', '{ 1 2 --add-- }']
+    assert trace.stack(2) == ['{ 1 2 /add }', '{ 1 2 /add }']
+
+def test_only_procedures_are_kept():
+    recorder = TraceRecorder(Interpreter(), io.BytesIO())
+    recorder.run(Scanner(io.StringIO('1 1 100 { [ exch ] pop } for')))
+    assert [ v.__ps_repr__() for v, _ in recorder.proc_strings.values() ] == ['{ /[ /exch /] /pop }']